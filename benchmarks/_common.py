@@ -0,0 +1,24 @@
+"""Helpers shared by the benchmark scripts."""
+
+import fanoutqa
+
+
+def walk_subquestions(subqs):
+    """Yield each subquestion in a decomposition, depth first."""
+    for subq in subqs:
+        yield subq
+        yield from walk_subquestions(subq.decomposition)
+
+
+def subquestion_texts(q) -> list[str]:
+    """The text of each subquestion in the question's decomposition, or the question itself if it has none."""
+    return [subq.question for subq in walk_subquestions(q.decomposition)] or [q.question]
+
+
+def dev_queries() -> list[str]:
+    """The top-level questions and human-written subquestions of the dev set."""
+    queries = []
+    for q in fanoutqa.load_dev():
+        queries.append(q.question)
+        queries.extend(subq.question for subq in walk_subquestions(q.decomposition))
+    return queries
@@ -0,0 +1,145 @@
+"""
+Measure how closely the lookup-table normalize engine agrees with the default spaCy engine on the dev set, and how much
+faster it is.
+
+This reports:
+
+- the speed of ``normalize_many`` with each engine over the dev set's texts
+- token-level agreement: the fraction of normalized tokens that are the same under both engines, and the lemmas the
+  engines disagree on most often
+- accuracy-metric agreement: how often ``answer_in_text`` gives the same result under both engines
+
+The texts are the dev set's questions, subquestions, and answers, plus the evidence pages of the first N questions with
+--evidence N. The accuracy metric is computed for each dev question's reference answer against the answers given in
+--answers (a JSON file of ``{"id": ..., "answer": ...}`` objects, as submitted for scoring); without it, each question's
+subquestion answers, joined together, are used as the candidate answer.
+
+Usage: python benchmarks/normalize_agreement.py [--evidence N] [--answers FILE] [-o report.json]
+"""
+
+import argparse
+import collections
+import difflib
+import json
+import time
+
+from _common import walk_subquestions
+
+import fanoutqa
+from fanoutqa.eval.string import answer_in_text
+from fanoutqa.eval.utils import str_answer
+from fanoutqa.norm import normalize_many, set_normalize_cache, set_normalize_engine
+from fanoutqa.retrieval import chunk_text
+from fanoutqa.wiki import wiki_content
+
+ENGINES = ("spacy", "lookup")
+
+
+def dev_texts(questions, n_evidence: int) -> list[str]:
+    texts = []
+    for q in questions:
+        texts.append(q.question)
+        texts.append(str_answer(q.answer))
+        for subq in walk_subquestions(q.decomposition):
+            texts.append(subq.question)
+            texts.append(str_answer(subq.answer))
+    for q in questions[:n_evidence]:
+        for doc in q.necessary_evidence:
+            texts.extend(chunk_text(wiki_content(doc), 1024))
+    return texts
+
+
+def default_answers(questions) -> dict:
+    return {q.id: " ".join(str_answer(subq.answer) for subq in walk_subquestions(q.decomposition)) for q in questions}
+
+
+def time_engine(engine: str, texts: list[str]) -> tuple[list[str], float]:
+    # time the engine itself, not lookups in the normalize cache from an earlier run
+    set_normalize_cache(None)
+    set_normalize_engine(engine)
+    normalize_many(texts[:10])  # load the pipeline before timing
+    start = time.perf_counter()
+    normalized = normalize_many(texts)
+    return normalized, time.perf_counter() - start
+
+
+def token_agreement(a: list[str], b: list[str], disagreements: collections.Counter) -> tuple[int, int]:
+    """Return the number of matching tokens and the number of tokens in the longer sequence, and count the
+    substituted tokens."""
+    matcher = difflib.SequenceMatcher(a=a, b=b, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "replace":
+            disagreements[(" ".join(a[i1:i2]), " ".join(b[j1:j2]))] += 1
+    return sum(block.size for block in matcher.get_matching_blocks()), max(len(a), len(b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--evidence", type=int, default=0, help="also normalize the evidence of the first N questions")
+    parser.add_argument("--answers", help="a JSON file of generated answers to compute accuracy agreement on")
+    parser.add_argument("-o", "--output", default="normalize-agreement.json", help="where to write the report")
+    args = parser.parse_args()
+
+    questions = fanoutqa.load_dev()
+    texts = dev_texts(questions, args.evidence)
+    if args.answers:
+        with open(args.answers) as f:
+            answers = {a["id"]: a["answer"] for a in json.load(f)}
+    else:
+        answers = default_answers(questions)
+    scored_questions = [q for q in questions if q.id in answers]
+
+    # speed and token agreement
+    normalized = {}
+    speed = {}
+    for engine in ENGINES:
+        normalized[engine], elapsed = time_engine(engine, texts)
+        speed[engine] = {"seconds": elapsed, "chars_per_second": sum(map(len, texts)) / elapsed}
+    speed["speedup"] = speed["spacy"]["seconds"] / speed["lookup"]["seconds"]
+
+    disagreements = collections.Counter()
+    n_matching = n_tokens = n_exact = 0
+    for a, b in zip(normalized["spacy"], normalized["lookup"]):
+        matching, total = token_agreement(a.split(), b.split(), disagreements)
+        n_matching += matching
+        n_tokens += total
+        n_exact += a == b
+
+    # accuracy metric agreement
+    acc = {}
+    for engine in ENGINES:
+        set_normalize_engine(engine)
+        acc[engine] = [answer_in_text(q.answer, answers[q.id]) for q in scored_questions]
+    set_normalize_engine("spacy")
+    n_found_agree = sum(a.found == b.found for a, b in zip(acc["spacy"], acc["lookup"]))
+    n_score_agree = sum(a.score == b.score for a, b in zip(acc["spacy"], acc["lookup"]))
+    n_scored = len(scored_questions)
+
+    report = {
+        "n_texts": len(texts),
+        "speed": speed,
+        "tokens": {
+            "n_tokens": n_tokens,
+            "agreement": n_matching / n_tokens if n_tokens else 1,
+            "exact_text_agreement": n_exact / len(texts) if texts else 1,
+            "top_disagreements": [
+                {"spacy": a, "lookup": b, "count": count} for (a, b), count in disagreements.most_common(25)
+            ],
+        },
+        "accuracy": {
+            "n_questions": n_scored,
+            "found_agreement": n_found_agree / n_scored if n_scored else 1,
+            "score_agreement": n_score_agree / n_scored if n_scored else 1,
+            "mean_score": {
+                engine: sum(r.score for r in results) / n_scored if n_scored else 0 for engine, results in acc.items()
+            },
+        },
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in report.items() if k != "tokens"}, indent=2))
+    print(f"token agreement: {report['tokens']['agreement']:.4%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Measure the memory used by a NormalizePool as the number of workers grows, against the same number of independent
+worker processes that each load their own spaCy pipeline. Linux only (reads /proc/<pid>/smaps_rollup).
+
+Memory is reported as the total proportional set size (PSS) of the parent and its workers: pages shared between
+processes are split evenly between them, so the total counts shared memory once.
+
+Usage: python benchmarks/normalize_pool.py [--workers 1 2 4 8]
+"""
+
+import argparse
+import multiprocessing
+import multiprocessing.pool
+import os
+import time
+
+import fanoutqa
+from fanoutqa import norm
+from fanoutqa.norm_pool import NormalizePool
+
+
+def pss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1])
+    return 0
+
+
+def total_pss_mb(pool: multiprocessing.pool.Pool) -> float:
+    """The total PSS of this process and the given pool's workers."""
+    pids = [os.getpid()] + [p.pid for p in pool._pool]
+    return sum(pss_kb(pid) for pid in pids) / 1024
+
+
+def _independent_worker(texts):
+    return norm.normalize_many(texts)
+
+
+def _independent_init():
+    norm.set_normalize_cache(None)
+
+
+def dev_texts() -> list[str]:
+    texts = []
+    for q in fanoutqa.load_dev():
+        texts.append(q.question)
+        texts.extend(str(ev.title) for ev in q.necessary_evidence)
+    return texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    texts = dev_texts()
+    batches = [texts[i : i + 64] for i in range(0, len(texts), 64)]
+    norm.set_normalize_cache(None)
+    print(f"{'workers':>8} {'pool MB':>10} {'pool s':>8} {'independent MB':>15} {'independent s':>14}")
+    for n in args.workers:
+        with NormalizePool(processes=n) as pool:
+            start = time.perf_counter()
+            norm.normalize_many(texts)
+            pool_time = time.perf_counter() - start
+            pool_mb = total_pss_mb(pool._pool)
+
+        # each spawned worker loads its own pipeline
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(n, initializer=_independent_init) as independent:
+            start = time.perf_counter()
+            independent.map(_independent_worker, batches)
+            independent_time = time.perf_counter() - start
+            independent_mb = total_pss_mb(independent)
+
+        print(f"{n:>8} {pool_mb:>10.1f} {pool_time:>8.2f} {independent_mb:>15.1f} {independent_time:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
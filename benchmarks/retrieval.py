@@ -0,0 +1,237 @@
+"""
+Benchmark the baseline retriever's speed and recall on the dev set, and write a JSON report that can be compared across
+versions.
+
+For each doc_len setting, a Corpus is built over each dev question's necessary evidence, then each subquestion in the
+question's human-written decomposition that has its own evidence is used as a query. This reports:
+
+- the time to build each corpus (pages are fetched before timing, so this excludes network time)
+- the latency percentiles of each ``Corpus.best`` query, including tokenizing the query
+- the peak memory used to build each corpus (traced in a separate pass, since tracing slows everything down)
+- the rank at which a fragment from the subquestion's evidence page first appears
+- the rank at which a fragment containing the subquestion's reference answer first appears (for string, number, and
+  bool answers, using the same matching as the accuracy metric)
+
+Usage:
+    python benchmarks/retrieval.py [--doc-len 512 1024 2048] [--limit N] [-o report.json]
+    python benchmarks/retrieval.py --compare old.json new.json
+"""
+
+import argparse
+import datetime
+import importlib.metadata
+import json
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from _common import walk_subquestions
+
+import fanoutqa
+from fanoutqa.norm import normalize, set_normalize_cache
+from fanoutqa.retrieval import Corpus, PageRegistry
+from fanoutqa.retrieval.registry import _page_key
+from fanoutqa.wiki import wiki_content
+
+RECALL_AT = (1, 5, 10, 20)
+
+
+# ==== dataset ====
+def answer_pattern(answer):
+    """A regex matching the normalized reference answer with word boundaries, or None if the answer is not a single
+    string."""
+    if isinstance(answer, (list, dict)):
+        return None
+    if isinstance(answer, bool):
+        answer = "yes" if answer else "no"
+    return re.compile(rf"\b{re.escape(normalize(answer))}\b")
+
+
+# ==== stats ====
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def pct(p):
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    return {"mean": statistics.mean(values), "p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99), "max": values[-1]}
+
+
+def rank_stats(ranks: list) -> dict:
+    found = [r for r in ranks if r is not None]
+    out = {
+        "n": len(ranks),
+        "not_found": len(ranks) - len(found),
+        "mrr": sum(1 / r for r in found) / len(ranks) if ranks else 0,
+        "median_rank": statistics.median(found) if found else None,
+    }
+    for k in RECALL_AT:
+        out[f"recall@{k}"] = sum(1 for r in found if r <= k) / len(ranks) if ranks else 0
+    return out
+
+
+# ==== benchmark ====
+def run(questions, doc_len: int) -> dict:
+    # use a fresh registry for each setting so that build times don't depend on what ran before
+    registry = PageRegistry(max_bytes=None)
+    build_times = []
+    query_times = []
+    evidence_ranks = []
+    answer_ranks = []
+    for q in questions:
+        start = time.perf_counter()
+        corpus = Corpus(q.necessary_evidence, doc_len=doc_len, registry=registry)
+        _ = corpus.index  # the index is built lazily
+        build_times.append(time.perf_counter() - start)
+
+        # the normalized text of each chunk, for answer matching (the registry has each chunk's tokens already)
+        norm_texts = {}
+        for doc in q.necessary_evidence:
+            for chunk, tokens in registry.get(doc, doc_len):
+                norm_texts[chunk.content] = " ".join(tokens)
+        chunk_idxs = {id(chunk): idx for idx, chunk in enumerate(corpus.documents)}
+
+        for subq in walk_subquestions(q.decomposition):
+            # only subquestions with their own evidence page have a gold page to rank
+            if subq.evidence is None:
+                continue
+            start = time.perf_counter()
+            results = list(corpus.best(subq.question))
+            query_times.append(time.perf_counter() - start)
+
+            gold_key = _page_key(subq.evidence)
+            evidence_ranks.append(
+                next(
+                    (
+                        rank
+                        for rank, result in enumerate(results, 1)
+                        if corpus._chunk_keys[chunk_idxs[id(result)]] == gold_key
+                    ),
+                    None,
+                )
+            )
+            pattern = answer_pattern(subq.answer)
+            if pattern is not None:
+                answer_ranks.append(
+                    next(
+                        (rank for rank, result in enumerate(results, 1) if pattern.search(norm_texts[result.content])),
+                        None,
+                    )
+                )
+
+    return {
+        "doc_len": doc_len,
+        "build": {"total_s": sum(build_times), "per_corpus_ms": percentiles([t * 1000 for t in build_times])},
+        "query": {"n": len(query_times), "latency_ms": percentiles([t * 1000 for t in query_times])},
+        "evidence_rank": rank_stats(evidence_ranks),
+        "answer_rank": rank_stats(answer_ranks),
+    }
+
+
+def measure_memory(questions, doc_len: int) -> dict:
+    peaks = []
+    tracemalloc.start()
+    for q in questions:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        corpus = Corpus(q.necessary_evidence, doc_len=doc_len, registry=None)
+        _ = corpus.index
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+        del corpus
+    tracemalloc.stop()
+    return {"peak_build_bytes": percentiles(peaks)}
+
+
+def metadata(args) -> dict:
+    try:
+        version = importlib.metadata.version("fanoutqa")
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "fanoutqa_version": version,
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "args": vars(args),
+    }
+
+
+# ==== compare ====
+def flatten(d: dict, prefix="") -> dict:
+    out = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            out.update(flatten(v, f"{prefix}{k}."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[f"{prefix}{k}"] = v
+    return out
+
+
+def compare(old_fp, new_fp):
+    with open(old_fp) as f:
+        old = {run["doc_len"]: flatten(run) for run in json.load(f)["runs"]}
+    with open(new_fp) as f:
+        new = {run["doc_len"]: flatten(run) for run in json.load(f)["runs"]}
+    for doc_len in sorted(old.keys() & new.keys()):
+        print(f"doc_len={doc_len}")
+        for key in old[doc_len]:
+            if key == "doc_len" or key not in new[doc_len]:
+                continue
+            a, b = old[doc_len][key], new[doc_len][key]
+            change = f"{(b - a) / a:+.1%}" if a else ""
+            print(f"  {key:40} {a:>14.4f} {b:>14.4f} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--doc-len", type=int, nargs="+", default=[512, 1024, 2048], help="the doc_len settings to run")
+    parser.add_argument("--limit", type=int, help="only use the first N dev questions")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) peak memory pass")
+    parser.add_argument("-o", "--output", default="retrieval-benchmark.json", help="where to write the report")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two reports instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    questions = fanoutqa.load_dev()[: args.limit]
+    # time tokenization itself, not lookups in the normalize cache from an earlier run
+    set_normalize_cache(None)
+    # fetch every page up front so that network time isn't counted as build time
+    print("Fetching evidence...", file=sys.stderr)
+    for q in questions:
+        for doc in q.necessary_evidence:
+            wiki_content(doc)
+
+    runs = []
+    for doc_len in args.doc_len:
+        print(f"Running doc_len={doc_len}...", file=sys.stderr)
+        result = run(questions, doc_len)
+        if not args.no_memory:
+            result["memory"] = measure_memory(questions, doc_len)
+        runs.append(result)
+
+    report = {"meta": metadata(args), "n_questions": len(questions), "runs": runs}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(runs, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Check that the ``numpy`` ROUGE engine gives exactly the same scores as the ``rouge_score`` engine, and measure how much
+faster it is.
+
+The references are the dev set's answers, plus the answers in --questions (e.g. the test set's answer file, in the same
+format as the dev set). Each reference is scored against the answers in --answers (a JSON file of
+``{"id": ..., "answer": ...}`` objects, as submitted for scoring); without it, each question is scored against its
+subquestion answers joined together, and against its subquestions themselves, to include some longer answers. To time
+larger batches (which the ``numpy`` engine can spread over several processes), use --repeat to score every pair N
+times.
+
+Every score of every pair must be identical under both engines; the script fails loudly on the first difference.
+
+Usage: python benchmarks/rouge.py [--questions FILE] [--answers FILE] [--repeat N] [--workers N]
+"""
+
+import argparse
+import json
+import time
+
+from _common import walk_subquestions
+
+import fanoutqa
+from fanoutqa.eval.rouge import ROUGE_ENGINES, rouge_score_many, rouge_tokenize, set_rouge_engine
+from fanoutqa.eval.utils import str_answer
+
+
+def load_pairs(args) -> list[tuple[str, str]]:
+    questions = fanoutqa.load_dev()
+    if args.questions:
+        questions += fanoutqa.load_dev(args.questions)
+    if args.answers:
+        with open(args.answers) as f:
+            answers = {a["id"]: a["answer"] for a in json.load(f)}
+        return [(str_answer(q.answer), answers[q.id]) for q in questions if q.id in answers]
+
+    pairs = []
+    for q in questions:
+        subqs = list(walk_subquestions(q.decomposition))
+        pairs.append((str_answer(q.answer), " ".join(str_answer(subq.answer) for subq in subqs)))
+        pairs.append((str_answer(q.answer), "\n".join(f"{subq.question} {str_answer(subq.answer)}" for subq in subqs)))
+    return pairs
+
+
+def run_engine(engine: str, pairs: list[tuple[str, str]], workers: int):
+    set_rouge_engine(engine)
+    start = time.perf_counter()
+    targets = [rouge_tokenize(ref) for ref, _ in pairs]
+    predictions = [rouge_tokenize(cand) for _, cand in pairs]
+    tokenize_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results = rouge_score_many(targets, predictions, max_workers=workers)
+    score_time = time.perf_counter() - start
+    return results, tokenize_time, score_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="a file of additional questions with reference answers")
+    parser.add_argument("--answers", help="a JSON file of answers to score")
+    parser.add_argument("--repeat", type=int, default=1, help="score every pair N times")
+    parser.add_argument("--workers", type=int, default=None, help="the number of processes for the numpy engine")
+    args = parser.parse_args()
+
+    pairs = load_pairs(args) * args.repeat
+    print(f"{len(pairs)} pairs")
+
+    outputs = {}
+    print(f"{'engine':>12} {'tokenize':>10} {'score':>10} {'total':>10} {'pairs/s':>10}")
+    for engine in ROUGE_ENGINES:
+        results, tokenize_time, score_time = run_engine(engine, pairs, args.workers)
+        outputs[engine] = results
+        total = tokenize_time + score_time
+        print(f"{engine:>12} {tokenize_time:>9.2f}s {score_time:>9.2f}s {total:>9.2f}s {len(pairs) / total:>10.0f}")
+
+    expected = outputs[ROUGE_ENGINES[0]]
+    for engine in ROUGE_ENGINES[1:]:
+        for idx, (exp, got) in enumerate(zip(expected, outputs[engine])):
+            for rouge_type, score in exp.items():
+                # compare the types too, since the results are serialized (rouge_score gives int 0 for empty text)
+                if tuple(score) != tuple(got[rouge_type]) or list(map(type, score)) != list(map(type, got[rouge_type])):
+                    raise AssertionError(
+                        f"{engine} differs from {ROUGE_ENGINES[0]} on pair {idx} ({rouge_type}): {score} !="
+                        f" {got[rouge_type]}\n  reference: {pairs[idx][0]!r}\n  answer: {pairs[idx][1]!r}"
+                    )
+        print(f"{engine}: all {len(pairs)} pairs identical to {ROUGE_ENGINES[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Stress-test the library's entry points under a thread pool, then measure how threaded retrieval scales.
+
+The stress test runs the dev set through ``normalize_many``, ``answer_in_text``, ``wiki_content``, and a set of corpora
+shared between all the threads (querying with ``best`` and ``best_many`` while other threads add and remove pages), and
+checks that every threaded result is the same as the single-threaded result. It fails loudly on the first mismatch or
+exception.
+
+The throughput benchmark then builds one corpus per dev question and queries each with its subquestions, using 1, 2,
+4, ... threads, and reports the queries per second and the speedup over one thread.
+
+The dev set's evidence pages are fetched (and cached) before anything is timed.
+
+Usage: python benchmarks/threads.py [--threads 1 2 4 8] [--limit N] [--rounds N] [--doc-len 1024]
+"""
+
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from _common import subquestion_texts, walk_subquestions
+
+import fanoutqa
+from fanoutqa.eval.string import answer_in_text
+from fanoutqa.eval.utils import str_answer
+from fanoutqa.norm import normalize_many
+from fanoutqa.retrieval import Corpus, PageRegistry
+from fanoutqa.wiki import wiki_content
+
+
+def ranking(results) -> list[tuple[str, str]]:
+    return [(r.title, r.content) for r in results]
+
+
+# ==== stress ====
+def check(name: str, expected, actual):
+    if expected != actual:
+        raise AssertionError(f"{name}: the threaded result differs from the single-threaded result")
+
+
+def stress(questions, n_threads: int, rounds: int, doc_len: int):
+    texts = [q.question for q in questions] + [str_answer(q.answer) for q in questions]
+    for q in questions:
+        texts.extend(subquestion_texts(q))
+    pairs = [
+        (q.answer, " ".join(str_answer(subq.answer) for subq in walk_subquestions(q.decomposition))) for q in questions
+    ]
+
+    # single-threaded references
+    expected_norm = normalize_many(texts)
+    expected_acc = [answer_in_text(ref, cand) for ref, cand in pairs]
+    expected_content = {doc.pageid: wiki_content(doc) for q in questions for doc in q.necessary_evidence}
+    expected_rankings = {}
+    for q in questions:
+        corpus = Corpus(q.necessary_evidence, doc_len=doc_len, registry=None)
+        expected_rankings[q.id] = [ranking(corpus.best(sq)) for sq in subquestion_texts(q)]
+
+    for round_idx in range(rounds):
+        # every thread shares the same registry and the same corpora; the first set start out empty and only ever
+        # have their question's evidence added, the second set also have other pages added and removed
+        registry = PageRegistry()
+        corpora = {q.id: Corpus([], doc_len=doc_len, registry=registry) for q in questions}
+        churned = {q.id: Corpus(q.necessary_evidence, doc_len=doc_len, registry=registry) for q in questions}
+
+        def normalize_task(seed):
+            rng = random.Random(seed)
+            idxs = rng.sample(range(len(texts)), min(len(texts), 64))
+            check("normalize_many", [expected_norm[i] for i in idxs], normalize_many([texts[i] for i in idxs]))
+
+        def accuracy_task(seed):
+            idx = random.Random(seed).randrange(len(pairs))
+            check("answer_in_text", expected_acc[idx], answer_in_text(*pairs[idx]))
+
+        def wiki_task(seed):
+            q = random.Random(seed).choice(questions)
+            for doc in q.necessary_evidence:
+                check("wiki_content", expected_content[doc.pageid], wiki_content(doc))
+
+        def corpus_task(seed):
+            q = random.Random(seed).choice(questions)
+            corpus = corpora[q.id]
+            # adding pages is idempotent, so every thread can add the question's evidence
+            corpus.add(q.necessary_evidence)
+            subqs = subquestion_texts(q)
+            check("Corpus.best", expected_rankings[q.id][0], ranking(corpus.best(subqs[0])))
+            check("Corpus.best_many", expected_rankings[q.id], [ranking(r) for r in corpus.best_many(subqs).rankings])
+
+        def churn_task(seed):
+            # add and remove another question's pages while other threads query the same corpus; every query must
+            # rank each fragment of some consistent state of the corpus exactly once
+            rng = random.Random(seed)
+            q, other = rng.sample(questions, 2)
+            corpus = churned[q.id]
+            extra = [doc for doc in other.necessary_evidence if doc not in q.necessary_evidence]
+            corpus.add(extra)
+            rankings = [list(corpus.best(q.question)), *corpus.best_many(subquestion_texts(q), fuse=True).rankings]
+            for results in rankings:
+                if len({id(r) for r in results}) != len(results):
+                    raise AssertionError("Corpus.best: a fragment was ranked more than once")
+            corpus.remove(extra)
+
+        tasks = [normalize_task, accuracy_task, wiki_task, corpus_task, churn_task, churn_task]
+        jobs = [(task, round_idx * 100_000 + i) for i, task in enumerate(tasks * len(questions))]
+        random.Random(round_idx).shuffle(jobs)
+        with ThreadPoolExecutor(n_threads) as pool:
+            for future in [pool.submit(task, seed) for task, seed in jobs]:
+                future.result()
+
+        # once the churn has settled, each churned corpus is back to its question's evidence, and must rank exactly as
+        # a fresh corpus does
+        for q in questions:
+            rankings = [ranking(churned[q.id].best(sq)) for sq in subquestion_texts(q)]
+            check("Corpus after churn", expected_rankings[q.id], rankings)
+        print(f"stress round {round_idx + 1}/{rounds}: {len(jobs)} tasks on {n_threads} threads OK")
+
+
+# ==== throughput ====
+def throughput(questions, thread_counts: list[int], doc_len: int):
+    registry = PageRegistry(max_bytes=None)
+    corpora = Corpus.build_many([q.necessary_evidence for q in questions], doc_len=doc_len, registry=registry)
+    for corpus in corpora:
+        _ = corpus.index  # the index is built lazily
+    queries = [(corpus, sq) for q, corpus in zip(questions, corpora) for sq in subquestion_texts(q)]
+
+    def query(job):
+        corpus, sq = job
+        return len(list(corpus.best(sq)))
+
+    print(f"{'threads':>8} {'queries/s':>10} {'speedup':>8}")
+    baseline = None
+    for n in thread_counts:
+        with ThreadPoolExecutor(n) as pool:
+            start = time.perf_counter()
+            list(pool.map(query, queries))
+            elapsed = time.perf_counter() - start
+        qps = len(queries) / elapsed
+        baseline = baseline or qps
+        print(f"{n:>8} {qps:>10.1f} {qps / baseline:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--limit", type=int, default=50, help="only use the first N dev questions")
+    parser.add_argument("--rounds", type=int, default=3, help="the number of stress test rounds")
+    parser.add_argument("--doc-len", type=int, default=1024)
+    args = parser.parse_args()
+
+    questions = fanoutqa.load_dev()[: args.limit]
+    # fetch every page before anything is timed
+    for q in questions:
+        for doc in q.necessary_evidence:
+            wiki_content(doc)
+
+    stress(questions, max(args.threads), args.rounds, args.doc_len)
+    throughput(questions, args.threads, args.doc_len)
+
+
+if __name__ == "__main__":
+    main()
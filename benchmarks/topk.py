@@ -0,0 +1,89 @@
+"""
+Benchmark DiskIndex.get_top_k (MaxScore dynamic pruning) against exhaustive scoring (get_scores + sort), and check
+that both return the same top-k results for every query.
+
+Usage: python benchmarks/topk.py INDEX_DIR [-k 10] [--build]
+
+The queries are the top-level questions and human-written subquestions of the dev set. With --build, an index over
+every page in the wiki cache is built at INDEX_DIR first.
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+from _common import dev_queries
+
+import fanoutqa
+from fanoutqa.retrieval import DiskIndex
+from fanoutqa.retrieval.corpus import _ranking
+
+
+def exhaustive_top_k(index: DiskIndex, tok_q: list[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+    scores = index.get_scores(tok_q)
+    idxs = _ranking(scores)[:k]
+    return idxs, scores[idxs]
+
+
+def is_exact(index: DiskIndex, tok_q: list[str], ids: np.ndarray, scores: np.ndarray, expected: np.ndarray) -> bool:
+    """The top-k scores must match, and each returned chunk must actually have its returned score (chunk IDs may only
+    differ between chunks tied on score)."""
+    if len(ids) != len(expected) or len(set(ids.tolist())) != len(ids):
+        return False
+    return np.allclose(scores, expected) and np.allclose(index.get_scores(tok_q)[ids], scores)
+
+
+def fmt_latencies(times: list[float]) -> str:
+    times_ms = sorted(t * 1000 for t in times)
+    p50 = statistics.median(times_ms)
+    p95 = times_ms[min(len(times_ms) - 1, int(len(times_ms) * 0.95))]
+    return f"mean {statistics.mean(times_ms):.2f}ms, p50 {p50:.2f}ms, p95 {p95:.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("index", help="the directory of the DiskIndex to benchmark")
+    parser.add_argument("-k", type=int, default=10, help="the number of results to retrieve per query")
+    parser.add_argument("--build", action="store_true", help="build an index over the wiki cache first")
+    args = parser.parse_args()
+
+    if args.build:
+        start = time.perf_counter()
+        DiskIndex.build(args.index)
+        print(f"Built index in {time.perf_counter() - start:.1f}s")
+    index = DiskIndex(args.index)
+    print(f"Index: {index.corpus_size} chunks, {len(index.vocab)} terms")
+
+    queries = dev_queries()
+    exhaustive_times = []
+    top_k_times = []
+    mismatches = []
+    for q in queries:
+        tok_q = index.tokenize(q)
+        start = time.perf_counter()
+        _, expected = exhaustive_top_k(index, tok_q, args.k)
+        exhaustive_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        ids, scores = index.get_top_k(tok_q, args.k)
+        top_k_times.append(time.perf_counter() - start)
+
+        if not is_exact(index, tok_q, ids, scores, expected):
+            mismatches.append(q)
+
+    print(f"{len(queries)} queries, k={args.k}")
+    print(f"exhaustive: {fmt_latencies(exhaustive_times)}")
+    print(f"top-k:      {fmt_latencies(top_k_times)}")
+    print(f"speedup:    {sum(exhaustive_times) / sum(top_k_times):.2f}x")
+    if mismatches:
+        print(f"{len(mismatches)} queries did not match exhaustive scoring:")
+        for q in mismatches:
+            print(f"  {q}")
+        sys.exit(1)
+    print("All results match exhaustive scoring.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,3 @@
-from .scorer import evaluate
+from .references import ReferenceArtifacts
+from .scorer import aevaluate, evaluate
+from .streaming import StreamingScorer
@@ -0,0 +1,120 @@
+"""A persistent cache of BLEURT scores, and length-bucketed scoring of the pairs that aren't cached."""
+
+import hashlib
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
+
+from fanoutqa.sqlite_cache import SQLiteCache, default_cache
+from fanoutqa.utils import CACHE_DIR, AnyPath
+
+if TYPE_CHECKING:
+    from bleurt.score import BleurtScorer
+
+BLEURT_CHECKPOINT = "BLEURT-20"
+BLEURT_CACHE_PATH = CACHE_DIR / "bleurt.sqlite3"
+
+
+def bleurt_key(checkpoint: str, reference: str, candidate: str) -> str:
+    """The cache key of the BLEURT score of a (reference, candidate) pair under the given checkpoint."""
+    h = hashlib.sha256()
+    for part in (checkpoint, reference, candidate):
+        data = part.encode("utf-8", "surrogatepass")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class BleurtCache(SQLiteCache):
+    """
+    Stores the BLEURT score of each (checkpoint, reference, candidate) in a SQLite database, keyed by a hash of all
+    three (see :func:`bleurt_key`), so that rescoring a submission only runs BLEURT on the answers that changed.
+    """
+
+    table = "bleurt"
+    columns = "score REAL NOT NULL"
+
+    def __init__(self, path: AnyPath = BLEURT_CACHE_PATH):
+        """
+        :param path: The path to the SQLite database (created if it does not exist)
+        """
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: list[str]) -> list[Optional[float]]:
+        """Return the cached score of each key, or None for keys that are not cached."""
+        with self._lock:
+            found = self._select_many("score", keys)
+            out = [found.get(key) for key in keys]
+            n_hits = sum(1 for score in out if score is not None)
+            self.hits += n_hits
+            self.misses += len(keys) - n_hits
+            return out
+
+    def put_many(self, items: Iterable[tuple[str, float]]):
+        """Cache the given (key, score) pairs."""
+        items = [(key, float(score)) for key, score in items]
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO bleurt (key, score) VALUES (?, ?)", items)
+
+
+bleurt_cache: Optional[BleurtCache] = default_cache("FANOUTQA_BLEURT_CACHE", BleurtCache)
+
+
+def set_bleurt_cache(cache: Optional[BleurtCache]) -> Optional[BleurtCache]:
+    """
+    Set the cache used by :func:`score_bleurt_pairs` (or None to disable caching), and return the previous cache. By
+    default, a :class:`.BleurtCache` stored in ``~/.cache/fanoutqa`` is used; set the ``FANOUTQA_BLEURT_CACHE`` env var
+    to 0 to disable it.
+    """
+    global bleurt_cache
+    previous = bleurt_cache
+    bleurt_cache = cache
+    return previous
+
+
+def score_bleurt_pairs(
+    references: list[str],
+    candidates: list[str],
+    get_scorer: Callable[[], "BleurtScorer"],
+    batch_size: int = 16,
+    checkpoint: str = BLEURT_CHECKPOINT,
+) -> list[float]:
+    """
+    Return the BLEURT score of each (reference, candidate) pair, in order.
+
+    Cached scores are looked up first, and the scorer is only loaded (by calling *get_scorer*) if any pair is not
+    cached. The remaining pairs are sorted by length and scored in batches of *batch_size*, so each batch holds pairs of
+    similar length and a few very long answers only pad their own batch instead of every batch they land in.
+
+    :param references: The reference answers
+    :param candidates: The generated answers
+    :param get_scorer: A function returning the BLEURT scorer to use
+    :param batch_size: The number of pairs to score at a time
+    :param checkpoint: The name of the scorer's checkpoint, for the cache key
+    """
+    cache = bleurt_cache
+    scores: list[Optional[float]] = [None] * len(references)
+    keys = None
+    if cache is not None:
+        keys = [bleurt_key(checkpoint, ref, cand) for ref, cand in zip(references, candidates)]
+        scores = cache.get_many(keys)
+
+    misses = [idx for idx, score in enumerate(scores) if score is None]
+    if misses:
+        scorer = get_scorer()
+        misses.sort(key=lambda idx: len(references[idx]) + len(candidates[idx]))
+        for start in range(0, len(misses), batch_size):
+            batch = misses[start : start + batch_size]
+            batch_scores = scorer.score(
+                references=[references[idx] for idx in batch],
+                candidates=[candidates[idx] for idx in batch],
+                batch_size=batch_size,
+            )
+            for idx, score in zip(batch, batch_scores):
+                scores[idx] = score
+            # save as we go, so an interrupted run doesn't lose the batches it has already scored
+            if cache is not None:
+                cache.put_many((keys[idx], scores[idx]) for idx in batch)
+    return scores
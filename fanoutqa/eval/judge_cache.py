@@ -0,0 +1,59 @@
+"""A persistent, content-addressed store of LLM judge responses."""
+
+import hashlib
+import time
+from typing import Optional
+
+from fanoutqa.sqlite_cache import SQLiteCache
+from fanoutqa.utils import CACHE_DIR, AnyPath
+
+JUDGE_CACHE_PATH = CACHE_DIR / "llmcache" / "judgments.sqlite3"
+
+
+def judgment_key(model: str, prompt_version: int, question: str, reference: str, answer: str) -> str:
+    """The cache key of a judgment: a hash of everything that can change the judge's response."""
+    h = hashlib.sha256()
+    for part in (model, str(prompt_version), question, reference, answer):
+        data = part.encode("utf-8", "surrogatepass")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()
+
+
+class JudgeCache(SQLiteCache):
+    """
+    Stores the LLM judge's response to each (judge model, prompt version, question, reference answer, generated answer)
+    in a single SQLite database, keyed by a hash of all five (see :func:`judgment_key`). Every system that gives the
+    same answer to a question shares its judgment, and changing the judge model or prompt never reuses a stale one.
+    """
+
+    table = "judgments"
+    columns = "response TEXT NOT NULL, model TEXT, created REAL"
+
+    def __init__(self, path: AnyPath = JUDGE_CACHE_PATH):
+        """
+        :param path: The path to the SQLite database (created if it does not exist)
+        """
+        super().__init__(path)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for the given key, or None."""
+        with self._lock:
+            row = self._connection().execute("SELECT response FROM judgments WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, response: str, model: str = None):
+        """Cache the response for the given key. *model* is recorded alongside it for reference."""
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO judgments (key, response, model, created) VALUES (?, ?, ?, ?)",
+                    (key, response, model, time.time()),
+                )
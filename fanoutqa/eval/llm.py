@@ -1,28 +1,117 @@
-import hashlib
+import asyncio
 import os
+import threading
+import weakref
+from typing import Optional
 
-from kani import Kani
+import openai
+from kani import AIFunction, ChatMessage, Kani
 from kani.engines.openai import OpenAIEngine
 
+from fanoutqa.eval.judge_cache import JudgeCache, judgment_key
+from fanoutqa.eval.ratelimit import RateLimiter
 from fanoutqa.eval.utils import str_answer
 from fanoutqa.models import DevQuestion
-from fanoutqa.utils import CACHE_DIR
+from fanoutqa.sqlite_cache import default_cache
 
-LLM_CACHE_DIR = CACHE_DIR / "llmcache"
-LLM_CACHE_DIR.mkdir(exist_ok=True)
 LLM_JUDGE_MODEL = os.getenv("FANOUTQA_JUDGE_MODEL", "gpt-4o-2024-11-20")
 OPENAI_API_KEY = os.getenv("FANOUTQA_OPENAI_API_KEY", "")
 OPENAI_API_BASE = os.getenv("FANOUTQA_OPENAI_API_BASE", "https://api.openai.com/v1")
+# judge throughput settings; see Scorer
+LLM_JUDGE_CONCURRENCY = int(os.getenv("FANOUTQA_JUDGE_CONCURRENCY", "20"))
+LLM_JUDGE_RPM = int(os.getenv("FANOUTQA_JUDGE_RPM", "0")) or None
+LLM_JUDGE_TPM = int(os.getenv("FANOUTQA_JUDGE_TPM", "0")) or None
+LLM_JUDGE_TIMEOUT = float(os.getenv("FANOUTQA_JUDGE_TIMEOUT", "120"))
+LLM_JUDGE_RETRIES = int(os.getenv("FANOUTQA_JUDGE_RETRIES", "5"))
+
+
+class RatelimitedOpenAIEngine(OpenAIEngine):
+    """An OpenAI engine that waits for its request-per-minute and token-per-minute limiters before each request."""
+
+    def __init__(self, *args, rpm_limiter: RateLimiter = None, tpm_limiter: RateLimiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rpm_limiter = rpm_limiter
+        self.tpm_limiter = tpm_limiter
+
+    async def predict(self, messages: list[ChatMessage], functions: list[AIFunction] | None = None, **hyperparams):
+        if self.rpm_limiter:
+            await self.rpm_limiter.acquire()
+        if self.tpm_limiter:
+            n_toks = self.function_token_reserve(functions) + sum(self.message_len(m) for m in messages)
+            await self.tpm_limiter.acquire(n_toks)
+        return await super().predict(messages, functions, **hyperparams)
+
+
+def make_engine(
+    rpm_limit: Optional[int] = LLM_JUDGE_RPM,
+    tpm_limit: Optional[int] = LLM_JUDGE_TPM,
+    timeout: float = LLM_JUDGE_TIMEOUT,
+) -> RatelimitedOpenAIEngine:
+    """
+    Create a new judge engine.
+
+    The engine's requests are not retried (callers retry them instead, see :func:`is_retryable`) and time out after
+    *timeout* seconds; time spent waiting for the rate limiters does not count towards the timeout.
+
+    :param rpm_limit: The maximum number of requests per minute, or None for no limit
+    :param tpm_limit: The maximum number of prompt tokens per minute, or None for no limit
+    :param timeout: The timeout of each request, in seconds
+    """
+    client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_API_BASE, max_retries=0, timeout=timeout)
+    return RatelimitedOpenAIEngine(
+        client=client,
+        model=LLM_JUDGE_MODEL,
+        temperature=0,
+        seed=31415,
+        max_context_size=16384,
+        rpm_limiter=RateLimiter(rpm_limit) if rpm_limit else None,
+        tpm_limiter=RateLimiter(tpm_limit) if tpm_limit else None,
+    )
+
+
+def is_retryable(e: Exception) -> bool:
+    """Whether a failed judge request is worth retrying (timeouts, connection errors, rate limits, and server
+    errors)."""
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code in (408, 409, 429) or e.status_code >= 500
+    return False
+
+
+# the OpenAI client's connection pool is bound to the event loop it is first used in, so each event loop (e.g. each
+# thread calling evaluate()) gets its own engine
+_engines: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, OpenAIEngine] = weakref.WeakKeyDictionary()
+_engines_lock = threading.Lock()
+
+
+def get_engine() -> OpenAIEngine:
+    """Return the default judge engine for the running event loop, creating it if needed."""
+    loop = asyncio.get_running_loop()
+    with _engines_lock:
+        engine = _engines.get(loop)
+        if engine is None:
+            engine = _engines[loop] = make_engine()
+    return engine
+
+
+# bump this whenever factuality_system or factuality_prompt changes, so that cached judgments aren't reused
+FACTUALITY_PROMPT_VERSION = 1
+judge_cache: Optional[JudgeCache] = default_cache("FANOUTQA_JUDGE_CACHE", JudgeCache)
+
+
+def set_judge_cache(cache: Optional[JudgeCache]) -> Optional[JudgeCache]:
+    """
+    Set the cache of judgments used by :func:`get_llm_factuality` when given a cache key (or None to disable caching),
+    and return the previous cache. By default, a :class:`.JudgeCache` stored in ``~/.cache/fanoutqa/llmcache`` is used;
+    set the ``FANOUTQA_JUDGE_CACHE`` env var to 0 to disable it.
+    """
+    global judge_cache
+    previous = judge_cache
+    judge_cache = cache
+    return previous
 
 
-engine = OpenAIEngine(
-    api_key=OPENAI_API_KEY,
-    model=LLM_JUDGE_MODEL,
-    api_base=OPENAI_API_BASE,
-    temperature=0,
-    seed=31415,
-    max_context_size=16384,
-)
 factuality_system = "You are comparing a submitted answer to an expert answer on a given question."
 
 
@@ -45,21 +134,34 @@ def factuality_prompt(question: str, reference: str, answer: str):
     )
 
 
-async def get_llm_factuality(question: DevQuestion, answer: str, cache_key=None):
-    """Query GPT-4 to determine the factual equivalence of the generated answer and reference answer."""
+async def get_llm_factuality(question: DevQuestion, answer: str, cache_key=None, engine: OpenAIEngine = None):
+    """
+    Query GPT-4 to determine the factual equivalence of the generated answer and reference answer.
+
+    :param cache_key: If this is provided, look up and store the judgment in the judge cache (see
+        :func:`set_judge_cache`). Judgments are cached by content - the judge model, prompt version, question, reference
+        answer, and generated answer - so every system that gives the same answer shares the same judgment, whatever its
+        key.
+    :param engine: The engine to query (defaults to :func:`get_engine`)
+    """
+    engine = engine or get_engine()
+    reference = str_answer(question.answer)
+
     # cache
-    if cache_key:
-        ans_hash = hashlib.sha256(answer.encode()).hexdigest()[:8]
-        cache_filename = LLM_CACHE_DIR / f"factual-{cache_key}-{question.id}-{ans_hash}.txt"
-        if cache_filename.exists():
-            return cache_filename.read_text(encoding="utf-8")
+    cache = judge_cache if cache_key else None
+    if cache is not None:
+        key = judgment_key(engine.model, FACTUALITY_PROMPT_VERSION, question.question, reference, answer)
+        # the cache is a blocking SQLite lookup, so keep it off the event loop
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
 
     # ask the LLM if it is subjective
-    prompt = factuality_prompt(question.question, str_answer(question.answer), answer)
+    prompt = factuality_prompt(question.question, reference, answer)
     ai = Kani(engine, system_prompt=factuality_system)
     resp = await ai.chat_round_str(prompt)
 
-    if cache_key:
+    if cache is not None:
         # noinspection PyUnboundLocalVariable
-        cache_filename.write_text(resp, encoding="utf-8")
+        await asyncio.to_thread(cache.put, key, resp, model=engine.model)
     return resp
@@ -0,0 +1,96 @@
+"""Find many whole-word patterns in a text in a single pass."""
+
+from collections import deque
+from typing import Iterable
+
+
+class WordBoundaryMatcher:
+    """
+    Finds which of a set of literal patterns occur in a text as whole words - that is, the patterns ``p`` for which
+    ``re.search(rf"\\b{re.escape(p)}\\b", text)`` would find a match - with a single scan over the text, no matter how
+    many patterns there are.
+
+    The patterns are compiled into an Aho-Corasick automaton, which finds every occurrence of every pattern (including
+    overlapping occurrences); each occurrence then only counts if there is a word boundary, with the same definition as
+    ``re``'s ``\\b``, at both of its ends.
+
+    .. code-block:: python
+
+        matcher = WordBoundaryMatcher(["new york", "york", "ork"])
+        matcher.find("i live in new york city")  # {"new york", "york"}
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        """
+        :param patterns: The patterns to search for (duplicates are ignored)
+        """
+        self.patterns = list(dict.fromkeys(patterns))
+        self._has_empty = False
+        # the automaton: for each state, its transitions, its failure link, and the indices of the patterns that end
+        # there (including those ending at the states its failure links lead to)
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[int]] = [[]]
+        for idx, pattern in enumerate(self.patterns):
+            if not pattern:
+                self._has_empty = True
+                continue
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = self._goto[state][ch] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append(idx)
+
+        # link each state to the state of its longest proper suffix, breadth first (states at depth 1 link to the root)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find(self, text: str) -> set[str]:
+        """Return the set of patterns that occur in the text as whole words."""
+        found = set()
+        # an empty pattern matches at any word boundary, and a text has one exactly when it has a word character
+        if self._has_empty and any(_is_word(ch) for ch in text):
+            found.add("")
+        n_nonempty = len(self.patterns) - self._has_empty
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        n_found = 0
+        for end, ch in enumerate(text, 1):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for idx in out[state]:
+                pattern = self.patterns[idx]
+                if pattern in found:
+                    continue
+                if _is_boundary(text, end - len(pattern)) and _is_boundary(text, end):
+                    found.add(pattern)
+                    n_found += 1
+                    if n_found == n_nonempty:
+                        return found
+        return found
+
+
+def _is_word(ch: str) -> bool:
+    # the same set of characters as re's \w for str patterns
+    return ch.isalnum() or ch == "_"
+
+
+def _is_boundary(text: str, pos: int) -> bool:
+    """Whether ``\\b`` matches at the given position in the text."""
+    before = pos > 0 and _is_word(text[pos - 1])
+    after = pos < len(text) and _is_word(text[pos])
+    return before != after
@@ -0,0 +1,45 @@
+"""An asyncio rate limiter for requests or tokens per minute."""
+
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Limits an async workload to *max_rate* units (e.g. requests or tokens) per *time_period* seconds, as a token bucket:
+    capacity refills continuously, and up to *max_rate* units may be used at once after an idle period.
+
+    Waiters are served in order, so a large request is not starved by a stream of small ones.
+
+    .. code-block:: python
+
+        rpm = RateLimiter(500)  # 500 requests per minute
+        await rpm.acquire()
+    """
+
+    def __init__(self, max_rate: float, time_period: float = 60):
+        """
+        :param max_rate: The number of units allowed per time period
+        :param time_period: The length of the time period, in seconds
+        """
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._level = max_rate  # the capacity available right now
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        """Wait until *amount* units are available, then use them. Amounts larger than *max_rate* use the whole
+        bucket."""
+        amount = min(amount, self.max_rate)
+        async with self._lock:
+            self._refill()
+            while self._level < amount:
+                await asyncio.sleep((amount - self._level) * self.time_period / self.max_rate)
+                self._refill()
+            self._level -= amount
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.max_rate, self._level + (now - self._last_refill) * self.max_rate / self.time_period)
+        self._last_refill = now
@@ -0,0 +1,149 @@
+"""
+The reference side of every metric, computed once per question set and shared by every :class:`.Scorer` that scores
+answers to those questions.
+"""
+
+import gzip
+import hashlib
+import itertools
+import json
+import os
+from dataclasses import dataclass
+from typing import Iterable
+
+from fanoutqa.eval.rouge import rouge_tokenize
+from fanoutqa.eval.string import _answer_strings
+from fanoutqa.eval.utils import str_answer
+from fanoutqa.models import DevQuestion
+from fanoutqa.norm import NORMALIZE_ENGINES, NORMALIZE_VERSION, get_normalize_engine, normalize_many
+from fanoutqa.utils import AnyPath
+
+REFERENCE_ARTIFACTS_VERSION = 1
+
+
+def reference_fingerprint(questions: Iterable[DevQuestion]) -> str:
+    """
+    A hash of everything that the reference artifacts of the given questions depend on: each question's ID and
+    reference answer, the artifact version, and the normalize engine and its package versions.
+    """
+    engine = get_normalize_engine()
+    versions = NORMALIZE_ENGINES[engine].versions()
+    h = hashlib.sha256()
+    h.update(f"{REFERENCE_ARTIFACTS_VERSION}\0{NORMALIZE_VERSION}\0{engine}\0{versions}\0".encode())
+    for q in questions:
+        h.update(f"{q.id}\0{json.dumps(q.answer)}\0".encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+@dataclass
+class ReferenceArtifacts:
+    """
+    The precomputed reference side of the string metrics for a set of questions: each reference answer as a string,
+    its normalized answer strings (for accuracy), and its ROUGE tokens. These only depend on the questions, so build
+    them once and pass them to every :class:`.Scorer` over the same questions to skip recomputing them for each set of
+    answers.
+
+    Use :meth:`build` to compute them, and :meth:`save` and :meth:`load` (or :meth:`load_or_build`) to persist them
+    between runs.
+
+    .. code-block:: python
+
+        references = ReferenceArtifacts.build(questions)
+        for answers in systems:
+            scorer = Scorer(questions, answers, references=references)
+            ...
+    """
+
+    fingerprint: str
+    """The :func:`reference_fingerprint` of the questions these artifacts were built from."""
+
+    answers: dict[str, str]
+    """Question ID -> the reference answer as a string (see :func:`.str_answer`)."""
+
+    norm_answers: dict[str, list[str]]
+    """Question ID -> the normalized primitive answer strings of the reference answer, in order."""
+
+    rouge_tokens: dict[str, list[str]]
+    """Question ID -> the stemmed ROUGE tokens of the reference answer (see :func:`.rouge_tokenize`)."""
+
+    @classmethod
+    def build(cls, questions: Iterable[DevQuestion]) -> "ReferenceArtifacts":
+        """Compute the reference artifacts of the given questions. Every answer string is normalized in one batch."""
+        questions = list(questions)
+        answer_strings = [list(_answer_strings(q.answer)) for q in questions]
+        normalized = iter(normalize_many(itertools.chain.from_iterable(answer_strings)))
+
+        answers = {}
+        norm_answers = {}
+        rouge_tokens = {}
+        for q, strings in zip(questions, answer_strings):
+            answers[q.id] = answer = str_answer(q.answer)
+            norm_answers[q.id] = list(itertools.islice(normalized, len(strings)))
+            rouge_tokens[q.id] = rouge_tokenize(answer)
+        return cls(
+            fingerprint=reference_fingerprint(questions),
+            answers=answers,
+            norm_answers=norm_answers,
+            rouge_tokens=rouge_tokens,
+        )
+
+    def __contains__(self, qid: str) -> bool:
+        return qid in self.answers
+
+    def __len__(self):
+        return len(self.answers)
+
+    def save(self, fp: AnyPath):
+        """Write the artifacts to the given file, gzip-compressed if its name ends with ``.gz``."""
+        data = {
+            "version": REFERENCE_ARTIFACTS_VERSION,
+            "fingerprint": self.fingerprint,
+            "answers": self.answers,
+            "norm_answers": self.norm_answers,
+            "rouge_tokens": self.rouge_tokens,
+        }
+        with _open(fp, "wt") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, fp: AnyPath) -> "ReferenceArtifacts":
+        """Read artifacts written by :meth:`save`."""
+        with _open(fp, "rt") as f:
+            data = json.load(f)
+        if data["version"] != REFERENCE_ARTIFACTS_VERSION:
+            raise ValueError(
+                f"The reference artifacts at {fp} were built by an incompatible version of fanoutqa (artifact version"
+                f" {data['version']}, expected {REFERENCE_ARTIFACTS_VERSION}). Please rebuild them."
+            )
+        return cls(
+            fingerprint=data["fingerprint"],
+            answers=data["answers"],
+            norm_answers=data["norm_answers"],
+            rouge_tokens=data["rouge_tokens"],
+        )
+
+    @classmethod
+    def load_or_build(cls, questions: Iterable[DevQuestion], fp: AnyPath) -> "ReferenceArtifacts":
+        """
+        Load the artifacts at the given path if they were built from the same questions with the same normalize engine,
+        or build them and save them there otherwise.
+        """
+        questions = list(questions)
+        if os.path.exists(fp):
+            try:
+                artifacts = cls.load(fp)
+            except (ValueError, KeyError):
+                pass
+            else:
+                if artifacts.fingerprint == reference_fingerprint(questions):
+                    return artifacts
+        artifacts = cls.build(questions)
+        os.makedirs(os.path.dirname(os.path.abspath(fp)), exist_ok=True)
+        artifacts.save(fp)
+        return artifacts
+
+
+def _open(fp: AnyPath, mode: str):
+    if str(fp).endswith(".gz"):
+        return gzip.open(fp, mode, encoding="utf-8")
+    return open(fp, mode[0], encoding="utf-8")
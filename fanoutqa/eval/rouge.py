@@ -0,0 +1,235 @@
+"""
+ROUGE-1, ROUGE-2, and ROUGE-L over pre-tokenized text, so each reference only needs to be tokenized once.
+
+Two engines are available (see :func:`set_rouge_engine`): ``rouge_score``, the default, scores each pair with
+``rouge_score``'s own helpers; ``numpy`` encodes every token as an integer, counts the n-grams of a whole batch at once
+with NumPy, and finds the LCS with a bit-parallel algorithm. Both give exactly the same scores.
+"""
+
+import functools
+import itertools
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from rouge_score.scoring import Score
+
+ROUGE_TYPES = ("rouge1", "rouge2", "rougeL")
+ROUGE_ENGINES = ("rouge_score", "numpy")
+# batches smaller than this are scored in this process, since starting a process pool would take longer
+ROUGE_PARALLEL_MIN_PAIRS = 5000
+
+_engine = "rouge_score"
+_tokenizer = None
+_cached_stemmer = None
+
+
+def set_rouge_engine(engine: str) -> str:
+    """
+    Set the engine used by :func:`rouge_tokenize` and :func:`rouge_score_many`, and return the name of the previous
+    engine. The default engine can also be set with the ``FANOUTQA_ROUGE_ENGINE`` env var. The engine is process-wide.
+
+    - ``rouge_score`` (default): tokenize, stem, and score each pair with the ``rouge_score`` package.
+    - ``numpy``: tokenize with a stemmer that remembers the stems of the words it has seen, and score whole batches at
+      once with integer-encoded tokens (and, for large batches, a pool of processes). The scores are identical to
+      ``rouge_score``'s; use ``benchmarks/rouge.py`` to check this on a set of answers.
+
+    :param engine: The name of the engine to use
+    """
+    global _engine
+    if engine not in ROUGE_ENGINES:
+        raise ValueError(f"Unknown ROUGE engine {engine!r} (expected one of {list(ROUGE_ENGINES)})")
+    previous = _engine
+    _engine = engine
+    return previous
+
+
+def get_rouge_engine() -> str:
+    """Return the name of the engine currently used by :func:`rouge_score_many`."""
+    return _engine
+
+
+set_rouge_engine(os.getenv("FANOUTQA_ROUGE_ENGINE", "rouge_score"))
+
+
+# ==== tokenization ====
+class _CachedStemmer:
+    """A Porter stemmer that remembers the stems of the words it has seen."""
+
+    def __init__(self, maxsize: int = 100_000):
+        from nltk.stem.porter import PorterStemmer
+
+        # the same stemmer as rouge_score's DefaultTokenizer
+        self.stem = functools.lru_cache(maxsize=maxsize)(PorterStemmer().stem)
+
+
+def rouge_tokenize(text: str) -> list[str]:
+    """
+    Tokenize and stem the text the same way as ``RougeScorer(ROUGE_TYPES, use_stemmer=True)`` does before scoring it.
+    """
+    global _tokenizer, _cached_stemmer
+    if _engine == "numpy":
+        from rouge_score.tokenize import tokenize
+
+        if _cached_stemmer is None:
+            _cached_stemmer = _CachedStemmer()
+        return tokenize(text, _cached_stemmer)
+
+    if _tokenizer is None:
+        from rouge_score.tokenizers import DefaultTokenizer
+
+        _tokenizer = DefaultTokenizer(use_stemmer=True)
+    return _tokenizer.tokenize(text)
+
+
+# ==== scoring ====
+def rouge_score_tokens(target_tokens: list[str], prediction_tokens: list[str]) -> dict[str, "Score"]:
+    """
+    Return the ROUGE scores of the prediction against the target, given both as tokenized by :func:`rouge_tokenize`.
+    The output is the same as ``RougeScorer(ROUGE_TYPES, use_stemmer=True).score(target, prediction)``.
+    """
+    # rouge_score doesn't expose scoring pre-tokenized text, so use the same helpers RougeScorer.score does
+    from rouge_score.rouge_scorer import _create_ngrams, _score_lcs, _score_ngrams
+
+    result = {}
+    for rouge_type in ROUGE_TYPES:
+        if rouge_type == "rougeL":
+            result[rouge_type] = _score_lcs(target_tokens, prediction_tokens)
+        else:
+            n = int(rouge_type[5:])
+            result[rouge_type] = _score_ngrams(_create_ngrams(target_tokens, n), _create_ngrams(prediction_tokens, n))
+    return result
+
+
+def rouge_score_many(
+    target_tokens: list[list[str]], prediction_tokens: list[list[str]], max_workers: int = None
+) -> list[dict[str, "Score"]]:
+    """
+    Like :func:`rouge_score_tokens`, for many (target, prediction) pairs at once, using the current ROUGE engine (see
+    :func:`set_rouge_engine`).
+
+    :param target_tokens: The tokens of each target (reference)
+    :param prediction_tokens: The tokens of each prediction (generated answer)
+    :param max_workers: With the ``numpy`` engine, the number of processes to use for batches of at least
+        ``ROUGE_PARALLEL_MIN_PAIRS`` pairs (defaults to the number of CPUs). If this is 1, always score the pairs in
+        this process. The processes are spawned rather than forked (the scorer calls this from a worker thread, and
+        forking a process with other threads running can deadlock the child), so the calling script must guard its
+        entry point with ``if __name__ == "__main__":``.
+    """
+    if len(target_tokens) != len(prediction_tokens):
+        raise ValueError("There must be the same number of targets and predictions.")
+    if _engine == "rouge_score":
+        return [rouge_score_tokens(t, p) for t, p in zip(target_tokens, prediction_tokens)]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(target_tokens) < ROUGE_PARALLEL_MIN_PAIRS:
+        return _score_many_numpy(target_tokens, prediction_tokens)
+    # a few chunks per worker, so one slow chunk doesn't leave the other workers idle
+    chunk_size = math.ceil(len(target_tokens) / (max_workers * 4))
+    starts = range(0, len(target_tokens), chunk_size)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        chunks = pool.map(
+            _score_many_numpy,
+            [target_tokens[i : i + chunk_size] for i in starts],
+            [prediction_tokens[i : i + chunk_size] for i in starts],
+        )
+        return list(itertools.chain.from_iterable(chunks))
+
+
+def _score_many_numpy(target_tokens: list[list[str]], prediction_tokens: list[list[str]]) -> list[dict[str, "Score"]]:
+    import numpy as np
+    from rouge_score.scoring import Score, fmeasure
+
+    n_pairs = len(target_tokens)
+    vocab = {}
+    targets = [[vocab.setdefault(tok, len(vocab)) for tok in toks] for toks in target_tokens]
+    predictions = [[vocab.setdefault(tok, len(vocab)) for tok in toks] for toks in prediction_tokens]
+
+    # every target, then every prediction, as one flat array of token IDs
+    seqs = targets + predictions
+    lens = np.array([len(seq) for seq in seqs], dtype=np.int64)
+    flat = np.fromiter(itertools.chain.from_iterable(seqs), dtype=np.int64, count=int(lens.sum()))
+    seq_ids = np.repeat(np.arange(len(seqs), dtype=np.int64), lens)
+    positions = np.arange(len(flat), dtype=np.int64) - np.repeat(np.cumsum(lens) - lens, lens)
+    overlaps = {
+        n: _ngram_overlaps(flat, seq_ids, positions, lens, n, n_pairs, len(vocab))
+        for n in {int(rouge_type[5:]) for rouge_type in ROUGE_TYPES if rouge_type != "rougeL"}
+    }
+
+    out = []
+    for idx, (target, prediction) in enumerate(zip(targets, predictions)):
+        result = {}
+        for rouge_type in ROUGE_TYPES:
+            if rouge_type == "rougeL":
+                # as in rouge_score, scores with an empty side are the ints 0 rather than 0.0
+                if not target or not prediction:
+                    result[rouge_type] = Score(precision=0, recall=0, fmeasure=0)
+                    continue
+                lcs = _lcs_length(target, prediction)
+                precision = lcs / len(prediction)
+                recall = lcs / len(target)
+            else:
+                n = int(rouge_type[5:])
+                overlap = int(overlaps[n][idx])
+                precision = overlap / max(len(prediction) - n + 1, 1)
+                recall = overlap / max(len(target) - n + 1, 1)
+            result[rouge_type] = Score(precision=precision, recall=recall, fmeasure=fmeasure(precision, recall))
+        out.append(result)
+    return out
+
+
+def _ngram_overlaps(flat, seq_ids, positions, lens, n: int, n_pairs: int, vocab_size: int):
+    """
+    Return the number of n-grams each target shares with its prediction (the sum over n-grams of the smaller of the
+    two counts), for every pair at once.
+    """
+    import numpy as np
+
+    overlaps = np.zeros(n_pairs, dtype=np.int64)
+    starts = np.flatnonzero(positions <= lens[seq_ids] - n)
+    if not len(starts):
+        return overlaps
+
+    # give each distinct n-gram an ID, one token at a time so the IDs never overflow
+    codes = flat[starts]
+    n_codes = vocab_size
+    for offset in range(1, n):
+        uniq, codes = np.unique(codes * vocab_size + flat[starts + offset], return_inverse=True)
+        codes = codes.reshape(-1)
+        n_codes = len(uniq)
+
+    # key each n-gram by its pair too, then count each key on the target and prediction sides
+    seqs = seq_ids[starts]
+    is_target = seqs < n_pairs
+    keys = (seqs % n_pairs) * n_codes + codes
+    target_keys, target_counts = np.unique(keys[is_target], return_counts=True)
+    pred_keys, pred_counts = np.unique(keys[~is_target], return_counts=True)
+    common, target_idx, pred_idx = np.intersect1d(target_keys, pred_keys, assume_unique=True, return_indices=True)
+    np.add.at(overlaps, common // n_codes, np.minimum(target_counts[target_idx], pred_counts[pred_idx]))
+    return overlaps
+
+
+def _lcs_length(a: list[int], b: list[int]) -> int:
+    """
+    The length of the longest common subsequence of two sequences, with Hyyrö's bit-parallel algorithm: each bit of
+    ``v`` stands for one column of the usual dynamic programming table, so each row takes a few big-integer operations
+    instead of a loop over the columns.
+    """
+    if len(b) > len(a):
+        a, b = b, a
+    masks = {}  # token -> the positions where it appears in b
+    for j, tok in enumerate(b):
+        masks[tok] = masks.get(tok, 0) | (1 << j)
+    full = (1 << len(b)) - 1
+    v = full
+    for tok in a:
+        mask = masks.get(tok)
+        if mask is None:
+            continue
+        u = v & mask
+        v = ((v + u) | (v - u)) & full
+    # each zero bit is one more element of the LCS
+    return len(b) - bin(v).count("1")
@@ -1,8 +1,23 @@
 import asyncio
+import logging
+import random
+import threading
+import time
 import warnings
-from typing import Dict, Iterable, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
 
-from fanoutqa.eval.llm import OPENAI_API_KEY, get_llm_factuality
+from fanoutqa.eval.bleurt_cache import BLEURT_CHECKPOINT, score_bleurt_pairs
+from fanoutqa.eval.llm import (
+    LLM_JUDGE_CONCURRENCY,
+    LLM_JUDGE_RETRIES,
+    LLM_JUDGE_RPM,
+    LLM_JUDGE_TIMEOUT,
+    LLM_JUDGE_TPM,
+    OPENAI_API_KEY,
+    get_llm_factuality,
+    is_retryable,
+    make_engine,
+)
 from fanoutqa.eval.models import (
     AccuracyScore,
     Answer,
@@ -11,25 +26,59 @@ from fanoutqa.eval.models import (
     RougeScore,
     RougeScorePart,
 )
-from fanoutqa.eval.string import answer_in_text
+from fanoutqa.eval.references import ReferenceArtifacts
+from fanoutqa.eval.rouge import ROUGE_TYPES, rouge_score_many, rouge_tokenize
+from fanoutqa.eval.string import answer_in_text_many
 from fanoutqa.eval.utils import str_answer
 from fanoutqa.models import DevQuestion
-from fanoutqa.utils import batched
 
-ROUGE_TYPES = ("rouge1", "rouge2", "rougeL")
+if TYPE_CHECKING:
+    from rouge_score.scoring import Score
+
+log = logging.getLogger(__name__)
 
 
 class Scorer:
     def __init__(
-        self, questions: list[DevQuestion], answers: list[Answer], only_score_answered=False, llm_cache_key: str = None
+        self,
+        questions: list[DevQuestion],
+        answers: list[Answer],
+        only_score_answered=False,
+        llm_cache_key: str = None,
+        llm_concurrency: int = LLM_JUDGE_CONCURRENCY,
+        llm_rpm: Optional[int] = LLM_JUDGE_RPM,
+        llm_tpm: Optional[int] = LLM_JUDGE_TPM,
+        llm_timeout: float = LLM_JUDGE_TIMEOUT,
+        llm_retries: int = LLM_JUDGE_RETRIES,
+        llm_raise_on_failure: bool = False,
+        bleurt_batch_size: int = 16,
+        references: Optional[ReferenceArtifacts] = None,
     ):
         """
         :param questions: The questions and reference answers, as loaded by the dataset
         :param answers: The generated answers to score
         :param only_score_answered: Whether to only score questions that have an answer (True), or consider unanswered
             questions to have 0 score (False, default).
-        :param llm_cache_key: If this is provided, cache the LLM-as-judge generations with this key. We recommend
-            setting this to a human-readable key for each system under test.
+        :param llm_cache_key: If this is provided, cache the LLM-as-judge generations. Generations are cached by the
+            content of the question and answer, so systems that give the same answer share them whatever their key;
+            we recommend setting this to a human-readable key for each system under test.
+        :param llm_concurrency: The maximum number of LLM judge requests in flight at once (default 20, or the
+            ``FANOUTQA_JUDGE_CONCURRENCY`` env var)
+        :param llm_rpm: The maximum number of LLM judge requests per minute (default unlimited, or the
+            ``FANOUTQA_JUDGE_RPM`` env var)
+        :param llm_tpm: The maximum number of LLM judge prompt tokens per minute (default unlimited, or the
+            ``FANOUTQA_JUDGE_TPM`` env var)
+        :param llm_timeout: The timeout of each LLM judge request, in seconds (default 120, or the
+            ``FANOUTQA_JUDGE_TIMEOUT`` env var)
+        :param llm_retries: The number of times to retry a failed LLM judge request (default 5, or the
+            ``FANOUTQA_JUDGE_RETRIES`` env var)
+        :param llm_raise_on_failure: Whether to raise the error of an LLM judge request that still fails after retrying
+            (True), or score its answer 0 with a warning (False, default). Errors that are not worth retrying (e.g. an
+            invalid API key) are always raised.
+        :param bleurt_batch_size: The number of answers to score with BLEURT at a time. Answers are batched with others
+            of similar length, so larger batches cost little extra padding.
+        :param references: The precomputed :class:`.ReferenceArtifacts` of the questions. Pass the same artifacts to
+            every scorer over the same questions to compute them only once; if not given, they are built on first use.
         """
 
         self.questions = questions
@@ -45,39 +94,70 @@ class Scorer:
             self.eval_len = len(self.questions)
 
         self.llm_cache_key = llm_cache_key
+        self.llm_concurrency = llm_concurrency
+        self.llm_rpm = llm_rpm
+        self.llm_tpm = llm_tpm
+        self.llm_timeout = llm_timeout
+        self.llm_retries = llm_retries
+        self.llm_raise_on_failure = llm_raise_on_failure
+        self.bleurt_batch_size = bleurt_batch_size
+
+        if references is not None:
+            missing = [q.id for q in self.questions if q.id not in references]
+            if missing:
+                raise ValueError(
+                    f"The given reference artifacts do not cover {len(missing)} of the questions (e.g. question ID"
+                    f" {missing[0]}). Were they built from a different question set?"
+                )
+        self._references = references
+        self._references_lock = threading.Lock()
 
         # ext evallers
-        self.rouge = None
         self.bleurt = None
 
+    @property
+    def references(self) -> ReferenceArtifacts:
+        """The reference artifacts of the loaded qs, built on first use if they were not given."""
+        # the metrics run in separate threads, so make sure only one of them builds the artifacts
+        with self._references_lock:
+            if self._references is None:
+                self._references = ReferenceArtifacts.build(self.questions)
+            return self._references
+
     async def score(self):
-        acc, acc_raw = self.score_accuracy()
-        rouge, rouge_raw = self.score_rouge()
-        bleurt_, bleurt_raw = self.score_bleurt()
+        """
+        Compute every metric for the loaded qs and as. The CPU-bound metrics each run in a worker thread, concurrently
+        with each other and with the network-bound GPT judge, so this takes about as long as the slowest metric rather
+        than the sum of all of them.
+        """
         # require FANOUTQA_OPENAI_API_KEY to be set to do GPT judge to prevent footguns
         if not OPENAI_API_KEY:
             warnings.warn(
                 "No OpenAI API key found! To run GPT-as-judge scoring, set the `FANOUTQA_OPENAI_API_KEY` env var to"
                 " your OpenAI API key."
             )
-            gptscore = 0
-            gpt_raw = {}
+            gpt_coro = _no_gpt_score()
         else:
-            gptscore, gpt_raw = await self.score_gpt()
+            gpt_coro = self.score_gpt()
 
-        # collect raw aggs
-        raw_scores = []
-        for q, a in self.get_qa_pairs():
-            raw_scores.append(
-                EvaluationSingleScore(
-                    question_id=q.id,
-                    acc=acc_raw[q.id],
-                    rouge=rouge_raw[q.id],
-                    bleurt=bleurt_raw[q.id],
-                    gpt=gpt_raw.get(q.id),
-                )
-            )
-        return EvaluationScore(acc=acc, rouge=rouge, bleurt=bleurt_, gpt=gptscore, raw=raw_scores)
+        (acc, acc_raw), (rouge, rouge_raw), (bleurt_, bleurt_raw), (gptscore, gpt_raw) = await asyncio.gather(
+            asyncio.to_thread(self.score_accuracy),
+            asyncio.to_thread(self.score_rouge),
+            asyncio.to_thread(self.score_bleurt),
+            gpt_coro,
+        )
+
+        return _evaluation_score(
+            [q.id for q, _ in self.get_qa_pairs()],
+            acc,
+            acc_raw,
+            rouge,
+            rouge_raw,
+            bleurt_,
+            bleurt_raw,
+            gptscore,
+            gpt_raw,
+        )
 
     def get_qa_pairs(self) -> Iterable[tuple[DevQuestion, Optional[Answer]]]:
         """Yield pairs of questions and answers to score.
@@ -95,72 +175,50 @@ class Scorer:
     # scorers
     def score_accuracy(self) -> Tuple[AccuracyScore, Dict[str, float]]:
         """Get the loose and strict accuracy scores for the loaded qs and as."""
-        raw_scores = {}  # qid -> score
-        accs = []
-        n_perfect = 0
-        for q, a in self.get_qa_pairs():
+        qa_pairs = list(self.get_qa_pairs())
+        answered = [(q, a) for q, a in qa_pairs if a is not None]
+        references = self.references
+        # normalize every answer together, in one batch, and match it against its reference's precomputed answer strings
+        results = iter(
+            answer_in_text_many(
+                ((q.answer, a["answer"]) for q, a in answered),
+                norm_answers=(references.norm_answers[q.id] for q, _ in answered),
+            )
+        )
+        accs = {}  # qid -> (score, found)
+        for q, a in qa_pairs:
             if a is None:
-                accs.append(0)
-                raw_scores[q.id] = 0
-                continue
-            result = answer_in_text(q.answer, a["answer"])
-            accs.append(result.score)
-            raw_scores[q.id] = result.score
-            if result.found:
-                n_perfect += 1
-
+                accs[q.id] = (0, False)
+            else:
+                result = next(results)
+                accs[q.id] = (result.score, result.found)
         assert len(accs) == self.eval_len
-        assert len(raw_scores) == self.eval_len
-        avg_acc = sum(accs) / self.eval_len
-        pct_perfect = n_perfect / self.eval_len
-        return AccuracyScore(loose=avg_acc, strict=pct_perfect), raw_scores
+        return _summarize_accuracy(accs, self.eval_len)
 
     def score_rouge(self) -> Tuple[RougeScore, Dict[str, RougeScore]]:
-        """Get the ROUGE-1, ROUGE-2, and ROUGE-L scores (P/R/F1) for the loaded qs and as."""
-        import rouge_score.scoring
-
-        if self.rouge is None:
-            from rouge_score.rouge_scorer import RougeScorer
-
-            self.rouge = RougeScorer(ROUGE_TYPES, use_stemmer=True)
-
-        raw_scores = {}  # qid -> RougeScore
-        scores = {t: [] for t in ROUGE_TYPES}  # rouge_type -> list[Score]
-        for q, a in self.get_qa_pairs():
-            if a is None:
-                for score in scores.values():
-                    score.append(rouge_score.scoring.Score(0, 0, 0))
-                raw_scores[q.id] = RougeScore(
-                    **{k: RougeScorePart(precision=0, recall=0, fscore=0) for k in ROUGE_TYPES}
-                )
-                continue
-            results = self.rouge.score(str_answer(q.answer), str_answer(a["answer"]))
-            for k, v in results.items():
-                scores[k].append(v)
-            raw_scores[q.id] = RougeScore(
-                **{
-                    k: RougeScorePart(precision=v.precision, recall=v.recall, fscore=v.fmeasure)
-                    for k, v in results.items()
-                }
+        """
+        Get the ROUGE-1, ROUGE-2, and ROUGE-L scores (P/R/F1) for the loaded qs and as. Every answer is scored in one
+        batch by the current ROUGE engine (see :func:`.set_rouge_engine`).
+        """
+        references = self.references
+        qa_pairs = list(self.get_qa_pairs())
+        answered = [(q, a) for q, a in qa_pairs if a is not None]
+        batch_results = iter(
+            rouge_score_many(
+                [references.rouge_tokens[q.id] for q, _ in answered],
+                [rouge_tokenize(str_answer(a["answer"])) for _, a in answered],
             )
-
-        assert all(len(v) == self.eval_len for v in scores.values())
-        assert len(raw_scores) == self.eval_len
-        out = {}
-        for k, v in scores.items():
-            avg_precision = sum(s.precision for s in v) / self.eval_len
-            avg_recall = sum(s.recall for s in v) / self.eval_len
-            avg_fscore = sum(s.fmeasure for s in v) / self.eval_len
-            out[k] = RougeScorePart(precision=avg_precision, recall=avg_recall, fscore=avg_fscore)
-        return RougeScore(**out), raw_scores
+        )
+        rouges = {q.id: None if a is None else next(batch_results) for q, a in qa_pairs}
+        assert len(rouges) == self.eval_len
+        return _summarize_rouge(rouges, self.eval_len)
 
     def score_bleurt(self) -> Tuple[float, Dict[str, float]]:
-        """Get the BLEURT score for the loaded qs and as."""
-        if self.bleurt is None:
-            from bleurt.score import BleurtScorer
-
-            self.bleurt = BleurtScorer("BLEURT-20")
-
+        """
+        Get the BLEURT score for the loaded qs and as. Scores are cached on disk for each (reference, answer) pair, so
+        rescoring a submission only runs BLEURT on the answers that changed (see :func:`.score_bleurt_pairs`).
+        """
+        reference_artifacts = self.references
         references = []
         candidates = []
         idx_to_id = {}
@@ -170,66 +228,230 @@ class Scorer:
                 candidates.append("")
             else:
                 candidates.append(str_answer(a["answer"]))
-            references.append(str_answer(q.answer))
+            references.append(reference_artifacts.answers[q.id])
 
-        scores = self.bleurt.score(references=references, candidates=candidates)
-        assert len(scores) == self.eval_len
-        avg_score = sum(scores) / self.eval_len
+        scores = score_bleurt_pairs(references, candidates, self._get_bleurt, batch_size=self.bleurt_batch_size)
         raw_scores = {idx_to_id[idx]: score for idx, score in enumerate(scores)}
         assert len(raw_scores) == self.eval_len
-        return avg_score, raw_scores
+        return _mean(raw_scores, self.eval_len), raw_scores
+
+    def _get_bleurt(self):
+        if self.bleurt is None:
+            try:
+                # pads each batch only to its longest pair, rather than to the model's maximum sequence length
+                from bleurt.score import LengthBatchingBleurtScorer as BleurtScorer
+            except ImportError:
+                from bleurt.score import BleurtScorer
+
+            self.bleurt = BleurtScorer(BLEURT_CHECKPOINT)
+        return self.bleurt
 
     async def score_gpt(self) -> Tuple[float, Dict[str, int]]:
-        """Use GPT-4 as a judge to grade the loaded qs and as."""
-        accs = []
+        """
+        Use GPT-4 as a judge to grade the loaded qs and as.
+
+        Up to ``llm_concurrency`` judge calls are in flight at once, and a new call starts as soon as any call finishes.
+        Calls that time out or fail with a retryable error are retried with jittered exponential backoff; answers whose
+        calls still fail are scored 0, with a warning (or, if ``llm_raise_on_failure`` is set, the error is raised).
+        Any other error is raised. Progress is logged to the ``fanoutqa.eval.scorer`` logger.
+        """
+        jobs = []
         raw_scores = {}
+        for q, a in self.get_qa_pairs():
+            if a is None:
+                raw_scores[q.id] = 0
+                continue
+            # sometimes we have fun neural text degeneration, just cut it off
+            ans = a["answer"]
+            if len(a["answer"]) > 4000:
+                warnings.warn(f"The answer to question ID {a['id']} is too long, trimming it to 4000 characters.")
+                ans = ans[:4000]
+            jobs.append((q, ans))
+
+        engine = make_engine(self.llm_rpm, self.llm_tpm, self.llm_timeout)
+        progress = _JudgeProgress(len(jobs))
+        failures = {}  # qid -> exception
+        job_iter = iter(jobs)
 
-        for batch in batched(self.get_qa_pairs(), 20):
-            # eval 20 qs at a time
-            coros = []
-            ids = []
-            for q, a in batch:
-                if a is None:
-                    accs.append(0)
+        async def worker():
+            # each worker takes the next job as soon as its last one finishes, so one slow call never holds up the rest
+            for q, ans in job_iter:
+                try:
+                    result = await self._judge(q, ans, engine, progress)
+                except Exception as e:
+                    if self._should_raise(e):
+                        raise
+                    failures[q.id] = e
                     raw_scores[q.id] = 0
-                    continue
-                # sometimes we have fun neural text degeneration, just cut it off
-                ans = a["answer"]
-                if len(a["answer"]) > 4000:
-                    warnings.warn(f"The answer to question ID {a['id']} is too long, trimming it to 4000 characters.")
-                    ans = ans[:4000]
-                coro = get_llm_factuality(q, ans, cache_key=self.llm_cache_key)
-                coros.append(coro)
-                ids.append(q.id)
-
-            # and score their answers
-            # B, C, E = full score, anything else = 0
-            answers = await asyncio.gather(*coros)
-            for qid, result in zip(ids, answers):
-                mc = result.strip()[-1].lower()
-                if mc in "bce":
-                    accs.append(1)
-                    raw_scores[qid] = 1
                 else:
-                    accs.append(0)
-                    raw_scores[qid] = 0
+                    # B, C, E = full score, anything else = 0
+                    raw_scores[q.id] = 1 if result.strip()[-1:].lower() in ("b", "c", "e") else 0
+                progress.done(failed=q.id in failures)
 
-        assert len(accs) == self.eval_len
+        workers = [asyncio.ensure_future(worker()) for _ in range(min(self.llm_concurrency, len(jobs)))]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # if one worker raised, stop the others before closing the engine they use
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await engine.close()
+        progress.log(final=True)
+
+        if failures:
+            qid, e = next(iter(failures.items()))
+            warnings.warn(
+                f"The LLM judge failed to grade {len(failures)} answer(s) after retrying, which were scored 0 (e.g."
+                f" question ID {qid}: {e!r})."
+            )
+
+        # report the scores in question order
+        raw_scores = {q.id: raw_scores[q.id] for q, _ in self.get_qa_pairs()}
         assert len(raw_scores) == self.eval_len
-        avg_acc = sum(accs) / self.eval_len
-        return avg_acc, raw_scores
+        return _mean(raw_scores, self.eval_len), raw_scores
+
+    async def _judge(self, q: DevQuestion, answer: str, engine, progress: "_JudgeProgress") -> str:
+        """Get the judge's response for one answer, retrying with jittered exponential backoff."""
+        for attempt in range(self.llm_retries + 1):
+            try:
+                return await get_llm_factuality(q, answer, cache_key=self.llm_cache_key, engine=engine)
+            except Exception as e:
+                if attempt == self.llm_retries or not is_retryable(e):
+                    raise
+                progress.retries += 1
+                log.debug(f"Retrying the LLM judge for question ID {q.id} after {e!r}")
+                await asyncio.sleep(min(60, 2**attempt) * random.uniform(0.5, 1.5))
+
+    def _should_raise(self, e: Exception) -> bool:
+        """Whether a judge error that survived :meth:`_judge`'s retries should be raised rather than scored 0."""
+        return self.llm_raise_on_failure or not is_retryable(e)
+
+
+class _JudgeProgress:
+    """Logs the progress of the LLM judge at most every few seconds."""
+
+    def __init__(self, total: int, interval: float = 5):
+        self.total = total
+        self.interval = interval
+        self.n_done = 0
+        self.n_failed = 0
+        self.retries = 0
+        self.start = self.last_log = time.monotonic()
+
+    def done(self, failed: bool):
+        self.n_done += 1
+        self.n_failed += failed
+        # the final count is logged once the judge finishes
+        if self.n_done < self.total and time.monotonic() - self.last_log >= self.interval:
+            self.log()
+
+    def log(self, final: bool = False):
+        self.last_log = now = time.monotonic()
+        rate = self.n_done / (now - self.start) if now > self.start else 0
+        log.info(
+            f"LLM judge{' finished' if final else ''}: {self.n_done}/{self.total} graded ({rate:.1f}/s),"
+            f" {self.retries} retries, {self.n_failed} failed"
+        )
+
+
+async def _no_gpt_score() -> Tuple[float, Dict[str, int]]:
+    return 0, {}
+
+
+# ==== aggregation ====
+# shared by Scorer and StreamingScorer, so that both average the per-question scores in exactly the same way
+def _mean(scores: Dict[str, float], eval_len: int) -> float:
+    return sum(scores.values()) / eval_len
+
+
+def _summarize_accuracy(accs: Dict[str, Tuple[float, bool]], eval_len: int) -> Tuple[AccuracyScore, Dict[str, float]]:
+    """Average the (score, whether every reference string was found) of each question."""
+    loose = sum(score for score, _ in accs.values()) / eval_len
+    strict = sum(1 for _, found in accs.values() if found) / eval_len
+    return AccuracyScore(loose=loose, strict=strict), {qid: score for qid, (score, _) in accs.items()}
+
+
+def _summarize_rouge(
+    rouges: Dict[str, Optional[Dict[str, "Score"]]], eval_len: int
+) -> Tuple[RougeScore, Dict[str, RougeScore]]:
+    """Average the ROUGE scores of each question, as given by :func:`.rouge_score_many` (None if unanswered)."""
+    raw_scores = {}  # qid -> RougeScore
+    parts = {t: [] for t in ROUGE_TYPES}  # rouge_type -> list[RougeScorePart]
+    for qid, result in rouges.items():
+        if result is None:
+            result_parts = {t: RougeScorePart(precision=0, recall=0, fscore=0) for t in ROUGE_TYPES}
+        else:
+            result_parts = {
+                k: RougeScorePart(precision=v.precision, recall=v.recall, fscore=v.fmeasure) for k, v in result.items()
+            }
+        for k, v in result_parts.items():
+            parts[k].append(v)
+        raw_scores[qid] = RougeScore(**result_parts)
+
+    out = {}
+    for k, v in parts.items():
+        avg_precision = sum(s.precision for s in v) / eval_len
+        avg_recall = sum(s.recall for s in v) / eval_len
+        avg_fscore = sum(s.fscore for s in v) / eval_len
+        out[k] = RougeScorePart(precision=avg_precision, recall=avg_recall, fscore=avg_fscore)
+    return RougeScore(**out), raw_scores
+
+
+def _evaluation_score(
+    qids: list[str],
+    acc: AccuracyScore,
+    acc_raw: Dict[str, float],
+    rouge: RougeScore,
+    rouge_raw: Dict[str, RougeScore],
+    bleurt_: float,
+    bleurt_raw: Dict[str, float],
+    gpt: float,
+    gpt_raw: Dict[str, int],
+) -> EvaluationScore:
+    """Combine each metric's score and per-question scores into an evaluation score, with the questions in order."""
+    raw_scores = [
+        EvaluationSingleScore(
+            question_id=qid,
+            acc=acc_raw[qid],
+            rouge=rouge_raw[qid],
+            bleurt=bleurt_raw[qid],
+            gpt=gpt_raw.get(qid),
+        )
+        for qid in qids
+    ]
+    return EvaluationScore(acc=acc, rouge=rouge, bleurt=bleurt_, gpt=gpt, raw=raw_scores)
 
 
 def evaluate(questions: list[DevQuestion], answers: list[Answer], **kwargs) -> EvaluationScore:
     """
     Evaluate all FOQA metrics across the given questions and generated answers.
 
+    This starts its own event loop, so it can't be called from async code; use :func:`aevaluate` there instead.
+
     :param questions: The questions and reference answers, as loaded by the dataset.
     :param answers: The generated answers to score. These should be dictionaries like ``{"id": "...", "answer": "..."}``
     :param only_score_answered: Whether to only score questions that have an answer (True), or consider unanswered
         questions to have 0 score (False, default). This is useful for evaluating only a subset of the dataset.
-    :param llm_cache_key: If this is provided, cache the LLM-as-judge generations with this key. We recommend
-        setting this to a human-readable key for each system under test.
+    :param llm_cache_key: If this is provided, cache the LLM-as-judge generations. Generations are cached by the
+        content of the question and answer, so systems that give the same answer share them whatever their key; we
+        recommend setting this to a human-readable key for each system under test.
+    :param llm_concurrency: The maximum number of LLM judge requests in flight at once. This, ``llm_rpm``,
+        ``llm_tpm``, ``llm_timeout``, and ``llm_retries`` control the LLM judge's throughput; see :class:`.Scorer`.
+    :param references: The precomputed :class:`.ReferenceArtifacts` of the questions. When evaluating several systems
+        on the same questions, build these once and pass them to each call.
+    """
+    return asyncio.run(aevaluate(questions, answers, **kwargs))
+
+
+async def aevaluate(questions: list[DevQuestion], answers: list[Answer], **kwargs) -> EvaluationScore:
+    """
+    Evaluate all FOQA metrics across the given questions and generated answers, in the running event loop. Takes the
+    same arguments as :func:`evaluate`.
+
+    .. code-block:: python
+
+        score = await fanoutqa.eval.aevaluate(dev_questions, answers, llm_cache_key="your-model-key")
     """
     scorer = Scorer(questions, answers, **kwargs)
-    return asyncio.run(scorer.score())
+    return await scorer.score()
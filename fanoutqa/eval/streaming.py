@@ -0,0 +1,356 @@
+"""Score generated answers as they are produced, rather than after the whole run."""
+
+import asyncio
+import json
+import os
+import time
+import warnings
+from typing import AsyncIterable, Dict, Iterable, Optional, Union
+
+from fanoutqa.eval.bleurt_cache import score_bleurt_pairs
+from fanoutqa.eval.llm import OPENAI_API_KEY, make_engine
+from fanoutqa.eval.models import Answer, EvaluationScore
+from fanoutqa.eval.rouge import rouge_score_many, rouge_tokenize
+from fanoutqa.eval.scorer import (
+    Scorer,
+    _evaluation_score,
+    _JudgeProgress,
+    _mean,
+    _summarize_accuracy,
+    _summarize_rouge,
+)
+from fanoutqa.eval.string import answer_in_text_many
+from fanoutqa.eval.utils import str_answer
+from fanoutqa.models import DevQuestion
+from fanoutqa.utils import AnyPath
+
+
+class StreamingScorer(Scorer):
+    """
+    Scores answers as they arrive - for example, while a benchmark run is still appending them to a JSONL file - and
+    keeps a running score of the answers scored so far.
+
+    Each answer is graded by the LLM judge as soon as it is added (with the same concurrency, rate limits, and retries
+    as :meth:`.Scorer.score_gpt`), while the string metrics and BLEURT are computed in a worker thread over whatever
+    answers are waiting, so answers that arrive in a burst are scored in batches. Once the last answer is added, only
+    its own scoring remains, so the final score is ready almost as soon as the last answer lands. The final score is the
+    same as :func:`.evaluate` would give over the same answers; if a question is answered more than once, its last
+    answer is scored.
+
+    .. code-block:: python
+
+        scorer = StreamingScorer(questions, llm_cache_key="your-model-key")
+        # follow the results file of a run in progress, until every question has been answered
+        score = await scorer.tail("results/results-openbook-your-model.jsonl")
+
+        # or, feed it answers from any (async) iterable
+        score = await scorer.consume(generate_answers())
+
+        # or, add answers one at a time
+        scorer.add({"id": "...", "answer": "..."})
+        print(scorer.running_score())
+        score = await scorer.finish()
+
+    The scorer must be used from a single event loop, and can only be finished once.
+    """
+
+    def __init__(self, questions: list[DevQuestion], only_score_answered=False, **kwargs):
+        """
+        :param questions: The questions and reference answers, as loaded by the dataset
+        :param only_score_answered: Whether to only score questions that have an answer (True), or consider unanswered
+            questions to have 0 score (False, default).
+        :param kwargs: Any other arguments accepted by :class:`.Scorer`, except ``answers``
+        """
+        super().__init__(questions, [], only_score_answered=only_score_answered, **kwargs)
+        # qid -> the number of times it has been answered, so that results for a replaced answer are discarded
+        self._versions: Dict[str, int] = {}
+        # qid -> score, for each metric
+        self._acc = {}
+        self._rouge = {}
+        self._bleurt = {}
+        self._gpt = {}
+        self._missing_bleurt = {}  # qid -> BLEURT score of an empty answer, for unanswered questions
+
+        self._pending = []  # (qid, answer, version) waiting for the string metrics and BLEURT
+        self._wakeup = None
+        self._worker = None
+        self._judge_tasks = set()
+        self._judge_failures = {}  # qid -> exception
+        self._judge_error = None  # the first error the judge raised rather than scoring its answer 0
+        self._judge_sem = None
+        self._engine = None
+        self._progress = None
+        self._finished = False
+
+    @property
+    def all_answered(self) -> bool:
+        """Whether every question has an answer (always False if ``only_score_answered`` is set)."""
+        return not self.only_score_answered and len(self.answers_by_id) == len(self.questions)
+
+    # ==== input ====
+    def add(self, answer: Answer):
+        """
+        Add an answer and start scoring it. Must be called from the event loop the scorer runs in. Answers to questions
+        that are not in the question set are skipped, with a warning.
+        """
+        if self._finished:
+            raise RuntimeError("This scorer has already finished.")
+        qid = answer["id"]
+        q = self.questions_by_id.get(qid)
+        if q is None:
+            warnings.warn(f"There is no question with ID {qid} in the question set, skipping its answer.")
+            return
+        self._start()
+        # a failed worker or judge fails the whole scorer, so surface the error as soon as possible
+        if self._worker.done():
+            self._worker.result()
+        if self._judge_error is not None:
+            raise self._judge_error
+
+        if qid in self.answers_by_id:
+            self.answers[self.answers.index(self.answers_by_id[qid])] = answer
+        else:
+            self.answers.append(answer)
+        self.answers_by_id[qid] = answer
+        version = self._versions[qid] = self._versions.get(qid, 0) + 1
+        for scores in (self._acc, self._rouge, self._bleurt, self._gpt):
+            scores.pop(qid, None)
+
+        self._pending.append((qid, answer["answer"], version))
+        self._wakeup.set()
+        if OPENAI_API_KEY:
+            self._progress.total += 1
+            task = asyncio.create_task(self._judge_one(q, answer["answer"], version))
+            self._judge_tasks.add(task)
+            task.add_done_callback(self._judge_done)
+
+    async def consume(self, answers: Union[Iterable[Answer], AsyncIterable[Answer]]) -> EvaluationScore:
+        """Add every answer from the (async) iterable as it is produced, then return the final score."""
+        if hasattr(answers, "__aiter__"):
+            async for answer in answers:
+                self.add(answer)
+        else:
+            for answer in answers:
+                self.add(answer)
+                # let the judge and the worker start on this answer before adding the next one
+                await asyncio.sleep(0)
+        return await self.finish()
+
+    async def tail(
+        self, fp: AnyPath, poll_interval: float = 1, idle_timeout: Optional[float] = None
+    ) -> EvaluationScore:
+        """
+        Follow a JSONL file of answers (e.g. a results file written by the benchmark runner, which may include other
+        keys in each line), adding each answer as its line is written, then return the final score.
+
+        The file is read from the start, and need not exist yet. This returns as soon as every question has been
+        answered or, if *idle_timeout* is given, once the file has not grown for that many seconds. If
+        ``only_score_answered`` is set, there is no way to tell when every answer has been written, so *idle_timeout* is
+        required.
+
+        :param fp: The path to the JSONL file
+        :param poll_interval: How often to check the file for new lines, in seconds
+        :param idle_timeout: If given, stop waiting for new answers after this many seconds without one
+        """
+        if self.only_score_answered and idle_timeout is None:
+            raise ValueError(
+                "tail() would never return: with only_score_answered, it can't tell when the last answer has been"
+                " written. Pass an idle_timeout."
+            )
+        last_data = time.monotonic()
+        buffer = ""
+        f = None
+        try:
+            while not self.all_answered:
+                if f is None and os.path.exists(fp):
+                    f = open(fp, encoding="utf-8")
+                chunk = f.read() if f is not None else ""
+                if chunk:
+                    last_data = time.monotonic()
+                    # only read complete lines; the last line may still be being written
+                    *lines, buffer = (buffer + chunk).split("\n")
+                    for line in lines:
+                        if line.strip():
+                            self.add(json.loads(line))
+                    await asyncio.sleep(0)
+                elif idle_timeout is not None and time.monotonic() - last_data >= idle_timeout:
+                    if buffer.strip():
+                        self.add(json.loads(buffer))
+                    break
+                else:
+                    await asyncio.sleep(poll_interval)
+        finally:
+            if f is not None:
+                f.close()
+        return await self.finish()
+
+    # ==== output ====
+    def running_score(self) -> Optional[EvaluationScore]:
+        """
+        Return the score of the answers that have been fully scored so far (as if ``only_score_answered`` were set), or
+        None if no answer has been fully scored yet.
+        """
+        done = [
+            (self.questions_by_id[qid], a)
+            for qid, a in self.answers_by_id.items()
+            if qid in self._acc
+            and qid in self._rouge
+            and qid in self._bleurt
+            and (qid in self._gpt or not OPENAI_API_KEY)
+        ]
+        if not done:
+            return None
+        return self._summarize(done, len(done))
+
+    async def finish(self) -> EvaluationScore:
+        """Wait for every answer added so far to be scored, then return the final score."""
+        if self._finished:
+            raise RuntimeError("This scorer has already finished.")
+        self._start()
+        self._finished = True
+        self._wakeup.set()
+        try:
+            await self._worker
+            await asyncio.gather(*self._judge_tasks)
+            if self._judge_error is not None:
+                raise self._judge_error
+        except BaseException:
+            for task in self._judge_tasks:
+                task.cancel()
+            raise
+        finally:
+            if self._engine is not None:
+                await self._engine.close()
+        if OPENAI_API_KEY:
+            self._progress.log(final=True)
+        if self._judge_failures:
+            qid, e = next(iter(self._judge_failures.items()))
+            warnings.warn(
+                f"The LLM judge failed to grade {len(self._judge_failures)} answer(s) after retrying, which were"
+                f" scored 0 (e.g. question ID {qid}: {e!r})."
+            )
+
+        # like Scorer.score_bleurt, unanswered questions get the BLEURT score of an empty answer
+        qa_pairs = list(self.get_qa_pairs())
+        missing = [q for q, a in qa_pairs if a is None]
+        if missing:
+            references = self.references
+            scores = await asyncio.to_thread(
+                score_bleurt_pairs,
+                [references.answers[q.id] for q in missing],
+                [""] * len(missing),
+                self._get_bleurt,
+                batch_size=self.bleurt_batch_size,
+            )
+            self._missing_bleurt = {q.id: score for q, score in zip(missing, scores)}
+        eval_len = len(self.answers) if self.only_score_answered else len(self.questions)
+        return self._summarize(qa_pairs, eval_len)
+
+    def _summarize(self, qa_pairs, eval_len: int) -> EvaluationScore:
+        """Aggregate the per-question scores the same way as :meth:`.Scorer.score`."""
+        accs = {}
+        rouges = {}
+        bleurts = {}
+        gpts = {}
+        for q, a in qa_pairs:
+            if a is None:
+                accs[q.id] = (0, False)
+                rouges[q.id] = None
+                bleurts[q.id] = self._missing_bleurt[q.id]
+                gpts[q.id] = 0
+            else:
+                accs[q.id] = self._acc[q.id]
+                rouges[q.id] = self._rouge[q.id]
+                bleurts[q.id] = self._bleurt[q.id]
+                gpts[q.id] = self._gpt.get(q.id, 0)
+        # like _no_gpt_score, without an API key there are no per-question judgments
+        gpt, gpts = (_mean(gpts, eval_len), gpts) if OPENAI_API_KEY else (0, {})
+        acc, acc_raw = _summarize_accuracy(accs, eval_len)
+        rouge, rouge_raw = _summarize_rouge(rouges, eval_len)
+        return _evaluation_score(
+            list(accs), acc, acc_raw, rouge, rouge_raw, _mean(bleurts, eval_len), bleurts, gpt, gpts
+        )
+
+    # ==== scoring ====
+    def _start(self):
+        if self._worker is None:
+            # require FANOUTQA_OPENAI_API_KEY to be set to do GPT judge to prevent footguns
+            if not OPENAI_API_KEY:
+                warnings.warn(
+                    "No OpenAI API key found! To run GPT-as-judge scoring, set the `FANOUTQA_OPENAI_API_KEY` env var"
+                    " to your OpenAI API key."
+                )
+            self._progress = _JudgeProgress(0)
+            self._wakeup = asyncio.Event()
+            self._judge_sem = asyncio.Semaphore(self.llm_concurrency)
+            self._worker = asyncio.create_task(self._metric_worker())
+
+    async def _metric_worker(self):
+        """Score the waiting answers' string metrics and BLEURT in a thread, as many at a time as are waiting."""
+        while True:
+            if not self._pending:
+                if self._finished:
+                    return
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            batch, self._pending = self._pending, []
+            results = await asyncio.to_thread(self._score_batch, batch)
+            for (qid, _, version), (acc, rouge, bleurt_) in zip(batch, results):
+                # the answer was replaced while it was being scored; its replacement is waiting in the next batch
+                if self._versions[qid] != version:
+                    continue
+                self._acc[qid] = acc
+                self._rouge[qid] = rouge
+                self._bleurt[qid] = bleurt_
+
+    def _score_batch(self, batch: list[tuple[str, str, int]]) -> list[tuple]:
+        references = self.references
+        questions = [self.questions_by_id[qid] for qid, _, _ in batch]
+        answers = [answer for _, answer, _ in batch]
+        accs = answer_in_text_many(
+            ((q.answer, answer) for q, answer in zip(questions, answers)),
+            norm_answers=(references.norm_answers[q.id] for q in questions),
+        )
+        rouges = rouge_score_many(
+            [references.rouge_tokens[q.id] for q in questions], [rouge_tokenize(str_answer(a)) for a in answers]
+        )
+        bleurts = score_bleurt_pairs(
+            [references.answers[q.id] for q in questions],
+            [str_answer(a) for a in answers],
+            self._get_bleurt,
+            batch_size=self.bleurt_batch_size,
+        )
+        return [((acc.score, acc.found), rouge, bleurt_) for acc, rouge, bleurt_ in zip(accs, rouges, bleurts)]
+
+    def _judge_done(self, task: asyncio.Task):
+        self._judge_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None and self._judge_error is None:
+            self._judge_error = task.exception()
+
+    async def _judge_one(self, q: DevQuestion, answer: str, version: int):
+        # sometimes we have fun neural text degeneration, just cut it off
+        if len(answer) > 4000:
+            warnings.warn(f"The answer to question ID {q.id} is too long, trimming it to 4000 characters.")
+            answer = answer[:4000]
+        async with self._judge_sem:
+            if self._engine is None:
+                self._engine = make_engine(self.llm_rpm, self.llm_tpm, self.llm_timeout)
+            try:
+                result = await self._judge(q, answer, self._engine, self._progress)
+            except Exception as e:
+                if self._should_raise(e):
+                    raise
+                score = 0
+                failed = True
+                if self._versions[q.id] == version:
+                    self._judge_failures[q.id] = e
+            else:
+                # B, C, E = full score, anything else = 0
+                score = 1 if result.strip()[-1:].lower() in ("b", "c", "e") else 0
+                failed = False
+                if self._versions[q.id] == version:
+                    self._judge_failures.pop(q.id, None)
+        if self._versions[q.id] == version:
+            self._gpt[q.id] = score
+        self._progress.done(failed=failed)
@@ -1,19 +1,79 @@
 import itertools
-import re
 from collections import namedtuple
+from typing import Container, Iterable, Iterator, Optional
 
+from fanoutqa.eval.matcher import WordBoundaryMatcher
 from fanoutqa.models import AnswerType
-from fanoutqa.norm import normalize
+from fanoutqa.norm import normalize_many
 
 AccuracyResult = namedtuple("AccuracyResult", "found score missing")
 
 
 def answer_in_text(reference: AnswerType, candidate: str) -> AccuracyResult:
     """What proportion of answer strings found in the reference can also be found in the candidate?"""
+    return answer_in_text_many([(reference, candidate)])[0]
+
+
+def answer_in_text_many(
+    pairs: Iterable[tuple[AnswerType, str]], norm_answers: Optional[Iterable[list[str]]] = None
+) -> list[AccuracyResult]:
+    """
+    Like :func:`answer_in_text`, for many (reference, candidate) pairs at once. The output is the same as
+    ``[answer_in_text(reference, candidate) for reference, candidate in pairs]``.
+
+    Every candidate and answer string is normalized in one batch, and each candidate is then scanned once for all of
+    its reference's answer strings (see :class:`.WordBoundaryMatcher`).
+
+    :param pairs: The (reference, candidate) pairs to score
+    :param norm_answers: The normalized answer strings of each pair's reference, if they are already known (e.g. from
+        :class:`.ReferenceArtifacts`), so that only the candidates are normalized
+    """
+    pairs = list(pairs)
+    if norm_answers is None:
+        texts = []
+        n_answers = []
+        for reference, candidate in pairs:
+            answers = list(_answer_strings(reference))
+            texts.append(candidate)
+            texts.extend(answers)
+            n_answers.append(len(answers))
+        normalized = iter(normalize_many(texts))
+        norm_pairs = []
+        for n in n_answers:
+            norm_cand = next(normalized)
+            norm_pairs.append((norm_cand, list(itertools.islice(normalized, n))))
+    else:
+        norm_pairs = list(zip(normalize_many(candidate for _, candidate in pairs), norm_answers))
+
+    results = []
+    for (reference, _), (norm_cand, answers) in zip(pairs, norm_pairs):
+        found = WordBoundaryMatcher(answers).find(norm_cand)
+        results.append(_answer_in_normalized(reference, iter(answers), found))
+    return results
+
+
+def _answer_strings(reference: AnswerType):
+    """Yield each primitive answer in the reference as a string, in the order :func:`_answer_in_normalized` visits
+    them."""
+    if isinstance(reference, list):
+        for a in reference:
+            yield from _answer_strings(a)
+    elif isinstance(reference, dict):
+        for a in itertools.chain(reference.keys(), reference.values()):
+            yield from _answer_strings(a)
+    elif isinstance(reference, bool):
+        yield "yes" if reference else "no"
+    else:
+        yield reference
+
+
+def _answer_in_normalized(reference: AnswerType, norm_answers: Iterator[str], found: Container[str]) -> AccuracyResult:
+    """Score the reference given its normalized answer strings, in order, and the set of those found in the
+    candidate."""
     if isinstance(reference, list):
         missing = []
         for a in reference:
-            result = answer_in_text(a, candidate)
+            result = _answer_in_normalized(a, norm_answers, found)
             missing.extend(result.missing)
         n_found = len(reference) - len(missing)
         return AccuracyResult(found=n_found == len(reference), score=n_found / len(reference), missing=missing)
@@ -21,18 +81,15 @@ def answer_in_text(reference: AnswerType, candidate: str) -> AccuracyResult:
         missing = []
         vals = itertools.chain(reference.keys(), reference.values())
         for a in vals:
-            result = answer_in_text(a, candidate)
+            result = _answer_in_normalized(a, norm_answers, found)
             missing.extend(result.missing)
         n_ref = len(reference) * 2
         n_found = n_ref - len(missing)  # kvs
         return AccuracyResult(found=n_found == n_ref, score=n_found / n_ref, missing=missing)
     else:
-        if isinstance(reference, bool):
-            reference = "yes" if reference else "no"
         # primitive
-        norm_ans = normalize(reference)
-        norm_cand = normalize(candidate)
-        # ensure the answer is surrounded by word boundaries
-        if not re.search(rf"\b{re.escape(norm_ans)}\b", norm_cand):
+        norm_ans = next(norm_answers)
+        # the answer must be surrounded by word boundaries
+        if norm_ans not in found:
             return AccuracyResult(found=False, score=0, missing=[norm_ans])
     return AccuracyResult(found=True, score=1, missing=[])
@@ -1,30 +1,184 @@
+import hashlib
+import importlib.metadata
+import itertools
 import logging
+import os
 import re
+import threading
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional
 
 import ftfy
 
+from .norm_cache import NormalizeCache
+from .sqlite_cache import default_cache
+
+if TYPE_CHECKING:
+    from .norm_pool import NormalizePool
+
 log = logging.getLogger(__name__)
 
 
 class LazySpacy:
-    """Lazily load the spacy pipeline when needed to save memory."""
+    """
+    Lazily load the spacy pipeline when needed to save memory.
+
+    The pipeline is only loaded once, even if several threads need it at the same time.
+    """
 
-    def __init__(self, model: str):
+    def __init__(self, model: str, exclude: Iterable[str] = ()):
+        """
+        :param model: The name of the spacy pipeline to load
+        :param exclude: The names of pipeline components to exclude when loading, if they are not needed
+        """
         self.model = model
+        self.exclude = list(exclude)
         self.pipe = None
+        self._load_lock = threading.Lock()
+        self._versions = None
+
+    def load(self):
+        """Load the pipeline, if it has not been loaded yet."""
+        if self.pipe is None:
+            with self._load_lock:
+                if self.pipe is None:
+                    self._load_pipe()
 
     def _load_pipe(self):
         import spacy
 
-        self.pipe = spacy.load("en_core_web_sm")
+        self.pipe = spacy.load(self.model, exclude=self.exclude)
+
+    @property
+    def packages(self) -> tuple[str, ...]:
+        """The names of the packages whose versions can change the pipeline's output."""
+        return "spacy", self.model
+
+    def versions(self) -> str:
+        """
+        The installed version of each of :attr:`packages`, without loading the pipeline (e.g. to invalidate cached
+        output when the model is upgraded).
+        """
+        if self._versions is None:
+            versions = []
+            for package in self.packages:
+                try:
+                    versions.append(f"{package}=={importlib.metadata.version(package)}")
+                except importlib.metadata.PackageNotFoundError:
+                    versions.append(f"{package} (not installed)")
+            self._versions = ",".join(versions)
+        return self._versions
 
     def __call__(self, *args, **kwargs):
-        if self.pipe is None:
-            self._load_pipe()
+        self.load()
         return self.pipe(*args, **kwargs)
 
+    def stream(self, texts: Iterable[str], batch_size: int = 256, n_process: int = 1):
+        """Process the given texts in batches with ``Language.pipe``, yielding a Doc for each text, in order."""
+        self.load()
+        return self.pipe.pipe(texts, batch_size=batch_size, n_process=n_process)
+
+
+class LazyLookupLemmatizer(LazySpacy):
+    """
+    Lazily create a blank spacy pipeline that lemmatizes each token with a lookup table, ignoring its part of speech.
+
+    This is much faster than the statistical pipeline and does not need a model, but is slightly less accurate (e.g.
+    it cannot tell the noun "saw" from the verb).
+    """
+
+    def __init__(self, lang: str = "en"):
+        super().__init__(model=lang)
+
+    def _load_pipe(self):
+        import spacy
+
+        try:
+            import spacy_lookups_data  # noqa: F401
+        except ImportError as e:
+            raise ImportError(
+                "Using the lookup normalizer requires the spacy-lookups-data package. Use `pip install"
+                " fanoutqa[lookup]`."
+            ) from e
+
+        pipe = spacy.blank(self.model)
+        pipe.add_pipe("lemmatizer", config={"mode": "lookup"})
+        pipe.initialize()
+        self.pipe = pipe
+
+    @property
+    def packages(self) -> tuple[str, ...]:
+        return "spacy", "spacy-lookups-data"
+
+
+NORMALIZE_ENGINES = {
+    # lemmatization only needs the tagger, attribute ruler, and lemmatizer (and the tok2vec layer the tagger listens to)
+    "spacy": LazySpacy("en_core_web_sm", exclude=("parser", "ner")),
+    "lookup": LazyLookupLemmatizer("en"),
+}
+nlp = NORMALIZE_ENGINES["spacy"]
+
+
+def set_normalize_engine(engine: str) -> str:
+    """
+    Set the lemmatization engine used by :func:`normalize` and :func:`normalize_many`, and return the name of the
+    previous engine. The default engine can also be set with the ``FANOUTQA_NORMALIZE_ENGINE`` env var. The engine is
+    shared by every thread in the process, so set it before starting any threads that normalize text.
+
+    - ``"spacy"`` (default): lemmatize with the ``en_core_web_sm`` pipeline, using each token's part of speech
+    - ``"lookup"``: lemmatize with a lookup table, with no model to load; many times faster, but may disagree with the
+      default engine on a small number of words. Use ``benchmarks/normalize_agreement.py`` to measure the difference.
+
+    :param engine: The name of the engine to use
+    """
+    global nlp
+    if engine not in NORMALIZE_ENGINES:
+        raise ValueError(f"Unknown normalize engine {engine!r} (expected one of {list(NORMALIZE_ENGINES)})")
+    previous = get_normalize_engine()
+    nlp = NORMALIZE_ENGINES[engine]
+    return previous
+
+
+def get_normalize_engine() -> str:
+    """Return the name of the lemmatization engine currently used by :func:`normalize`."""
+    return next(name for name, engine in NORMALIZE_ENGINES.items() if engine is nlp)
+
+
+set_normalize_engine(os.getenv("FANOUTQA_NORMALIZE_ENGINE", "spacy"))
 
-nlp = LazySpacy("en_core_web_sm")
+# bump this whenever a change to normalize() could change its output, to invalidate the on-disk normalize cache
+NORMALIZE_VERSION = 1
+normalize_cache: Optional[NormalizeCache] = default_cache("FANOUTQA_NORMALIZE_CACHE", NormalizeCache)
+
+
+def set_normalize_cache(cache: Optional[NormalizeCache]) -> Optional[NormalizeCache]:
+    """
+    Set the memo cache used by :func:`normalize` and :func:`normalize_many` (or None to disable caching), and return
+    the previous cache. By default, a :class:`.NormalizeCache` stored in ``~/.cache/fanoutqa`` is used; set the
+    ``FANOUTQA_NORMALIZE_CACHE`` env var to 0 to disable it.
+    """
+    global normalize_cache
+    previous = normalize_cache
+    normalize_cache = cache
+    return previous
+
+
+normalize_pool: Optional["NormalizePool"] = None
+
+
+def set_normalize_pool(pool: Optional["NormalizePool"]) -> Optional["NormalizePool"]:
+    """
+    Send all normalization in this process to the given :class:`.NormalizePool` (or None to normalize in this process
+    again), and return the previous pool. Using the pool as a context manager does this automatically.
+    """
+    global normalize_pool
+    previous = normalize_pool
+    normalize_pool = pool
+    return previous
+
+
+def _cache_key(text: str, remove_stopwords: bool) -> str:
+    data = f"{NORMALIZE_VERSION}\0{get_normalize_engine()}\0{nlp.versions()}\0{int(remove_stopwords)}\0{text}"
+    return hashlib.sha256(data.encode("utf-8", "surrogatepass")).hexdigest()
 
 
 def normalize(text, remove_stopwords=False):
@@ -36,11 +190,83 @@ def normalize(text, remove_stopwords=False):
     - remove stopwords (optional)
     - remove punctuation
     - remove redundant whitespace
+
+    Results are memoized in memory and on disk (see :func:`set_normalize_cache`).
+    """
+    cache = normalize_cache
+    if cache is None:
+        return _normalize(text, remove_stopwords)
+    key = _cache_key(str(text), remove_stopwords)
+    normalized = cache.get_many([key])[0]
+    if normalized is None:
+        normalized = _normalize(text, remove_stopwords)
+        cache.put_many([(key, normalized)])
+    return normalized
+
+
+def _normalize(text, remove_stopwords=False):
+    if normalize_pool is not None:
+        return normalize_pool.normalize_many([text], remove_stopwords)[0]
+    text = _pre_lemmatize(text)
+    text = lemmatize(text, remove_stopwords=remove_stopwords)
+    return _post_lemmatize(text)
+
+
+def normalize_many(
+    texts: Iterable[str], remove_stopwords=False, batch_size: int = 256, n_process: int = 1
+) -> list[str]:
     """
+    Normalize many strings at once. The output is the same as ``[normalize(text) for text in texts]``, but the texts
+    are streamed through the spacy pipeline in batches, which is much faster.
+
+    :param texts: The strings to normalize
+    :param remove_stopwords: Whether to remove stopwords
+    :param batch_size: The number of texts to process in each batch
+    :param n_process: The number of processes to use for lemmatization (see ``spacy.Language.pipe``)
+    """
+    return list(iter_normalize(texts, remove_stopwords, batch_size, n_process))
+
+
+def iter_normalize(
+    texts: Iterable[str], remove_stopwords=False, batch_size: int = 256, n_process: int = 1
+) -> Iterator[str]:
+    """Like :func:`normalize_many`, but lazily yields each normalized string in order."""
+    cache = normalize_cache
+    if cache is None:
+        yield from _iter_normalize(texts, remove_stopwords, batch_size, n_process)
+        return
+
+    # look up the cached strings a block at a time, and only stream the rest through the pipeline
+    texts = iter(texts)
+    while block := [str(text) for text in itertools.islice(texts, batch_size * 4)]:
+        keys = [_cache_key(text, remove_stopwords) for text in block]
+        normalized = cache.get_many(keys)
+        misses = [idx for idx, value in enumerate(normalized) if value is None]
+        if misses:  # don't load the pipeline at all if everything is cached
+            computed = _iter_normalize((block[idx] for idx in misses), remove_stopwords, batch_size, n_process)
+            for idx, value in zip(misses, computed):
+                normalized[idx] = value
+            cache.put_many((keys[idx], normalized[idx]) for idx in misses)
+        yield from normalized
+
+
+def _iter_normalize(texts: Iterable[str], remove_stopwords, batch_size: int, n_process: int) -> Iterator[str]:
+    if normalize_pool is not None:
+        yield from normalize_pool.normalize_many(texts, remove_stopwords)
+        return
+    docs = nlp.stream((_pre_lemmatize(text) for text in texts), batch_size=batch_size, n_process=n_process)
+    for doc in docs:
+        yield _post_lemmatize(_join_lemmas(doc, remove_stopwords))
+
+
+def _pre_lemmatize(text) -> str:
     text = str(text).lower()
     text = ftfy.fix_text(text)
     text = normalize_numbers(text)
-    text = lemmatize(text, remove_stopwords=remove_stopwords)
+    return text
+
+
+def _post_lemmatize(text: str) -> str:
     text = remove_punct(text)
     text = normalize_whitespace(text)
     return text
@@ -55,7 +281,10 @@ def normalize_numbers(text: str):
 
 def lemmatize(text: str, remove_stopwords=False):
     """Return a normalized string with each word replaced by its lemmatized version."""
-    doc = nlp(text)
+    return _join_lemmas(nlp(text), remove_stopwords)
+
+
+def _join_lemmas(doc, remove_stopwords=False) -> str:
     if remove_stopwords:
         return " ".join(tok.lemma_ for tok in doc if not tok.is_stop)
     return " ".join(tok.lemma_ for tok in doc)
@@ -0,0 +1,128 @@
+"""A bounded in-memory and persistent on-disk memo of normalized strings."""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from .sqlite_cache import SQLiteCache
+from .utils import CACHE_DIR, AnyPath
+
+NORMALIZE_CACHE_PATH = CACHE_DIR / "normcache.sqlite3"
+
+
+@dataclass
+class NormalizeCacheStats:
+    memory_hits: int = 0
+    """The number of lookups found in memory."""
+
+    disk_hits: int = 0
+    """The number of lookups found on disk (and not in memory)."""
+
+    misses: int = 0
+    """The number of lookups that had to be normalized."""
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of lookups that did not have to be normalized."""
+        total = self.memory_hits + self.disk_hits + self.misses
+        if not total:
+            return 0
+        return (self.memory_hits + self.disk_hits) / total
+
+
+class NormalizeCache(SQLiteCache):
+    """
+    Memoizes normalized strings by key: the most recently used entries are kept in memory, and every entry is also
+    stored in a SQLite database on disk so that later runs (e.g. re-scoring a submission) only normalize new text. The
+    database holds at most ``max_disk_entries`` entries; once it grows past that, the oldest entries are removed.
+
+    :func:`fanoutqa.norm.normalize` and :func:`fanoutqa.norm.normalize_many` use a process-wide cache by default; see
+    :func:`fanoutqa.norm.set_normalize_cache`.
+    """
+
+    table = "normcache"
+    columns = "value TEXT NOT NULL"
+
+    def __init__(
+        self,
+        path: Optional[AnyPath] = NORMALIZE_CACHE_PATH,
+        max_memory_entries: int = 100_000,
+        max_disk_entries: Optional[int] = 1_000_000,
+    ):
+        """
+        :param path: The path to the SQLite database to store entries in (created if it does not exist), or None to only
+            keep entries in memory
+        :param max_memory_entries: The maximum number of entries to keep in memory
+        :param max_disk_entries: The maximum number of entries to keep on disk, or None for no limit
+        """
+        super().__init__(path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.stats = NormalizeCacheStats()
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        # the database is shared with other processes, so count its rows every so often instead of tracking them
+        self._writes_since_prune = 0
+
+    def get_many(self, keys: list[str]) -> list[Optional[str]]:
+        """Return the cached value of each key, or None for keys that are not cached."""
+        with self._lock:
+            out = []
+            not_in_memory = []
+            for idx, key in enumerate(keys):
+                value = self._memory.get(key)
+                if value is not None:
+                    self._memory.move_to_end(key)
+                    self.stats.memory_hits += 1
+                else:
+                    not_in_memory.append(idx)
+                out.append(value)
+
+            if not_in_memory and self.path is not None:
+                found = self._select_many("value", [keys[idx] for idx in not_in_memory])
+                for idx in not_in_memory:
+                    value = found.get(keys[idx])
+                    if value is not None:
+                        out[idx] = value
+                        self._remember(keys[idx], value)
+                        self.stats.disk_hits += 1
+            self.stats.misses += sum(1 for value in out if value is None)
+            return out
+
+    def put_many(self, items: Iterable[tuple[str, str]]):
+        """Cache the given (key, value) pairs."""
+        items = list(items)
+        with self._lock:
+            for key, value in items:
+                self._remember(key, value)
+            if items and self.path is not None:
+                conn = self._connection()
+                with conn:
+                    conn.executemany("INSERT OR REPLACE INTO normcache (key, value) VALUES (?, ?)", items)
+                self._writes_since_prune += len(items)
+                if self.max_disk_entries is not None and self._writes_since_prune >= self.max_disk_entries // 10:
+                    self._prune()
+
+    def clear(self):
+        """Remove every entry from the cache, in memory and on disk."""
+        with self._lock:
+            self._memory.clear()
+        super().clear()
+
+    # ==== helpers ====
+    def _remember(self, key: str, value: str):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _prune(self):
+        conn = self._connection()
+        n_entries = conn.execute("SELECT COUNT(*) FROM normcache").fetchone()[0]
+        if n_entries > self.max_disk_entries:
+            # rows are replaced rather than updated, so the lowest rowids are the oldest entries
+            with conn:
+                conn.execute(
+                    "DELETE FROM normcache WHERE rowid IN (SELECT rowid FROM normcache ORDER BY rowid LIMIT ?)",
+                    (n_entries - self.max_disk_entries,),
+                )
+        self._writes_since_prune = 0
@@ -0,0 +1,114 @@
+"""A pool of normalization worker processes that share one copy of the spaCy pipeline."""
+
+import gc
+import multiprocessing
+import os
+import warnings
+from typing import Iterable
+
+from . import norm
+
+
+class NormalizePool:
+    """
+    A pool of worker processes for :func:`fanoutqa.norm.normalize`. The spaCy pipeline is loaded once in this process,
+    then the workers are forked from it and share the pipeline's memory copy-on-write, so adding workers adds almost no
+    memory.
+
+    While the pool is active (inside a ``with`` block, or after :func:`fanoutqa.norm.set_normalize_pool`), every call to
+    :func:`~fanoutqa.norm.normalize` and :func:`~fanoutqa.norm.normalize_many` in this process - including those made
+    by :class:`.Corpus` and the accuracy metric - is sent to the pool, and this process never runs the pipeline itself.
+    The normalize cache is still checked in this process first, so only uncached texts are sent to the workers.
+
+    .. code-block:: python
+
+        with NormalizePool(processes=8):
+            corpora = [Corpus(q.necessary_evidence) for q in questions]
+
+    Forking requires a POSIX platform; where it is not available, the workers are spawned instead and each load their
+    own copy of the pipeline.
+
+    Starting the pool runs a full garbage collection in this process and briefly freezes every object in it (see
+    ``gc.freeze``) while the workers are forked; the objects are unfrozen again as soon as the workers have started.
+    """
+
+    def __init__(self, processes: int = None, batch_size: int = 64):
+        """
+        :param processes: The number of worker processes (defaults to the number of CPUs)
+        :param batch_size: The number of texts to send to a worker at a time
+        """
+        self.processes = processes or os.cpu_count()
+        self.batch_size = batch_size
+        self._pool = None
+        self._previous_pool = None
+
+    def start(self):
+        """Load the pipeline and fork the workers, if they have not been started yet."""
+        if self._pool is not None:
+            return
+        if "fork" not in multiprocessing.get_all_start_methods():
+            warnings.warn(
+                "Forking is not available on this platform, so each normalization worker will load its own copy of the"
+                " spaCy pipeline."
+            )
+            self._pool = multiprocessing.get_context("spawn").Pool(self.processes, initializer=_init_worker)
+            return
+
+        # load the pipeline before forking so the workers inherit it...
+        norm.nlp.load()
+        # ...and move everything so far out of the GC's reach, so that collections in the workers don't write to (and
+        # so copy) the pages holding the pipeline
+        gc.collect()
+        gc.freeze()
+        try:
+            self._pool = multiprocessing.get_context("fork").Pool(self.processes, initializer=_init_worker)
+        finally:
+            # the workers keep their frozen copy; this process goes back to collecting everything as usual
+            gc.unfreeze()
+
+    def normalize_many(self, texts: Iterable[str], remove_stopwords=False) -> list[str]:
+        """
+        Normalize the given texts in the workers, bypassing the normalize cache. Most callers should use
+        :func:`fanoutqa.norm.normalize_many` while the pool is active instead.
+        """
+        self.start()
+        texts = [str(text) for text in texts]
+        engine = norm.get_normalize_engine()
+        batches = [
+            (texts[start : start + self.batch_size], remove_stopwords, engine)
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        out = []
+        for normalized in self._pool.imap(_normalize_batch, batches):
+            out.extend(normalized)
+        return out
+
+    def close(self):
+        """Stop the workers."""
+        if self._pool is None:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+    def __enter__(self):
+        self.start()
+        self._previous_pool = norm.set_normalize_pool(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        norm.set_normalize_pool(self._previous_pool)
+        self.close()
+
+
+# ==== worker ====
+def _init_worker():
+    # the workers normalize in-process, of course, and the parent has already checked the cache
+    norm.set_normalize_pool(None)
+    norm.set_normalize_cache(None)
+
+
+def _normalize_batch(args: tuple[list[str], bool, str]) -> list[str]:
+    texts, remove_stopwords, engine = args
+    norm.set_normalize_engine(engine)
+    return list(norm.iter_normalize(texts, remove_stopwords))
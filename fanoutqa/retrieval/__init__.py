@@ -0,0 +1,17 @@
+"""This module contains a baseline implementation of a retriever for use with long Wikipedia articles"""
+
+try:
+    import numpy as np
+    from rank_bm25 import BM25Plus
+except ImportError as e:
+    raise ImportError(
+        "Using the baseline retriever requires the rank_bm25 package. Use `pip install fanoutqa[retrieval]`."
+    ) from e
+
+from .bm25 import IncrementalBM25Plus
+from .cache import RankingCache
+from .chunking import chunk_spans, chunk_text, sentence_spans
+from .corpus import CompressionResult, Corpus, MultiRetrievalResult, RetrievalResult
+from .diskindex import DiskIndex, cached_evidence
+from .prompts import PromptArtifact, build_evidence_prompts
+from .registry import PageRegistry, RegistryStats, page_registry
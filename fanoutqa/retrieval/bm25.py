@@ -0,0 +1,75 @@
+import math
+from collections.abc import Mapping
+from typing import Iterable
+
+from rank_bm25 import BM25Plus
+
+
+class IncrementalBM25Plus(BM25Plus):
+    """
+    A :class:`rank_bm25.BM25Plus` index that supports adding and removing documents after it is created.
+
+    The document frequency of each term, the document lengths, and the average document length are updated as
+    documents are added and removed; the IDF of each term is computed from its document frequency when it is looked
+    up, so no statistics need to be recomputed over the whole index.
+    """
+
+    # noinspection PyMissingConstructor
+    def __init__(self, corpus: Iterable[list[str]] = (), k1=1.5, b=0.75, delta=1):
+        # we don't call BM25.__init__ since it divides by the size of the initial corpus, which may be empty here
+        self.k1 = k1
+        self.b = b
+        self.delta = delta
+        self.tokenizer = None
+        self.corpus_size = 0
+        self.avgdl = 0
+        self.doc_freqs = []
+        self.doc_len = []
+        self.nd = {}  # word -> number of documents with word
+        self.total_len = 0
+        self.idf = _BM25PlusIdf(self)
+        self.add_documents(corpus)
+
+    def add_documents(self, corpus: Iterable[list[str]]):
+        """Add the given tokenized documents to the end of the index."""
+        for document in corpus:
+            frequencies = {}
+            for word in document:
+                frequencies[word] = frequencies.get(word, 0) + 1
+            for word in frequencies:
+                self.nd[word] = self.nd.get(word, 0) + 1
+            self.doc_freqs.append(frequencies)
+            self.doc_len.append(len(document))
+            self.total_len += len(document)
+            self.corpus_size += 1
+        self.avgdl = self.total_len / self.corpus_size if self.corpus_size else 0
+
+    def remove_documents(self, idxs: Iterable[int]):
+        """Remove the documents at the given indices from the index. Later documents' indices shift down to fill."""
+        idxs = set(idxs)
+        for idx in idxs:
+            for word in self.doc_freqs[idx]:
+                self.nd[word] -= 1
+                if not self.nd[word]:
+                    del self.nd[word]
+            self.total_len -= self.doc_len[idx]
+        self.doc_freqs = [freqs for idx, freqs in enumerate(self.doc_freqs) if idx not in idxs]
+        self.doc_len = [n for idx, n in enumerate(self.doc_len) if idx not in idxs]
+        self.corpus_size = len(self.doc_freqs)
+        self.avgdl = self.total_len / self.corpus_size if self.corpus_size else 0
+
+
+class _BM25PlusIdf(Mapping):
+    """A read-only view of the BM25+ IDF of each word in an index, computed from the current document frequencies."""
+
+    def __init__(self, index: IncrementalBM25Plus):
+        self.index = index
+
+    def __getitem__(self, word):
+        return math.log((self.index.corpus_size + 1) / self.index.nd[word])
+
+    def __iter__(self):
+        return iter(self.index.nd)
+
+    def __len__(self):
+        return len(self.index.nd)
@@ -0,0 +1,79 @@
+"""A persistent on-disk cache of the rankings of a corpus's fragments against queries."""
+
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+import numpy as np
+
+from fanoutqa.norm import NORMALIZE_ENGINES, NORMALIZE_VERSION, get_normalize_engine
+from fanoutqa.utils import CACHE_DIR, AnyPath
+
+RANKING_CACHE_DIR = CACHE_DIR / "rankings"
+
+# bump this whenever a change to tokenization, chunking, or scoring could change the ranking of a corpus
+RETRIEVER_VERSION = 2
+
+
+class RankingCache:
+    """
+    Caches the ranked fragment indices of a :class:`.Corpus` against each query on disk, keyed by the corpus's content
+    fingerprint (see :attr:`.Corpus.fingerprint`), the query, the retriever version, and the normalize engine and the
+    versions of the packages it uses.
+
+    A corpus with the same pages and chunk length always has the same fingerprint, so rebuilding prompts with the same
+    questions and evidence (e.g. after a prompt template change) skips tokenizing the corpus and queries and scoring
+    entirely.
+
+    .. code-block:: python
+
+        cache = RankingCache()
+        corpus = fanoutqa.retrieval.Corpus(q.necessary_evidence, ranking_cache=cache)
+        for fragment in corpus.best(q.question):
+            ...
+    """
+
+    def __init__(self, path: AnyPath = RANKING_CACHE_DIR):
+        """
+        :param path: The directory to store cached rankings in (defaults to ``~/.cache/fanoutqa/rankings``)
+        """
+        self.path = os.fspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fingerprint: str, q: str) -> Optional[np.ndarray]:
+        """Return the cached ranking of the corpus with the given fingerprint against the query, or None."""
+        try:
+            ranking = np.load(self._path(fingerprint, q))
+        except (FileNotFoundError, ValueError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return ranking
+
+    def put(self, fingerprint: str, q: str, ranking: np.ndarray):
+        """Cache the ranking of the corpus with the given fingerprint against the query."""
+        fp = self._path(fingerprint, q)
+        # write to a temporary file first so concurrent readers never see a partial file
+        fd, tmp_fp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, np.asarray(ranking, dtype=np.int32))
+            os.replace(tmp_fp, fp)
+        except BaseException:
+            os.unlink(tmp_fp)
+            raise
+
+    def _path(self, fingerprint: str, q: str) -> str:
+        # rankings depend on the tokens, so they are invalidated whenever the normalize cache would be
+        engine = get_normalize_engine()
+        version = f"{RETRIEVER_VERSION}-{NORMALIZE_VERSION}-{engine}-{NORMALIZE_ENGINES[engine].versions()}"
+        key = hashlib.sha256(f"{version}\0{fingerprint}\0{_cache_query(q)}".encode()).hexdigest()
+        return os.path.join(self.path, f"{key}.npy")
+
+
+def _cache_query(q: str) -> str:
+    # normalize() lowercases before anything else, so queries that differ only in case always rank the same
+    return str(q).lower()
@@ -0,0 +1,193 @@
+"""Utilities to split long documents into chunks, preferring to split on paragraph and sentence boundaries."""
+
+import re
+
+# a sentence ends at a line break, or at whitespace after sentence-final punctuation
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def chunk_text(text, max_chunk_size=1024, chunk_on=("\n\n", "\n", ". ", ", ", " "), chunker_i=0):
+    """
+    Chunks *text* into a list of str, with each element no longer than *max_chunk_size*.
+    Prefers splitting on the elements of *chunk_on*, in order.
+
+    To get the chunks as offsets into *text* instead of copies of it, use :func:`chunk_spans`.
+    """
+    return [_parts_text(text, parts) for parts in _chunk_parts(text, max_chunk_size, chunk_on, chunker_i)]
+
+
+def chunk_spans(
+    text, max_chunk_size=1024, chunk_on=("\n\n", "\n", ". ", ", ", " "), chunker_i=0
+) -> list[tuple[int, int]]:
+    """
+    Like :func:`chunk_text`, but returns a list of ``(start, end)`` offsets into *text* instead of copying each chunk,
+    so that the text of each chunk can be materialized lazily with ``text[start:end]``.
+
+    The chunks are the same as those returned by :func:`chunk_text`, except where :func:`chunk_text` re-attaches a
+    separator that is not actually in the text (e.g. at the end of the last sentence of a long paragraph) and so
+    returns a chunk that is not a slice of the text - in these cases, the span covers the corresponding text instead.
+    """
+    spans = []
+    for parts in _chunk_parts(text, max_chunk_size, chunk_on, chunker_i):
+        offsets = [part for part in parts if isinstance(part, tuple)]
+        if offsets:
+            spans.append((offsets[0][0], offsets[-1][1]))
+        else:
+            end = spans[-1][1] if spans else 0
+            spans.append((end, end))
+    return spans
+
+
+def sentence_spans(text) -> list[tuple[int, int]]:
+    """
+    Split *text* into sentences (and lines), returning a list of ``(start, end)`` offsets into *text*. The whitespace
+    between sentences is not included in any span.
+    """
+    spans = []
+    start = 0
+    for match in _SENTENCE_BOUNDARY.finditer(text):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+# ==== chunking impl ====
+# The chunker splits the text on the first separator, splits any pieces that are still too long on the next separator,
+# and so on, greedily merging adjacent pieces. Rather than recursing and copying each piece, we walk the pieces
+# iteratively with an explicit stack and keep track of each chunk as a list of parts that are either (start, end)
+# offsets into the text, or literal separator characters - when splitting, each piece keeps the separator that follows
+# it, and the last piece of each split is followed by an extra separator that is usually trimmed back off at the end.
+# A piece is a (start, end, suffix) tuple: the text[start:end], followed by the literal suffix.
+def _chunk_parts(text, max_chunk_size, chunk_on, chunker_i):
+    if len(text) <= max_chunk_size:  # the text is small enough
+        return [[(0, len(text))]]
+
+    chunks = []
+    lengths = []
+
+    def add_chunk(piece, lo, hi):
+        chunks.append(_piece_parts(piece, lo, hi))
+        lengths.append(hi - lo)
+
+    def slice_piece(piece):
+        # we have no more preferred chunk_on characters, just use slicing
+        piece_len = _piece_len(piece)
+        for offset in range(0, piece_len, max_chunk_size):
+            add_chunk(piece, offset, min(offset + max_chunk_size, piece_len))
+
+    if chunker_i >= len(chunk_on):
+        slice_piece((0, len(text), ""))
+        return chunks
+
+    # each frame is (pieces, chunker_i, index of the first chunk it produced)
+    stack = [(_split_piece(text, (0, len(text), ""), chunk_on[chunker_i]), chunker_i, 0)]
+    while stack:
+        pieces, chunker_i, first_chunk = stack[-1]
+        for piece in pieces:
+            piece_start, piece_end, piece_suffix = piece
+            piece_len = piece_end - piece_start + len(piece_suffix)
+            if piece_len > max_chunk_size:  # this piece needs to be split more, descend into it
+                if chunker_i + 1 >= len(chunk_on):
+                    slice_piece(piece)
+                    continue
+                stack.append((_split_piece(text, piece, chunk_on[chunker_i + 1]), chunker_i + 1, len(chunks)))
+                break
+            elif len(chunks) > first_chunk and piece_len + lengths[-1] <= max_chunk_size:  # this piece can be merged
+                parts = chunks[-1]
+                if not piece_suffix and parts and isinstance(parts[-1], tuple) and parts[-1][1] == piece_start:
+                    parts[-1] = (parts[-1][0], piece_end)
+                else:
+                    _extend_parts(parts, _piece_parts(piece, 0, piece_len))
+                lengths[-1] += piece_len
+            else:
+                add_chunk(piece, 0, piece_len)
+        else:
+            # we're done with this split
+            stack.pop()
+            split_char = chunk_on[chunker_i]
+            # if the last chunk is just the split_char, yeet it
+            if (
+                len(chunks) > first_chunk + 1
+                and lengths[-1] == len(split_char)
+                and _parts_text(text, chunks[-1]) == split_char
+            ):
+                chunks.pop()
+                lengths.pop()
+            # remove extra split_char from last chunk
+            _trim_parts(chunks[-1], len(split_char))
+            lengths[-1] = max(lengths[-1] - len(split_char), 0)
+    return chunks
+
+
+def _split_piece(text, piece, split_char):
+    """Yield the pieces of the given piece split on *split_char*, each including the split_char that follows it."""
+    start, end, suffix = piece
+    pos = start
+    while (idx := text.find(split_char, pos, end)) >= 0:
+        yield pos, idx + len(split_char), ""
+        pos = idx + len(split_char)
+    if not suffix:
+        yield pos, end, split_char
+        return
+
+    # the rest of the piece may contain split_chars that overlap the suffix
+    n_text = end - pos
+    rest = text[pos:end] + suffix
+    offset = 0
+    while (idx := rest.find(split_char, offset)) >= 0:
+        next_offset = idx + len(split_char)
+        yield (
+            pos + min(offset, n_text),
+            pos + min(next_offset, n_text),
+            suffix[max(offset - n_text, 0) : max(next_offset - n_text, 0)],
+        )
+        offset = next_offset
+    yield pos + min(offset, n_text), end, suffix[max(offset - n_text, 0) :] + split_char
+
+
+def _piece_len(piece):
+    start, end, suffix = piece
+    return end - start + len(suffix)
+
+
+def _piece_parts(piece, lo, hi):
+    """Return the parts making up piece[lo:hi]."""
+    start, end, suffix = piece
+    n_text = end - start
+    parts = []
+    if lo < n_text and hi > lo:
+        parts.append((start + lo, start + min(hi, n_text)))
+    if hi > n_text:
+        parts.append(suffix[max(lo - n_text, 0) : hi - n_text])
+    return parts
+
+
+def _extend_parts(parts, other):
+    for part in other:
+        if parts and isinstance(part, tuple) and isinstance(parts[-1], tuple) and parts[-1][1] == part[0]:
+            parts[-1] = (parts[-1][0], part[1])
+        else:
+            parts.append(part)
+
+
+def _trim_parts(parts, n):
+    """Remove the last *n* characters from the given parts, in place."""
+    while n > 0 and parts:
+        part = parts[-1]
+        part_len = part[1] - part[0] if isinstance(part, tuple) else len(part)
+        if part_len <= n:
+            parts.pop()
+            n -= part_len
+        elif isinstance(part, tuple):
+            parts[-1] = (part[0], part[1] - n)
+            n = 0
+        else:
+            parts[-1] = part[:-n]
+            n = 0
+
+
+def _parts_text(text, parts):
+    return "".join(text[part[0] : part[1]] if isinstance(part, tuple) else part for part in parts)
@@ -0,0 +1,620 @@
+import hashlib
+import itertools
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from fanoutqa import norm
+from fanoutqa.models import Evidence
+from fanoutqa.norm import normalize, normalize_many
+from fanoutqa.retrieval.bm25 import IncrementalBM25Plus
+from fanoutqa.retrieval.cache import RankingCache
+from fanoutqa.retrieval.chunking import chunk_text, sentence_spans
+from fanoutqa.retrieval.registry import IndexedChunks, PageRegistry, _page_key, _with_title, page_registry
+from fanoutqa.wiki import wiki_content
+
+# the number of token counters whose counts are cached on each corpus (see Corpus.pack)
+_MAX_TOKEN_COUNTERS = 4
+
+
+@dataclass
+class RetrievalResult:
+    title: str
+    """The title of the article this fragment comes from."""
+
+    content: str
+    """The content of the fragment."""
+
+
+@dataclass
+class MultiRetrievalResult:
+    rankings: list[list[RetrievalResult]]
+    """The fragments of the corpus ranked against each query, in the same order as the queries."""
+
+    fused: Optional[list[RetrievalResult]]
+    """The reciprocal rank fusion of all the rankings, if requested."""
+
+
+@dataclass
+class CompressionResult:
+    fragments: list[RetrievalResult]
+    """The compressed fragments, in the same order as the given fragments. Fragments with no kept sentences are
+    omitted."""
+
+    original_size: int
+    """The total size of the given fragments, in tokens if a token counter was given, otherwise in characters."""
+
+    compressed_size: int
+    """The total size of the compressed fragments, in the same unit."""
+
+    @property
+    def ratio(self) -> float:
+        """The compression ratio achieved: the compressed size as a fraction of the original size."""
+        if not self.original_size:
+            return 1
+        return self.compressed_size / self.original_size
+
+
+class Corpus:
+    """
+    A corpus of wiki docs. Chunks the docs on creation, and tokenizes the chunks (normalizing the text beforehand with
+    lemmatization) the first time the index is used.
+
+    Splits the documents into chunks no longer than a given length, preferring splitting on paragraph and sentence
+    boundaries. Documents will be converted to Markdown.
+
+    Uses BM25+ (Lv and Zhai, 2011), a TF-IDF based approach to retrieve document fragments.
+
+    To retrieve chunks corresponding to a query, iterate over ``Corpus.best(query)``.
+
+    .. code-block:: python
+
+        # example of how to use in the Evidence Provided setting
+        prompt = "..."
+        corpus = fanoutqa.retrieval.Corpus(q.necessary_evidence)
+        for fragment in corpus.best(q.question):
+            # use your own structured prompt format here
+            prompt += f"# {fragment.title}\\n{fragment.content}\\n\\n"
+
+    A corpus is safe to share between threads: queries can run while other threads add or remove documents, and each
+    query ranks the corpus as it was either before or after each change. Pages are fetched and chunked, and queries are
+    tokenized, without holding the corpus's lock, so threads only wait for each other while scoring and while newly
+    added chunks are tokenized (the first time the index is used after adding them).
+    """
+
+    def __init__(
+        self,
+        documents: list[Evidence],
+        doc_len: int = 2048,
+        registry: Optional[PageRegistry] = page_registry,
+        ranking_cache: Optional[RankingCache] = None,
+    ):
+        """
+        :param documents: The list of evidences to index (may be empty; use :meth:`add` to index more documents later).
+            Each page is only indexed once, even if it appears in the list more than once.
+        :param doc_len: The maximum length, in characters, of each chunk
+        :param registry: The registry of indexed pages to reuse pages from, and to add newly indexed pages to (defaults
+            to a process-wide registry, see :class:`.PageRegistry`). If this is None, always index every page.
+        :param ranking_cache: If this is provided, cache the ranking of the corpus against each query on disk, so that
+            repeated queries against a corpus with the same contents skip tokenization and scoring (see
+            :class:`.RankingCache`).
+        """
+        self.registry = registry
+        self.ranking_cache = ranking_cache
+        self._init_index([], doc_len)
+        for doc in _dedupe(documents).values():
+            self._add_chunks(doc, *self._get_indexed(doc, doc_len))
+
+    @classmethod
+    def build_many(
+        cls,
+        evidence_lists: list[list[Evidence]],
+        doc_len: int = 2048,
+        max_workers: int = None,
+        registry: Optional[PageRegistry] = page_registry,
+        ranking_cache: Optional[RankingCache] = None,
+    ) -> list["Corpus"]:
+        """
+        Build one corpus for each list of evidences (e.g. the ``necessary_evidence`` of each question in a split).
+
+        Pages that appear in more than one list, or are already in the registry, are only fetched, chunked, and
+        tokenized once, and the work is spread across a pool of processes. Each returned corpus is the same as
+        ``Corpus(evidences, doc_len, registry)``.
+
+        .. code-block:: python
+
+            questions = fanoutqa.load_test()
+            corpora = Corpus.build_many([q.necessary_evidence for q in questions], doc_len=1024)
+            for q, corpus in zip(questions, corpora):
+                ...
+
+        :param evidence_lists: A list of lists of evidences to index
+        :param doc_len: The maximum length, in characters, of each chunk
+        :param max_workers: The number of processes to use (defaults to the number of CPUs). If this is 1, index the
+            pages in this process instead. The processes are spawned rather than forked, so the calling script must
+            guard its entry point with ``if __name__ == "__main__":``.
+        :param registry: The registry of indexed pages to reuse pages from, and to add newly indexed pages to
+        :param ranking_cache: The ranking cache each corpus should use, if any
+        """
+        unique_docs = _dedupe(itertools.chain.from_iterable(evidence_lists))
+
+        indexed_by_key = {}
+        to_index = []
+        for key, doc in unique_docs.items():
+            chunks = registry.get(doc, doc_len) if registry is not None else None
+            if chunks is None:
+                to_index.append(doc)
+            else:
+                indexed_by_key[key] = chunks
+
+        if max_workers == 1:
+            indexed = [cls._index_document(doc, doc_len) for doc in to_index]
+        else:
+            with _index_pool(max_workers) as pool:
+                indexed = list(pool.map(cls._index_document, to_index, itertools.repeat(doc_len)))
+        for doc, chunks in zip(to_index, indexed):
+            indexed_by_key[_page_key(doc)] = chunks
+            if registry is not None:
+                registry.put(doc, doc_len, chunks)
+
+        corpora = []
+        for documents in evidence_lists:
+            corpus = cls.__new__(cls)
+            corpus.registry = registry
+            corpus.ranking_cache = ranking_cache
+            corpus._init_index(
+                [(doc, _with_title(indexed_by_key[key], doc.title)) for key, doc in _dedupe(documents).items()],
+                doc_len,
+            )
+            corpora.append(corpus)
+        return corpora
+
+    @classmethod
+    def _chunk_document(cls, doc: Evidence, doc_len: int) -> list[RetrievalResult]:
+        """Fetch and chunk the given document."""
+        return [RetrievalResult(doc.title, chunk) for chunk in chunk_text(wiki_content(doc), doc_len)]
+
+    @classmethod
+    def _index_document(cls, doc: Evidence, doc_len: int) -> IndexedChunks:
+        """Fetch and chunk the given document, returning a list of (chunk, tokens) pairs."""
+        chunks = cls._chunk_document(doc, doc_len)
+        return list(zip(chunks, cls.tokenize_many(chunk.content for chunk in chunks)))
+
+    def _get_indexed(self, doc: Evidence, doc_len: int) -> tuple[list[RetrievalResult], Optional[list[list[str]]]]:
+        """
+        Return the chunks of the given document and their tokens, from the registry if possible. If the document is not
+        in the registry, only chunk it, and return None for the tokens; it will be tokenized when the index is needed.
+        """
+        indexed = self.registry.get(doc, doc_len) if self.registry is not None else None
+        if indexed is None:
+            return self._chunk_document(doc, doc_len), None
+        return [chunk for chunk, _ in indexed], [tokens for _, tokens in indexed]
+
+    def _init_index(self, indexed_documents: list[tuple[Evidence, IndexedChunks]], doc_len: int):
+        self.doc_len = doc_len
+        self.documents = []
+        self._chunk_keys = []  # the _page_key of the page each chunk came from
+        self._index = IncrementalBM25Plus()
+        # pages whose chunks are in self.documents but have not been added to the index yet, in order:
+        # (evidence, chunks, tokens of each chunk or None if not tokenized yet)
+        self._pending: list[tuple[Evidence, list[RetrievalResult], Optional[list[list[str]]]]] = []
+        self._fingerprint = None
+        # token_counter -> formatted fragment -> number of tokens, for the last few token counters used
+        self._token_count_cache: dict[Callable[[str], int], dict[str, int]] = {}
+        # guards the documents, the index, and the pending pages; reentrant since the index property takes it too
+        self._lock = threading.RLock()
+        self._version = 0  # incremented whenever the corpus's contents change
+        for doc, chunks in indexed_documents:
+            self._add_chunks(doc, [chunk for chunk, _ in chunks], [tokens for _, tokens in chunks])
+
+    def _add_chunks(self, doc: Evidence, chunks: list[RetrievalResult], tokens: Optional[list[list[str]]]):
+        key = _page_key(doc)
+        with self._lock:
+            for chunk in chunks:
+                self.documents.append(chunk)
+                self._chunk_keys.append(key)
+            self._pending.append((doc, chunks, tokens))
+            self._fingerprint = None
+            self._version += 1
+
+    @property
+    def index(self) -> IncrementalBM25Plus:
+        """
+        The BM25+ index over the corpus's chunks. Chunks are only tokenized and indexed when the index is first needed,
+        so a corpus whose rankings are all in its ranking cache never tokenizes anything.
+        """
+        with self._lock:
+            for doc, chunks, tokens in self._pending:
+                if tokens is None:
+                    tokens = self.tokenize_many(chunk.content for chunk in chunks)
+                    if self.registry is not None:
+                        self.registry.put(doc, self.doc_len, list(zip(chunks, tokens)))
+                self._index.add_documents(tokens)
+            self._pending.clear()
+            return self._index
+
+    def add(self, documents: list[Evidence]):
+        """
+        Index the given documents and add them to the corpus, without re-indexing the documents already in it.
+        Documents that are already in the corpus are skipped, so each page is only indexed once.
+
+        .. code-block:: python
+
+            # example of how to use across the turns of an agent in the Open Book setting
+            corpus = fanoutqa.retrieval.Corpus([])
+            for query in searches:
+                corpus.add(fanoutqa.wiki_search(query))
+                fragments = corpus.best(q.question)
+                ...
+
+        :param documents: The list of evidences to add
+        """
+        # fetch and chunk the new pages without holding the lock...
+        with self._lock:
+            indexed_keys = set(self._chunk_keys)
+        new_docs = [doc for key, doc in _dedupe(documents).items() if key not in indexed_keys]
+        fetched = [(doc, *self._get_indexed(doc, self.doc_len)) for doc in new_docs]
+
+        # ...then add them, unless another thread added the same page in the meantime
+        with self._lock:
+            indexed_keys = set(self._chunk_keys)
+            for doc, chunks, tokens in fetched:
+                if _page_key(doc) not in indexed_keys:
+                    self._add_chunks(doc, chunks, tokens)
+
+    def remove(self, documents: list[Evidence]):
+        """
+        Remove all the chunks of the given documents from the corpus.
+
+        :param documents: The list of evidences to remove
+        """
+        keys = {_page_key(doc) for doc in documents}
+        with self._lock:
+            removed = [idx for idx, key in enumerate(self._chunk_keys) if key in keys]
+            if not removed:
+                return
+            self.index.remove_documents(removed)
+            # replace the list rather than modifying it, since queries in other threads may still be reading it
+            self.documents = [chunk for chunk, key in zip(self.documents, self._chunk_keys) if key not in keys]
+            self._chunk_keys = [key for key in self._chunk_keys if key not in keys]
+            self._fingerprint = None
+            self._version += 1
+
+    @staticmethod
+    def tokenize(text: str):
+        return normalize(text).split(" ")
+
+    @classmethod
+    def tokenize_many(cls, texts: Iterable[str]) -> list[list[str]]:
+        """Tokenize many texts at once, streaming them through the normalization pipeline in batches."""
+        return [normalized.split(" ") for normalized in normalize_many(texts)]
+
+    @property
+    def fingerprint(self) -> str:
+        """A hash of the corpus's contents (the title and content of each chunk, in order, and the chunk length)."""
+        with self._lock:
+            if self._fingerprint is None:
+                h = hashlib.sha256(str(self.doc_len).encode())
+                for doc in self.documents:
+                    for part in (doc.title, doc.content):
+                        data = part.encode()
+                        h.update(len(data).to_bytes(8, "little"))
+                        h.update(data)
+                self._fingerprint = h.hexdigest()
+            return self._fingerprint
+
+    def best(self, q: str) -> Iterable[RetrievalResult]:
+        """Yield the best matching fragments to the given query."""
+        idxs, documents = self._rank(q)
+        for idx in idxs:
+            yield documents[idx]
+
+    def _snapshot(self) -> tuple[int, Optional[str], list[RetrievalResult]]:
+        """
+        Return the corpus's current version, fingerprint, and fragments, all from the same point in time. The
+        fingerprint is only needed to look up rankings, so it is None if the corpus has no ranking cache (computing it
+        hashes every chunk after each change).
+        """
+        with self._lock:
+            fingerprint = self.fingerprint if self.ranking_cache is not None else None
+            return self._version, fingerprint, self.documents
+
+    def _rank(self, q: str) -> tuple[np.ndarray, list[RetrievalResult]]:
+        """
+        Return the indices of the corpus's fragments, best match to the given query first, and the list of fragments
+        they index into (which stays the same even if the corpus changes later).
+        """
+        if self.ranking_cache is not None:
+            _, fingerprint, documents = self._snapshot()
+            cached = self.ranking_cache.get(fingerprint, q)
+            if cached is not None:
+                return cached, documents
+
+        tok_q = self.tokenize(q)
+        with self._lock:
+            scores = self._get_scores_many([tok_q])[:, 0]
+            _, fingerprint, documents = self._snapshot()
+        idxs = _ranking(scores)
+        if self.ranking_cache is not None:
+            self.ranking_cache.put(fingerprint, q, idxs)
+        return idxs, documents
+
+    def best_many(self, qs: list[str], fuse: bool = False, rrf_k: int = 60) -> MultiRetrievalResult:
+        """
+        Rank the fragments of the corpus against many queries at once (e.g. one for each subquestion of a
+        decomposition).
+
+        All the queries are tokenized together, and each fragment is scored against each term in the union of their
+        terms only once, so this costs about as much as one call to :meth:`best`. Each per-query ranking is the same as
+        :meth:`best` would return, with ties broken by fragment order. Queries whose rankings are in the corpus's
+        ranking cache are not scored again.
+
+        :param qs: The queries to rank the fragments against
+        :param fuse: Whether to also return a single ranking that fuses all of the per-query rankings
+        :param rrf_k: The *k* constant used for reciprocal rank fusion, which dampens the weight of the top ranks
+        """
+        # look up the cached rankings, and score the rest together
+        version, fingerprint, documents = self._snapshot()
+        ranked_idxs = [None] * len(qs)
+        if self.ranking_cache is not None:
+            ranked_idxs = [self.ranking_cache.get(fingerprint, q) for q in qs]
+        to_score = [j for j, idxs in enumerate(ranked_idxs) if idxs is None]
+        if to_score:
+            tok_qs = self.tokenize_many(qs[j] for j in to_score)
+            with self._lock:
+                if self._version != version:
+                    # the corpus changed since the cached rankings were looked up, so score every query against it now
+                    to_score = list(range(len(qs)))
+                    tok_qs = self.tokenize_many(qs)
+                scores = self._get_scores_many(tok_qs)
+                version, fingerprint, documents = self._snapshot()
+            for col, j in enumerate(to_score):
+                ranked_idxs[j] = _ranking(scores[:, col])
+                if self.ranking_cache is not None:
+                    self.ranking_cache.put(fingerprint, qs[j], ranked_idxs[j])
+
+        rankings = []
+        fused_scores = np.zeros(len(documents))
+        for idxs in ranked_idxs:
+            rankings.append([documents[idx] for idx in idxs])
+            if fuse:
+                # RRF: each query contributes 1 / (k + rank) to each fragment, with ranks starting at 1
+                fused_scores[idxs] += 1 / (rrf_k + np.arange(1, len(idxs) + 1))
+
+        fused = None
+        if fuse:
+            fused = [documents[idx] for idx in _ranking(fused_scores)]
+        return MultiRetrievalResult(rankings=rankings, fused=fused)
+
+    def _get_scores_many(self, tok_qs: list[list[str]]) -> np.ndarray:
+        """
+        Return the BM25+ score of each fragment against each tokenized query, as an (n_fragments, n_queries) array.
+        Both :meth:`best` and :meth:`best_many` score through here, so a query's scores don't depend on which was used.
+        """
+        # assign each distinct query term a column
+        vocab = {}
+        for tok_q in tok_qs:
+            for tok in tok_q:
+                vocab.setdefault(tok, len(vocab))
+
+        # score each fragment against each term once (same formula as BM25Plus.get_scores)...
+        index = self.index
+        terms = list(vocab)
+        idf = np.array([index.idf.get(t) or 0 for t in terms])
+        tfs = np.array([[doc.get(t) or 0 for t in terms] for doc in index.doc_freqs], dtype=float).reshape(
+            len(index.doc_freqs), len(terms)
+        )
+        doc_len = np.array(index.doc_len)
+        len_norm = index.k1 * (1 - index.b + index.b * doc_len / index.avgdl)
+        term_scores = idf * (index.delta + (tfs * (index.k1 + 1)) / (len_norm[:, None] + tfs))
+
+        # ...then sum the term scores for each query, in the query's own term order so that a query's scores don't
+        # depend on the other queries scored with it (a matrix product would sum in an order that does)
+        scores = np.zeros((len(index.doc_freqs), len(tok_qs)))
+        for j, tok_q in enumerate(tok_qs):
+            for tok, count in Counter(tok_q).items():
+                scores[:, j] += term_scores[:, vocab[tok]] * count
+        return scores
+
+    def pack(
+        self,
+        q: str,
+        budget: int,
+        token_counter: Callable[[str], int],
+        template: str = "# {title}\n{content}\n\n",
+    ) -> str:
+        """
+        Return as many of the best matching fragments to the given query as fit in *budget* tokens, formatted with
+        *template* and concatenated in ranked order.
+
+        Each formatted fragment is counted with *token_counter* exactly once, so packing is linear in the number of
+        fragments instead of re-counting the whole prompt for each fragment added. Counts are cached on the corpus for
+        the most recently used token counters, so pass the same function on each call rather than a new lambda. Since
+        fragments are counted separately, the total may differ from the token count of the concatenated string by a
+        token or so at each fragment boundary.
+
+        .. code-block:: python
+
+            prompt = "*** BEGIN DATA ***\\n\\n{}\\n*** END DATA ***\\n\\n[Question]: ..."
+            budget = max_prompt_tokens - count_tokens(prompt.format(""))
+            prompt = prompt.format(corpus.pack(q.question, budget, count_tokens))
+
+        :param q: The query to rank fragments by
+        :param budget: The maximum number of tokens the packed fragments may use
+        :param token_counter: A function returning the number of tokens in a string
+        :param template: The format string used for each fragment; receives the ``title`` and ``content`` kwargs
+        """
+        packed = []
+        total = 0
+        for doc in self.best(q):
+            formatted = template.format(title=doc.title, content=doc.content)
+            n_tokens = self._count_tokens(formatted, token_counter)
+            if total + n_tokens > budget:
+                break
+            total += n_tokens
+            packed.append(formatted)
+        return "".join(packed)
+
+    def compress(
+        self,
+        q: str,
+        fragments: Iterable[RetrievalResult],
+        ratio: float = None,
+        max_tokens: int = None,
+        token_counter: Callable[[str], int] = None,
+        context: int = 1,
+    ) -> CompressionResult:
+        """
+        Compress the given fragments (e.g. the top results of :meth:`best`) by keeping only the sentences most relevant
+        to the query, along with their surrounding sentences.
+
+        Each sentence is scored against the query with BM25, using the IDF of each term in the whole corpus. Sentences
+        are then kept best first, each with up to *context* neighboring sentences on either side from the same fragment,
+        as long as the compressed fragments still fit in the target size; sentences that don't match any query term are
+        only kept as context. Within each fragment, kept sentences stay in their original order, and gaps are marked
+        with ``...``. Sizes are measured on the compressed fragments as returned, including the gap markers.
+
+        .. code-block:: python
+
+            fragments = list(itertools.islice(corpus.best(q.question), 10))
+            result = corpus.compress(q.question, fragments, ratio=0.3)
+            print(f"Compressed to {result.ratio:.0%} of the original size")
+
+        :param q: The query to compress the fragments against
+        :param fragments: The fragments to compress
+        :param ratio: The target size, as a fraction of the fragments' total size
+        :param max_tokens: The target size, in tokens (requires *token_counter*)
+        :param token_counter: A function returning the number of tokens in a string. If given, sizes are measured in
+            tokens; otherwise, they are measured in characters.
+        :param context: The number of neighboring sentences to keep on either side of each relevant sentence
+        """
+        if (ratio is None) == (max_tokens is None):
+            raise ValueError("Exactly one of `ratio` or `max_tokens` must be given.")
+        if max_tokens is not None and token_counter is None:
+            raise ValueError("`max_tokens` requires a `token_counter`.")
+        size_of = token_counter or len
+
+        # split each fragment into sentences: (fragment index, start, end)
+        fragments = list(fragments)
+        sentences = []
+        for frag_idx, fragment in enumerate(fragments):
+            for start, end in sentence_spans(fragment.content):
+                sentences.append((frag_idx, start, end))
+        texts = [fragments[frag_idx].content[start:end] for frag_idx, start, end in sentences]
+        original_size = sum(size_of(fragment.content) for fragment in fragments)
+        target = max_tokens if max_tokens is not None else ratio * original_size
+
+        # score each sentence against the query with BM25 (without the BM25+ delta, so non-matching sentences score 0)
+        tok_sents = self.tokenize_many(texts)
+        q_freqs = {}
+        for tok in self.tokenize(q):
+            q_freqs[tok] = q_freqs.get(tok, 0) + 1
+        with self._lock:
+            index = self.index
+            idf = {tok: index.idf.get(tok, 0) for tok in q_freqs}
+        avg_len = sum(len(toks) for toks in tok_sents) / len(tok_sents) if tok_sents else 0
+        scores = np.zeros(len(sentences))
+        for i, toks in enumerate(tok_sents):
+            len_norm = index.k1 * (1 - index.b + index.b * len(toks) / avg_len)
+            for tok, q_freq in q_freqs.items():
+                tf = toks.count(tok)
+                if tf:
+                    scores[i] += q_freq * idf[tok] * tf * (index.k1 + 1) / (tf + len_norm)
+
+        def rebuild(frag_idx: int, idxs: Iterable[int]) -> str:
+            # join runs of adjacent sentences with the original text between them, and mark the gaps between runs
+            runs = []  # (start, end) of each run of adjacent kept sentences
+            prev = None
+            for i in sorted(idxs):
+                _, start, end = sentences[i]
+                if runs and prev == i - 1:
+                    runs[-1] = (runs[-1][0], end)
+                else:
+                    runs.append((start, end))
+                prev = i
+            content = fragments[frag_idx].content
+            return " ... ".join(content[start:end] for start, end in runs)
+
+        # keep the best sentences with their context while the rebuilt fragments fit in the target size
+        kept = {}  # fragment index -> indices of its kept sentences
+        kept_sizes = {}  # fragment index -> size of the rebuilt fragment
+        total = 0
+        for i in np.argsort(-scores, kind="stable"):
+            if scores[i] <= 0:
+                break
+            frag_idx = sentences[i][0]
+            frag_kept = kept.get(frag_idx, set())
+            window = [
+                j
+                for j in range(i - context, i + context + 1)
+                if 0 <= j < len(sentences) and sentences[j][0] == frag_idx and j not in frag_kept
+            ]
+            # if the sentence doesn't fit with its context, try it alone
+            for candidate in (window, [i] if i not in frag_kept else []):
+                if not candidate:
+                    continue
+                new_size = size_of(rebuild(frag_idx, frag_kept.union(candidate)))
+                new_total = total - kept_sizes.get(frag_idx, 0) + new_size
+                if new_total <= target:
+                    kept[frag_idx] = frag_kept.union(candidate)
+                    kept_sizes[frag_idx] = new_size
+                    total = new_total
+                    break
+
+        compressed = []
+        for frag_idx in sorted(kept):
+            fragment = fragments[frag_idx]
+            compressed.append(RetrievalResult(title=fragment.title, content=rebuild(frag_idx, kept[frag_idx])))
+        return CompressionResult(fragments=compressed, original_size=original_size, compressed_size=total)
+
+    def _count_tokens(self, formatted: str, token_counter: Callable[[str], int]) -> int:
+        """Return the number of tokens in the given formatted fragment, cached for each token counter."""
+        with self._lock:
+            counts = self._token_count_cache.get(token_counter)
+            if counts is None:
+                # callers that pass a new function each time would otherwise grow the cache forever
+                while len(self._token_count_cache) >= _MAX_TOKEN_COUNTERS:
+                    self._token_count_cache.pop(next(iter(self._token_count_cache)))
+                counts = self._token_count_cache[token_counter] = {}
+        n_tokens = counts.get(formatted)
+        if n_tokens is None:
+            n_tokens = counts[formatted] = token_counter(formatted)
+        return n_tokens
+
+
+def _dedupe(documents: Iterable[Evidence]) -> dict[tuple, Evidence]:
+    """Return the first evidence for each distinct page in the given evidences, by key, in order."""
+    unique_docs = {}
+    for doc in documents:
+        unique_docs.setdefault(_page_key(doc), doc)
+    return unique_docs
+
+
+def _ranking(scores: np.ndarray) -> np.ndarray:
+    """Return the indices that sort the given scores best first, breaking ties by ascending index."""
+    return np.lexsort((np.arange(len(scores)), -scores))
+
+
+def _index_pool(max_workers: Optional[int]) -> ProcessPoolExecutor:
+    """
+    A pool of processes for :meth:`Corpus._index_document`. The workers are spawned rather than forked, since forking a
+    process whose other threads may hold locks (e.g. a scorer's worker threads) can deadlock the child; each worker
+    tokenizes with this process's normalize engine, and only uses the normalize cache if this process does.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_index_worker,
+        initargs=(norm.get_normalize_engine(), norm.normalize_cache is not None),
+    )
+
+
+def _init_index_worker(engine: str, use_cache: bool):
+    norm.set_normalize_engine(engine)
+    if not use_cache:
+        norm.set_normalize_cache(None)
@@ -0,0 +1,395 @@
+"""
+An on-disk BM25+ index over a large collection of pages (e.g. every page in the wiki cache), stored as memory-mappable
+arrays so that many processes can share one index through the OS page cache.
+"""
+
+import bisect
+import itertools
+import json
+import math
+import re
+import warnings
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from pathlib import Path
+from typing import Iterable, Optional
+
+import numpy as np
+
+from fanoutqa.models import Evidence
+from fanoutqa.norm import get_normalize_engine
+from fanoutqa.retrieval.corpus import Corpus, RetrievalResult, _dedupe, _index_pool, _ranking
+from fanoutqa.utils import AnyPath, load_dev, load_test
+from fanoutqa.wiki import WIKI_CACHE_DIR
+
+DISK_INDEX_VERSION = 2
+# relative slack on pruning bounds, so that floating-point error in partial sums never prunes a true top-k chunk
+_PRUNE_EPS = 1e-9
+
+# numeric arrays, stored as .npy files
+_ARRAYS = (
+    "vocab_offsets",  # int64 (n_terms + 1): the offset of each term in vocab.bin
+    "postings_offsets",  # int64 (n_terms + 1): the offset of each term's postings in postings_docs/postings_tfs
+    "postings_docs",  # int32: the chunk ID of each posting, ascending within each term
+    "postings_tfs",  # int32: the term frequency of each posting
+    "doc_lens",  # int32 (n_chunks): the number of tokens in each chunk
+    "chunk_pages",  # int32 (n_chunks): the page ID (index into titles) of each chunk
+    "chunk_offsets",  # int64 (n_chunks + 1): the offset of each chunk in chunks.bin
+    "title_offsets",  # int64 (n_pages + 1): the offset of each page title in titles.bin
+    "term_max_scores",  # float64 (n_terms): the max BM25+ term saturation (no IDF or delta) of each term's postings
+)
+# UTF-8 encoded strings, concatenated into raw .bin files
+_BLOBS = ("vocab", "chunks", "titles")
+
+
+class DiskIndex:
+    """
+    A BM25+ index over a large collection of pages, memory-mapped from a directory created by :meth:`DiskIndex.build`.
+
+    Opening an index only reads a small metadata file; the vocabulary, postings, and chunk contents are memory-mapped
+    and paged in on demand, so many worker processes can open the same index with near-zero startup time and share its
+    memory through the OS page cache.
+
+    The index chunks and tokenizes pages the same way as :class:`.Corpus` and scores them with the same BM25+
+    parameters, so ``DiskIndex.best(query)`` can be used wherever ``Corpus.best(query)`` is.
+
+    .. code-block:: python
+
+        # build an index over every page in the wiki cache, once
+        DiskIndex.build("foqa-index")
+
+        # then, in each worker
+        index = DiskIndex("foqa-index")
+        for fragment in index.best(q.question):
+            ...
+    """
+
+    def __init__(self, path: AnyPath):
+        """
+        :param path: The path to a directory created by :meth:`build`
+        """
+        self.path = Path(path)
+        with open(self.path / "meta.json") as f:
+            meta = json.load(f)
+        if meta["version"] != DISK_INDEX_VERSION:
+            raise ValueError(
+                f"The index at {self.path} was built by an incompatible version of fanoutqa (index version"
+                f" {meta['version']}, expected {DISK_INDEX_VERSION}). Please rebuild it."
+            )
+        self.doc_len = meta["doc_len"]
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.delta = meta["delta"]
+        self.corpus_size = meta["n_chunks"]
+        self.avgdl = meta["avgdl"]
+        self.normalize_engine = meta.get("normalize_engine", "spacy")
+        if self.normalize_engine != get_normalize_engine():
+            warnings.warn(
+                f"The index at {self.path} was built with the {self.normalize_engine!r} normalize engine, but the"
+                f" {get_normalize_engine()!r} engine is active. Queries may not match the indexed terms."
+            )
+
+        arrays = {name: np.load(self.path / f"{name}.npy", mmap_mode="r") for name in _ARRAYS}
+        blobs = {name: _load_blob(self.path / f"{name}.bin") for name in _BLOBS}
+        self.postings_offsets = arrays["postings_offsets"]
+        self.postings_docs = arrays["postings_docs"]
+        self.postings_tfs = arrays["postings_tfs"]
+        self.doc_lens = arrays["doc_lens"]
+        self.chunk_pages = arrays["chunk_pages"]
+        self.term_max_scores = arrays["term_max_scores"]
+        self.vocab = _MmapStrings(blobs["vocab"], arrays["vocab_offsets"])
+        self.chunks = _MmapStrings(blobs["chunks"], arrays["chunk_offsets"])
+        self.titles = _MmapStrings(blobs["titles"], arrays["title_offsets"])
+
+    # ==== build ====
+    @classmethod
+    def build(
+        cls,
+        path: AnyPath,
+        documents: Optional[Iterable[Evidence]] = None,
+        doc_len: int = 2048,
+        max_workers: int = None,
+    ) -> "DiskIndex":
+        """
+        Fetch, chunk, and tokenize the given documents, and write an index over them to the directory at *path*.
+
+        :param path: The directory to write the index to (created if it does not exist)
+        :param documents: The documents to index (defaults to every page in the wiki cache, see
+            :func:`cached_evidence`). Duplicate pages are only indexed once.
+        :param doc_len: The maximum length, in characters, of each chunk
+        :param max_workers: The number of processes to use to tokenize the documents (defaults to the number of CPUs).
+            If this is 1, tokenize the documents in this process instead. The processes are spawned rather than forked,
+            so the calling script must guard its entry point with ``if __name__ == "__main__":``.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if documents is None:
+            documents = cached_evidence()
+        unique_docs = _dedupe(documents)
+
+        term_ids = {}  # term -> temporary ID, in order of first appearance
+        posting_terms = array("i")
+        posting_docs = array("i")
+        posting_tfs = array("i")
+        doc_lens = array("i")
+        chunk_pages = array("i")
+        chunk_offsets = array("q", [0])
+        title_offsets = array("q", [0])
+        with open(path / "chunks.bin", "wb") as chunks_f, open(path / "titles.bin", "wb") as titles_f:
+            indexed = _index_documents(unique_docs.values(), doc_len, max_workers)
+            for page_id, (doc, chunks) in enumerate(zip(unique_docs.values(), indexed)):
+                title_offsets.append(title_offsets[-1] + titles_f.write(doc.title.encode()))
+                for chunk, tokens in chunks:
+                    chunk_id = len(doc_lens)
+                    for term, tf in Counter(tokens).items():
+                        posting_terms.append(term_ids.setdefault(term, len(term_ids)))
+                        posting_docs.append(chunk_id)
+                        posting_tfs.append(tf)
+                    doc_lens.append(len(tokens))
+                    chunk_pages.append(page_id)
+                    chunk_offsets.append(chunk_offsets[-1] + chunks_f.write(chunk.content.encode()))
+
+        # sort the vocabulary so terms can be found by binary search, then group the postings by term
+        vocab = sorted(term_ids)
+        sorted_ids = np.empty(len(vocab), dtype=np.int64)
+        sorted_ids[np.array([term_ids[term] for term in vocab], dtype=np.int64)] = np.arange(len(vocab))
+        posting_terms = sorted_ids[np.frombuffer(posting_terms, dtype=np.int32)]
+        order = np.argsort(posting_terms, kind="stable")  # stable, so chunk IDs stay ascending within each term
+        postings_offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_terms, minlength=len(vocab)), out=postings_offsets[1:])
+
+        # use the same BM25+ parameters as the Corpus
+        k1, b, delta = 1.5, 0.75, 1
+        avgdl = sum(doc_lens) / len(doc_lens) if doc_lens else 0
+        postings_docs = np.frombuffer(posting_docs, dtype=np.int32)[order]
+        postings_tfs = np.frombuffer(posting_tfs, dtype=np.int32)[order]
+        doc_lens_arr = np.frombuffer(doc_lens, dtype=np.int32)
+
+        # precompute each term's upper bound for top-k pruning (every term has at least one posting)
+        term_max_scores = np.zeros(len(vocab), dtype=np.float64)
+        if len(vocab):
+            len_norm = k1 * (1 - b + b * doc_lens_arr[postings_docs] / avgdl)
+            saturation = postings_tfs * (k1 + 1) / (len_norm + postings_tfs)
+            term_max_scores = np.maximum.reduceat(saturation, postings_offsets[:-1])
+
+        vocab_offsets = array("q", [0])
+        with open(path / "vocab.bin", "wb") as f:
+            for term in vocab:
+                vocab_offsets.append(vocab_offsets[-1] + f.write(term.encode()))
+
+        arrays = {
+            "vocab_offsets": np.frombuffer(vocab_offsets, dtype=np.int64),
+            "postings_offsets": postings_offsets,
+            "postings_docs": postings_docs,
+            "postings_tfs": postings_tfs,
+            "doc_lens": doc_lens_arr,
+            "chunk_pages": np.frombuffer(chunk_pages, dtype=np.int32),
+            "chunk_offsets": np.frombuffer(chunk_offsets, dtype=np.int64),
+            "title_offsets": np.frombuffer(title_offsets, dtype=np.int64),
+            "term_max_scores": term_max_scores,
+        }
+        for name, arr in arrays.items():
+            np.save(path / f"{name}.npy", arr)
+
+        meta = {
+            "version": DISK_INDEX_VERSION,
+            "doc_len": doc_len,
+            "k1": k1,
+            "b": b,
+            "delta": delta,
+            "n_pages": len(unique_docs),
+            "n_chunks": len(doc_lens),
+            "n_terms": len(vocab),
+            "avgdl": avgdl,
+            "normalize_engine": get_normalize_engine(),
+        }
+        with open(path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+        return cls(path)
+
+    # ==== query ====
+    tokenize = staticmethod(Corpus.tokenize)
+
+    def term_id(self, term: str) -> Optional[int]:
+        """Return the ID of the given term in the vocabulary, or None if it is not in the index."""
+        idx = bisect.bisect_left(self.vocab, term)
+        if idx < len(self.vocab) and self.vocab[idx] == term:
+            return idx
+        return None
+
+    def postings(self, term_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the chunk IDs and term frequencies of the chunks containing the given term."""
+        start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+        return self.postings_docs[start:end], self.postings_tfs[start:end]
+
+    def idf(self, term_id: int) -> float:
+        """Return the BM25+ IDF of the given term."""
+        df = self.postings_offsets[term_id + 1] - self.postings_offsets[term_id]
+        return math.log((self.corpus_size + 1) / df)
+
+    def get_scores(self, tok_q: list[str]) -> np.ndarray:
+        """Return the BM25+ score of each chunk in the index against the given tokenized query."""
+        scores = np.zeros(self.corpus_size)
+        for term, q_freq in Counter(tok_q).items():
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            idf = self.idf(term_id)
+            docs, tfs = self.postings(term_id)
+            # BM25+ gives each chunk idf * delta for each query term, even if the chunk doesn't contain it
+            scores += q_freq * idf * self.delta
+            scores[docs] += q_freq * idf * self._saturation(docs, tfs)
+        return scores
+
+    def get_top_k(self, tok_q: list[str], k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Return the chunk IDs and BM25+ scores of the *k* highest-scoring chunks against the given tokenized query, best
+        first. Ties are broken by ascending chunk ID.
+
+        The scores are those of :meth:`get_scores` (up to floating-point rounding), but rather than scoring every chunk
+        in the index, this uses MaxScore dynamic pruning: query terms are processed in descending order of their score
+        upper bound, and once the upper bounds of the remaining terms can no longer lift an unseen chunk into the top
+        *k*, only the postings of the current candidates are looked up (by binary search), and candidates that can no
+        longer make the top *k* are dropped.
+        """
+        k = min(k, self.corpus_size)
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # (weight, upper bound, term ID) for each known query term
+        terms = []
+        for term, q_freq in Counter(tok_q).items():
+            term_id = self.term_id(term)
+            if term_id is None:
+                continue
+            weight = q_freq * self.idf(term_id)
+            terms.append((weight, weight * self.term_max_scores[term_id], term_id))
+        terms.sort(key=lambda t: t[1], reverse=True)
+        # the delta term adds the same constant to every chunk, so it doesn't affect the ranking
+        constant = sum(weight * self.delta for weight, _, _ in terms)
+
+        cand_ids = np.zeros(0, dtype=np.int64)
+        cand_scores = np.zeros(0)
+        threshold = 0.0  # the k-th best partial score so far, a lower bound on the final k-th best score
+        remaining = sum(ub for _, ub, _ in terms)  # the upper bound on the score from the unprocessed terms
+        for weight, ub, term_id in terms:
+            docs, tfs = self.postings(term_id)
+            if len(cand_ids) >= k and remaining * (1 + _PRUNE_EPS) < threshold:
+                # no unseen chunk can make the top k: only score the candidates
+                remaining -= ub
+                pos = np.searchsorted(docs, cand_ids)
+                pos[pos == len(docs)] = 0
+                found = np.flatnonzero(docs[pos] == cand_ids)
+                docs, tfs = cand_ids[found], tfs[pos[found]]
+                cand_scores[found] += weight * self._saturation(docs, tfs)
+                # and drop the candidates that can't make the top k even with the rest of the terms
+                threshold = np.partition(cand_scores, -k)[-k]
+                keep = (cand_scores + remaining) * (1 + _PRUNE_EPS) >= threshold
+                cand_ids, cand_scores = cand_ids[keep], cand_scores[keep]
+            else:
+                # score every chunk containing the term, and merge them into the candidates
+                remaining -= ub
+                ids = np.concatenate((cand_ids, docs))
+                scores = np.concatenate((cand_scores, weight * self._saturation(docs, tfs)))
+                cand_ids, inverse = np.unique(ids, return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=scores, minlength=len(cand_ids))
+                if len(cand_ids) >= k:
+                    threshold = np.partition(cand_scores, -k)[-k]
+
+        # if fewer than k chunks contain any query term, fill the rest with (zero-scoring) chunks by ascending ID
+        if len(cand_ids) < k:
+            fill = np.setdiff1d(np.arange(k + len(cand_ids)), cand_ids)[: k - len(cand_ids)]
+            cand_ids = np.concatenate((cand_ids, fill))
+            cand_scores = np.concatenate((cand_scores, np.zeros(len(fill))))
+        order = np.lexsort((cand_ids, -cand_scores))[:k]
+        return cand_ids[order], cand_scores[order] + constant
+
+    def _saturation(self, docs: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        """The BM25+ term saturation (excluding IDF and delta) of the given postings."""
+        len_norm = self.k1 * (1 - self.b + self.b * self.doc_lens[docs] / self.avgdl)
+        return (tfs * (self.k1 + 1)) / (len_norm + tfs)
+
+    def get_result(self, chunk_id: int) -> RetrievalResult:
+        """Return the fragment with the given chunk ID."""
+        return RetrievalResult(title=self.titles[self.chunk_pages[chunk_id]], content=self.chunks[chunk_id])
+
+    def best(self, q: str) -> Iterable[RetrievalResult]:
+        """Yield the best matching fragments to the given query. Ties are broken by ascending chunk ID."""
+        tok_q = self.tokenize(q)
+        scores = self.get_scores(tok_q)
+        for idx in _ranking(scores):
+            yield self.get_result(idx)
+
+    def top_k(self, q: str, k: int = 10) -> list[RetrievalResult]:
+        """
+        Return the *k* best matching fragments to the given query, best first.
+
+        This is equivalent to taking the first *k* results of :meth:`best` (ties are broken the same way), but uses
+        dynamic pruning to avoid scoring every chunk in the index (see :meth:`get_top_k`). Since the pruned scores are
+        summed in a different order, chunks whose scores differ only by floating-point rounding may swap places.
+        """
+        tok_q = self.tokenize(q)
+        ids, _ = self.get_top_k(tok_q, k)
+        return [self.get_result(idx) for idx in ids]
+
+
+def cached_evidence() -> list[Evidence]:
+    """
+    Return an Evidence for each page in the wiki cache. Titles are taken from the dev and test sets' evidence; pages
+    that are not evidence for any question (e.g. pages retrieved in the open-book setting) have an empty title.
+    """
+    known = {}
+    for q in load_dev():
+        for ev in q.necessary_evidence:
+            known[ev.pageid] = ev
+    for q in load_test():
+        for ev in q.necessary_evidence:
+            known[ev.pageid] = ev
+
+    out = []
+    for fp in WIKI_CACHE_DIR.glob("*-dated.md"):
+        match = re.fullmatch(r"(\d+)-dated\.md", fp.name)
+        if match is None:
+            continue
+        pageid = int(match[1])
+        if pageid in known:
+            out.append(known[pageid])
+        else:
+            out.append(Evidence(pageid=pageid, revid=None, title="", url=f"https://en.wikipedia.org/?curid={pageid}"))
+    out.sort(key=lambda ev: ev.pageid)
+    return out
+
+
+# ==== helpers ====
+def _index_documents(documents: Iterable[Evidence], doc_len: int, max_workers: int = None):
+    """Yield Corpus._index_document(doc, doc_len) for each doc, in a process pool unless max_workers is 1."""
+    if max_workers == 1:
+        for doc in documents:
+            yield Corpus._index_document(doc, doc_len)
+        return
+    with _index_pool(max_workers) as pool:
+        yield from pool.map(Corpus._index_document, documents, itertools.repeat(doc_len), chunksize=16)
+
+
+class _MmapStrings(Sequence):
+    """A read-only sequence of strings, backed by a buffer of concatenated UTF-8 data and an array of offsets."""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    def __getitem__(self, idx: int) -> str:
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self.data[self.offsets[idx] : self.offsets[idx + 1]].tobytes().decode()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def _load_blob(fp: Path) -> np.ndarray:
+    # np.memmap can't map an empty file
+    if fp.stat().st_size == 0:
+        return np.zeros(0, dtype=np.uint8)
+    return np.memmap(fp, dtype=np.uint8, mode="r")
@@ -0,0 +1,150 @@
+"""
+Build Evidence Provided prompts for many context sizes and tokenizers at once, ranking each question's evidence only
+once.
+"""
+
+import gzip
+import json
+from dataclasses import dataclass
+from typing import Callable, Iterable, Union
+
+import numpy as np
+
+from fanoutqa.models import DevQuestion, TestQuestion
+from fanoutqa.retrieval.corpus import Corpus
+from fanoutqa.utils import AnyPath
+
+PROMPT_ARTIFACT_VERSION = 1
+
+# the prompt used for the Evidence Provided setting in the FanOutQA paper
+DEFAULT_PROMPT_TEMPLATE = (
+    "*** BEGIN DATA ***\n\n{documents}\n*** END DATA ***\n\nAnswer the following question based on the documents"
+    " above, and output only your answer. If the answer is a list, output one on each line. Current date:"
+    " 11-20-2023.\n\n[Question]: {question}"
+)
+DEFAULT_FRAGMENT_TEMPLATE = "<document>\n<title>{title}</title>\n<content>{content}</content>\n</document>\n"
+
+
+@dataclass
+class PromptArtifact:
+    """
+    The Evidence Provided prompts for a set of questions under several token budgets and tokenizers, stored compactly:
+    each question's ranked fragments are stored once, along with how many of them fit in each budget.
+
+    Use :meth:`prompt` or :meth:`prompts` to materialize the prompts, and :meth:`save` and :meth:`load` to write the
+    artifact to and read it from a file.
+    """
+
+    template: str
+    """The prompt template, which receives the ``documents`` and ``question`` kwargs."""
+
+    budgets: list[int]
+    """The token budgets the prompts were built for."""
+
+    tokenizers: list[str]
+    """The names of the tokenizers the prompts were built for."""
+
+    questions: list[dict]
+    """For each question, a dict with its ``id``, ``question``, the ranked and formatted ``fragments`` (up to the most
+    that fit in any budget), and the ``cuts``: for each tokenizer name, the number of fragments that fit in each
+    budget."""
+
+    def prompt(self, question_idx: int, tokenizer: str, budget: int) -> str:
+        """Return the prompt for the question at the given index, for the given tokenizer and budget."""
+        q = self.questions[question_idx]
+        n_fragments = q["cuts"][tokenizer][self.budgets.index(budget)]
+        return self.template.format(documents="".join(q["fragments"][:n_fragments]), question=q["question"])
+
+    def prompts(self, tokenizer: str, budget: int) -> dict[str, str]:
+        """Return a mapping of question ID to prompt for every question, for the given tokenizer and budget."""
+        return {q["id"]: self.prompt(idx, tokenizer, budget) for idx, q in enumerate(self.questions)}
+
+    def save(self, fp: AnyPath):
+        """Write the artifact to the given file, gzip-compressed if its name ends with ``.gz``."""
+        data = {
+            "version": PROMPT_ARTIFACT_VERSION,
+            "template": self.template,
+            "budgets": self.budgets,
+            "tokenizers": self.tokenizers,
+            "questions": self.questions,
+        }
+        with _open(fp, "wt") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, fp: AnyPath) -> "PromptArtifact":
+        """Read an artifact written by :meth:`save`."""
+        with _open(fp, "rt") as f:
+            data = json.load(f)
+        if data["version"] != PROMPT_ARTIFACT_VERSION:
+            raise ValueError(
+                f"The prompt artifact at {fp} was built by an incompatible version of fanoutqa (artifact version"
+                f" {data['version']}, expected {PROMPT_ARTIFACT_VERSION}). Please rebuild it."
+            )
+        return cls(
+            template=data["template"],
+            budgets=data["budgets"],
+            tokenizers=data["tokenizers"],
+            questions=data["questions"],
+        )
+
+
+def build_evidence_prompts(
+    questions: Iterable[Union[DevQuestion, TestQuestion]],
+    budgets: list[int],
+    token_counters: dict[str, Callable[[str], int]],
+    template: str = DEFAULT_PROMPT_TEMPLATE,
+    fragment_template: str = DEFAULT_FRAGMENT_TEMPLATE,
+    doc_len: int = 1024,
+    max_workers: int = None,
+) -> PromptArtifact:
+    """
+    Build Evidence Provided prompts for each question, for every combination of token budget and tokenizer.
+
+    Each question's evidence is indexed and ranked against the question once. Each formatted fragment is then counted
+    once per tokenizer, and the cut for every budget is found by binary search over the prefix sums of the fragment
+    counts, rather than re-counting the whole prompt each time a fragment is added. As with :meth:`.Corpus.pack`, the
+    total may differ from the token count of the full prompt by a token or so at each fragment boundary.
+
+    .. code-block:: python
+
+        artifact = build_evidence_prompts(
+            fanoutqa.load_dev(),
+            budgets=[4096 - 1000, 8192 - 1000],
+            token_counters={"gpt-4": lambda text: len(enc.encode(text))},
+        )
+        artifact.save("prompts.json.gz")
+        prompts = artifact.prompts("gpt-4", 4096 - 1000)
+
+    :param questions: The questions to build prompts for
+    :param budgets: The maximum number of tokens each prompt may use, including the template and question
+    :param token_counters: A mapping of tokenizer name to a function returning the number of tokens in a string
+    :param template: The prompt template; receives the ``documents`` and ``question`` kwargs
+    :param fragment_template: The format string used for each fragment; receives the ``title`` and ``content`` kwargs
+    :param doc_len: The maximum length, in characters, of each chunk
+    :param max_workers: The number of processes to use to index the evidence (see :meth:`.Corpus.build_many`)
+    """
+    questions = list(questions)
+    corpora = Corpus.build_many([q.necessary_evidence for q in questions], doc_len=doc_len, max_workers=max_workers)
+    budgets_arr = np.array(budgets)
+
+    out = []
+    for q, corpus in zip(questions, corpora):
+        fragments = [fragment_template.format(title=doc.title, content=doc.content) for doc in corpus.best(q.question)]
+        cuts = {}
+        for name, token_counter in token_counters.items():
+            base = token_counter(template.format(documents="", question=q.question))
+            counts = [corpus._count_tokens(fragment, token_counter) for fragment in fragments]
+            # prefix[i] is the number of tokens used by the first i fragments
+            prefix = np.concatenate(([base], base + np.cumsum(counts, dtype=np.int64)))
+            # the number of fragments that fit is the number of nonempty prefixes within the budget
+            cuts[name] = (np.searchsorted(prefix, budgets_arr, side="right") - 1).clip(min=0).tolist()
+        n_kept = max((n for name_cuts in cuts.values() for n in name_cuts), default=0)
+        out.append({"id": q.id, "question": q.question, "fragments": fragments[:n_kept], "cuts": cuts})
+    return PromptArtifact(template=template, budgets=list(budgets), tokenizers=list(token_counters), questions=out)
+
+
+def _open(fp: AnyPath, mode: str):
+    if str(fp).endswith(".gz"):
+        return gzip.open(fp, mode, encoding="utf-8")
+    return open(fp, mode[0], encoding="utf-8")
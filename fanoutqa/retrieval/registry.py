@@ -0,0 +1,132 @@
+"""
+A process-wide registry of indexed pages, so that pages cited by many questions are only fetched, chunked, and
+tokenized once per process.
+"""
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import TYPE_CHECKING, Optional
+
+from fanoutqa.models import Evidence
+from fanoutqa.norm import get_normalize_engine
+
+if TYPE_CHECKING:
+    from fanoutqa.retrieval.corpus import RetrievalResult
+
+IndexedChunks = list[tuple["RetrievalResult", list[str]]]
+
+
+@dataclass
+class RegistryStats:
+    hits: int = 0
+    """The number of lookups that found the page already indexed."""
+
+    misses: int = 0
+    """The number of lookups that had to index the page."""
+
+    evictions: int = 0
+    """The number of pages evicted to stay within the memory budget."""
+
+
+class PageRegistry:
+    """
+    An LRU cache of indexed pages: the chunks of each page and their tokens, keyed by the page and the chunk length.
+
+    :class:`.Corpus` looks up each of its pages here before indexing it, so popular pages are only indexed once per
+    process no matter how many corpora they appear in. The least recently used pages are evicted once the registry's
+    estimated size exceeds its memory budget.
+
+    The registry is safe to share between threads. Two threads that miss on the same page at the same time may both
+    index it, but only one copy is kept.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = 512 * 1024 * 1024):
+        """
+        :param max_bytes: The approximate maximum memory, in bytes, used by the indexed pages (None for no limit)
+        """
+        self.max_bytes = max_bytes
+        self.stats = RegistryStats()
+        self._pages: OrderedDict[tuple, tuple[IndexedChunks, int]] = OrderedDict()  # key -> (chunks, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """The estimated memory, in bytes, used by the indexed pages."""
+        return self._size
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, doc: Evidence, doc_len: int) -> Optional[IndexedChunks]:
+        """Return the indexed chunks of the given page, or None if it is not in the registry."""
+        key = _registry_key(doc, doc_len)
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self._pages.move_to_end(key)
+            self.stats.hits += 1
+        return _with_title(entry[0], doc.title)
+
+    def put(self, doc: Evidence, doc_len: int, chunks: IndexedChunks):
+        """Add the indexed chunks of the given page, evicting the least recently used pages if needed."""
+        key = _registry_key(doc, doc_len)
+        size = _estimate_size(chunks)
+        with self._lock:
+            old = self._pages.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._pages[key] = (chunks, size)
+            self._size += size
+            # always keep the page just added, even if it alone is over the budget
+            while self.max_bytes is not None and self._size > self.max_bytes and len(self._pages) > 1:
+                _, (_, evicted_size) = self._pages.popitem(last=False)
+                self._size -= evicted_size
+                self.stats.evictions += 1
+
+    def clear(self):
+        """Remove all pages from the registry."""
+        with self._lock:
+            self._pages.clear()
+            self._size = 0
+
+
+page_registry = PageRegistry()
+"""The registry used by :class:`.Corpus` by default."""
+
+
+# ==== helpers ====
+def _page_key(doc: Evidence) -> tuple:
+    """
+    A hashable key identifying the page an evidence refers to. Live pages are identified by their page ID, as in the
+    wiki cache; Kiwix pages all have a page ID of 0, so they are identified by their URL instead. This never reads
+    ``doc.revid``, which is a network request for a :class:`.LazyEvidence`.
+    """
+    if doc.pageid:
+        return "pageid", doc.pageid
+    return "url", doc.url
+
+
+def _registry_key(doc: Evidence, doc_len: int):
+    # the tokens depend on the normalize engine, so pages tokenized by different engines are kept apart
+    return *_page_key(doc), doc_len, get_normalize_engine()
+
+
+def _with_title(chunks: IndexedChunks, title: str) -> IndexedChunks:
+    """The same page may be cited under different titles; make sure the fragments carry the requested one."""
+    if not chunks or chunks[0][0].title == title:
+        return chunks
+    return [(replace(chunk, title=title), tokens) for chunk, tokens in chunks]
+
+
+def _estimate_size(chunks: IndexedChunks) -> int:
+    """Roughly estimate the memory used by some indexed chunks: the text of each chunk and each token, plus a fixed
+    per-object overhead (CPython's str header is ~50 bytes, and each list slot is a pointer)."""
+    size = 0
+    for chunk, tokens in chunks:
+        size += len(chunk.content) + 100
+        size += sum(len(token) + 57 for token in tokens)
+    return size
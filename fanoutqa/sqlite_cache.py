@@ -0,0 +1,83 @@
+"""The SQLite storage shared by the persistent caches (normalized strings, BLEURT scores, and LLM judgments)."""
+
+import os
+import sqlite3
+import threading
+from typing import Callable, Optional, TypeVar
+
+from .utils import AnyPath
+
+T = TypeVar("T")
+
+# stay well under SQLite's limit on the number of bound parameters
+_MAX_PARAMS = 500
+
+
+class SQLiteCache:
+    """
+    Base class for a cache stored in one table of a SQLite database, keyed by a ``key TEXT PRIMARY KEY`` column.
+
+    The database is opened in WAL mode, so any number of threads and processes can read and write it at once.
+    Subclasses set :attr:`table` and :attr:`columns`, and hold ``self._lock`` whenever they use :meth:`_connection`.
+    """
+
+    table: str
+    """The name of the cache's table."""
+
+    columns: str
+    """The definitions of the table's columns after the key, e.g. ``"value TEXT NOT NULL"``."""
+
+    def __init__(self, path: Optional[AnyPath]):
+        """
+        :param path: The path to the SQLite database (created if it does not exist), or None if the subclass only keeps
+            entries in memory
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        if self.path is None:
+            return
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        if self.path is None:
+            return 0
+        with self._lock:
+            return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _select_many(self, column: str, keys: list[str]) -> dict:
+        """Return key -> the given column, for each of the keys that is in the table."""
+        conn = self._connection()
+        found = {}
+        for start in range(0, len(keys), _MAX_PARAMS):
+            batch = keys[start : start + _MAX_PARAMS]
+            rows = conn.execute(
+                f"SELECT key, {column} FROM {self.table} WHERE key IN ({', '.join('?' * len(batch))})", batch
+            ).fetchall()
+            found.update(rows)
+        return found
+
+    def _connection(self) -> sqlite3.Connection:
+        # a connection can't be shared with a forked child process, so each process opens its own
+        if self._conn is None or self._conn_pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, {self.columns})")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+
+def default_cache(env_var: str, factory: Callable[[], T]) -> Optional[T]:
+    """Return the process-wide default cache made by *factory*, or None if the given env var is set to 0."""
+    if os.getenv(env_var) == "0":
+        return None
+    return factory()
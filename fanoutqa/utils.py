@@ -1,6 +1,7 @@
 import datetime
 import json
 import os
+import tempfile
 from itertools import islice
 from pathlib import Path
 from typing import TypeAlias, Union
@@ -43,6 +44,19 @@ def load_test(fp: AnyPath = None) -> list[TestQuestion]:
     return [TestQuestion.from_dict(d) for d in data]
 
 
+def atomic_write_text(fp: Path, text: str):
+    """Write the text to the given file by writing a temporary file and renaming it, so that concurrent readers (in
+    other threads or processes) never see a partially written file."""
+    fd, tmp_fp = tempfile.mkstemp(dir=fp.parent, prefix=f".{fp.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_fp, fp)
+    except BaseException:
+        os.unlink(tmp_fp)
+        raise
+
+
 def batched(iterable, n):
     # batched('ABCDEFG', 3) --> ABC DEF G
     if n < 1:
@@ -3,20 +3,23 @@
 import functools
 import logging
 import os
+import threading
 import urllib.parse
+from concurrent.futures import Future
 from xml.etree import ElementTree
 
 import httpx
 import pywikibot
 
 from .models import Evidence
-from .utils import CACHE_DIR, DATASET_EPOCH, markdownify
+from .utils import CACHE_DIR, DATASET_EPOCH, atomic_write_text, markdownify
 
 WIKI_CACHE_DIR = CACHE_DIR / "wikicache"
 WIKI_CACHE_DIR.mkdir(exist_ok=True, parents=True)
 PWB_CACHE_DIR = CACHE_DIR / "pywikibot"
 pywikibot.config.base_dir = str(PWB_CACHE_DIR.resolve())
 KIWIX_CACHE_DIR = CACHE_DIR / "kiwix"
+KIWIX_CACHE_DIR.mkdir(exist_ok=True, parents=True)
 
 FANOUTQA_WIKIPEDIA_TYPE = os.getenv("FANOUTQA_WIKIPEDIA_TYPE")
 FANOUTQA_KIWIX_BASE = os.getenv("FANOUTQA_KIWIX_BASE")
@@ -24,8 +27,13 @@ FANOUTQA_KIWIX_ZIMNAME = os.getenv("FANOUTQA_KIWIX_ZIMNAME")
 
 log = logging.getLogger(__name__)
 
+_site = None
+_site_lock = threading.Lock()
+# key -> the result of the request for that key that is currently running, if any (see _single_flight)
+_in_flight: dict[tuple, Future] = {}
+_in_flight_lock = threading.Lock()
+
 
-@functools.cache
 def _get_site():
     """Lazily construct the pywikibot Site.
 
@@ -34,7 +42,38 @@ def _get_site():
     ``FANOUTQA_WIKIPEDIA_TYPE=kiwix``) and any environment that merely
     ``import fanoutqa``. Defer construction until a live code path actually needs it.
     """
-    return pywikibot.Site("en", "wikipedia")
+    global _site
+    with _site_lock:
+        if _site is None:
+            _site = pywikibot.Site("en", "wikipedia")
+    return _site
+
+
+def _single_flight(key: tuple, fn, *args):
+    """
+    Return ``fn(*args)``; if another thread is already running the request for the same key, wait for its result
+    instead of repeating the request. Nothing is locked while the request runs, so requests for different keys never
+    wait for each other.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = _in_flight[key] = Future()
+    if not is_owner:
+        return future.result()
+
+    try:
+        result = fn(*args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
 
 
 # ==== impl ====
@@ -53,8 +92,15 @@ class LazyEvidence(Evidence):
         encoded_title = urllib.parse.quote(self.title)
         return f"https://en.wikipedia.org/wiki/{encoded_title}"
 
-    @functools.cached_property
+    @property
     def revid(self):
+        # only look up the revision once, even if several threads need it at the same time
+        # (LazyEvidence instances are pickled to send them to worker processes, so they can't hold a lock themselves)
+        if not hasattr(self, "_revid"):
+            self._revid = _single_flight(("revid", self.pageid), self._get_revid)
+        return self._revid
+
+    def _get_revid(self):
         req = _get_site().simple_request(
             action="query",
             prop="revisions",
@@ -98,7 +144,7 @@ def _wiki_content_live(doc: Evidence):
 
     # MD it, cache it, and return
     text = markdownify(html)
-    cache_filename.write_text(text, encoding="utf-8")
+    atomic_write_text(cache_filename, text)
     return text
 
 
@@ -149,17 +195,25 @@ def _wiki_content_kiwix(doc: Evidence) -> str:
     resp.read()
 
     text = markdownify(resp.text)
-    cache_filename.write_text(text, encoding="utf-8")
+    atomic_write_text(cache_filename, text)
     return text
 
 
 # ==== entrypoint ====
-@functools.lru_cache()
+# These are safe to call from many threads at once. Pages are cached on disk as they are fetched, and cache files are
+# written atomically, so threads (or processes) fetching the same page at the same time never see a partial file.
 def wiki_search(query: str, results=10) -> list[Evidence]:
     """Return a list of Evidence documents given the search query."""
+    # threads searching for the same query at the same time wait for the first search instead of repeating it, and
+    # return a new list each time, so callers can't modify the cached results
+    return list(_single_flight(("search", query, results), _wiki_search_cached, query, results))
+
+
+@functools.lru_cache()
+def _wiki_search_cached(query: str, results: int) -> tuple[Evidence, ...]:
     if FANOUTQA_WIKIPEDIA_TYPE == "kiwix":
-        return _wiki_search_kiwix(query, results)
-    return _wiki_search_live(query, results)
+        return tuple(_wiki_search_kiwix(query, results))
+    return tuple(_wiki_search_live(query, results))
 
 
 def wiki_content(doc: Evidence) -> str:
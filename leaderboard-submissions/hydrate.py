@@ -10,7 +10,10 @@ from pathlib import Path
 from typing import List, Literal, Optional
 
 import fanoutqa
+from fanoutqa.eval.references import ReferenceArtifacts
 from fanoutqa.eval.scorer import Scorer
+from fanoutqa.models import DevQuestion
+from fanoutqa.norm import set_normalize_cache
 
 # prevent manipulation of results - the results must be generated by this script or else the hash will not match
 LEADERBOARD_SALT = os.getenv("LEADERBOARD_SALT", "supersecret").encode()
@@ -63,6 +66,8 @@ async def hydrate_all():
     """Main entrypoint - ensure all metadata submissions have valid associated results files"""
     exit_code = 0
     written_files = []
+    # the test questions and their reference artifacts are shared by every submission, so only load them once
+    questions = references = None
     # for each submission file,
     for metadata_fp in METADATA_PATH.glob("*.json"):
         # check if it is valid and needs eval
@@ -85,7 +90,17 @@ async def hydrate_all():
         if check_result.metadata.evidenceprovided_generations is not None:
             print(f"Evidence-provided generations path: {EP_PATH / check_result.metadata.evidenceprovided_generations}")
         try:
-            result_fp = await eval_submission(metadata_fp, check_result)
+            if questions is None:
+                questions = fanoutqa.load_dev("fanoutqa-test-answers.json")
+                # the artifacts (and the normalized strings the normalize cache would store) contain the hidden test
+                # answers, so they are only kept in memory, never in ~/.cache/fanoutqa, which CI caches between runs;
+                # scoring only normalizes the submitted answers, so the cache stays on for that
+                previous_cache = set_normalize_cache(None)
+                try:
+                    references = ReferenceArtifacts.build(questions)
+                finally:
+                    set_normalize_cache(previous_cache)
+            result_fp = await eval_submission(metadata_fp, check_result, questions, references)
             written_files.append(result_fp)
         except Exception as e:
             # if invalid, log a check annotation and mark job failure
@@ -151,7 +166,9 @@ def check_submission(metadata_fp: Path) -> CheckResult:
     return CheckResult(metadata_data, True, the_hash)
 
 
-async def eval_submission(metadata_fp: Path, check_result: CheckResult):
+async def eval_submission(
+    metadata_fp: Path, check_result: CheckResult, questions: List[DevQuestion], references: ReferenceArtifacts
+):
     """Read in the answers and generations and eval them all, then write the results file."""
     # dummy = {
     #     "acc": {"loose": 0.0, "strict": 0.0},
@@ -169,12 +186,12 @@ async def eval_submission(metadata_fp: Path, check_result: CheckResult):
     if not re.fullmatch(r"[\w\-]+\.json", metadata_fp.name):
         raise ValueError("Submission filenames must consist only of alphanumeric characters, dashes, and underscores")
 
-    questions = fanoutqa.load_dev("fanoutqa-test-answers.json")
-
     if check_result.metadata.closedbook_generations is not None:
         print("Evaluating closed book answers...")
         closedbook_answers = read_jsonl_answers(CB_PATH / check_result.metadata.closedbook_generations)
-        closedbook_scorer = Scorer(questions, closedbook_answers, llm_cache_key="eval")
+        closedbook_scorer = Scorer(
+            questions, closedbook_answers, llm_cache_key="eval", llm_raise_on_failure=True, references=references
+        )
         closedbook_results = (await closedbook_scorer.score()).to_dict()
     else:
         closedbook_results = None
@@ -182,7 +199,9 @@ async def eval_submission(metadata_fp: Path, check_result: CheckResult):
     if check_result.metadata.openbook_generations is not None:
         print("Evaluating open book answers...")
         openbook_answers = read_jsonl_answers(OB_PATH / check_result.metadata.openbook_generations)
-        openbook_scorer = Scorer(questions, openbook_answers, llm_cache_key="eval")
+        openbook_scorer = Scorer(
+            questions, openbook_answers, llm_cache_key="eval", llm_raise_on_failure=True, references=references
+        )
         openbook_results = (await openbook_scorer.score()).to_dict()
     else:
         openbook_results = None
@@ -190,7 +209,9 @@ async def eval_submission(metadata_fp: Path, check_result: CheckResult):
     if check_result.metadata.evidenceprovided_generations is not None:
         print("Evaluating evidence provided answers...")
         evidenceprovided_answers = read_jsonl_answers(EP_PATH / check_result.metadata.evidenceprovided_generations)
-        evidenceprovided_scorer = Scorer(questions, evidenceprovided_answers, llm_cache_key="eval")
+        evidenceprovided_scorer = Scorer(
+            questions, evidenceprovided_answers, llm_cache_key="eval", llm_raise_on_failure=True, references=references
+        )
         evidenceprovided_results = (await evidenceprovided_scorer.score()).to_dict()
     else:
         evidenceprovided_results = None